@@ -0,0 +1,429 @@
+""" Long-form table of the authors of an ERA sheet, see `AuthorTable`
+
+Names are matched folded, lowercase with mojibake repaired and accents removed,
+see `fold_name`.
+"""
+
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+class AuthorTable(object):
+    """ Long-form table of the authors in the AUTHORS column
+
+    The AUTHORS string of each row is split at ';' into one entry per author, held in
+    `table` as integer and categorical columns:
+
+        * row (int32): Row position in the sheet
+        * position (int16): Position of the author in the row, 0 for the first author
+        * name (category): Normalized (lowercase and stripped) name
+        * repaired (category): Name with mojibake repaired, see `_repair_name`
+        * folded (category): Name with mojibake repaired and accents removed, see `fold_name`
+        * surname, given (category): Name split at a comma, or after the first word
+
+    The words of each folded name are indexed by word, so author queries are array
+    lookups instead of re-splitting the AUTHORS strings, and 'muller' matches 'Müller'
+    and its mojibake 'MÃ¼ller'. `find` ranks surnames similar to a search name with a
+    trigram index over the folded surnames, built on first use.
+
+    Args:
+        authors (`pandas.Series`): AUTHORS column
+    """
+
+    def __init__(self, authors):
+        self.table = self._explode(np.arange(len(authors)), authors)
+        self._build_words()
+
+        # The values read, to find the rows edited since, see `changed_positions`
+        self._index = authors.index
+        self._authors = authors.to_numpy(dtype=object, copy=True)
+
+    def update(self, positions, authors):
+        """ Re-read the authors of the given row positions
+
+        Args:
+            positions (list(int)): Row positions to update
+            authors (`pandas.Series`): AUTHORS values for the positions
+        """
+        kept = self.table[~self.table['row'].isin(positions)]
+        table = pd.concat([kept.astype(object), self._explode(positions, authors).astype(object)])
+        table = table.sort_values(['row', 'position'], kind='stable').reset_index(drop=True)
+
+        self.table = self._as_table(table)
+        self._build_words()
+        self._authors[positions] = authors.to_numpy(dtype=object)
+
+    def changed_positions(self, authors):
+        """ Row positions whose AUTHORS differ from those the table was built from
+
+        Catches edits made in place, e.g. `df.loc[idx, 'AUTHORS'] = ...`, as well as a
+        replaced column. Unchanged values are the same string objects, which compare
+        without reading the strings, so this is cheap next to rebuilding the table.
+
+        Args:
+            authors (`pandas.Series`): AUTHORS column
+
+        Returns:
+            `numpy.ndarray`: Row positions, None if the rows themselves have changed
+        """
+        if len(authors) != len(self._authors) or not authors.index.equals(self._index):
+            return None
+
+        values = authors.to_numpy(dtype=object)
+        changed = values != self._authors
+        if changed.any():
+            # Blank authors are NaN, which never equals itself
+            changed &= ~(pd.isnull(values) & pd.isnull(self._authors))
+
+        return np.flatnonzero(changed)
+
+    def get_rows(self, word):
+        """ Returns sorted row positions with an author containing word
+
+        Args:
+            word (str): Lowercase name word
+
+        Returns:
+            `numpy.ndarray`: Row positions
+        """
+        if word not in self.words:
+            return np.array([], dtype=np.intp)
+
+        code = self.words.get_loc(word)
+        start, end = np.searchsorted(self._word_codes, [code, code + 1])
+
+        return self._word_rows[start:end].astype(np.intp)
+
+    def match(self, search_term):
+        """ Row positions where search_term is a word of the first author containing it
+
+        Only the first author containing search_term is compared, e.g. 'gee' matches
+        'Gee B; McGee A' but not 'McGee A; Gee B', as the first author containing 'gee'
+        is 'mcgee a'. The word is compared folded, so 'Müller', 'muller' and the
+        mojibake 'MÃ¼ller' find the same rows, see `first_authors` for which author
+        of a row is compared.
+
+        Args:
+            search_term (str): Search name as typed
+
+        Returns:
+            `numpy.ndarray`: Sorted row positions
+
+        Example:
+            >>> table = AuthorTable(pd.Series(['JelÃ­nkovÃ¡ D; Li C', 'Jelínková D', 'McGee A; Gee B']))
+            >>> table.match('JelÃ­nkovÃ¡').tolist(), table.match('Jelínková').tolist()
+            ([0, 1], [0, 1])
+            >>> table.match('li').tolist(), table.match('gee').tolist()
+            ([0], [])
+        """
+        search_name = fold_name(search_term)
+        if not search_name or re.search(r'[\s;]', search_name):
+            return np.array([], dtype=np.intp)
+
+        # Entries of the rows where some author has the word
+        entries = self._row_entries(self.get_rows(search_name))
+        rows, first = self.first_authors(entries, search_term)
+
+        has_word = np.isin(self.table['folded'].cat.codes.to_numpy()[first], self._word_names(search_name))
+
+        return rows[has_word].astype(np.intp)
+
+    def first_authors(self, entries, search_term):
+        """ First author containing search_term in each row of entries
+
+        As in the AUTHORS strings, that is the first author whose lowercase name, with
+        mojibake repaired, contains search_term. Rows where no author does fall back to
+        the first author containing it with accents removed, so e.g. 'muller' still
+        finds 'Müller', but 'li' is never claimed by 'Jelínková' ahead of 'Li'.
+
+        Args:
+            entries (`numpy.ndarray`): Sorted table positions, all entries of their rows
+            search_term (str): Search name as typed
+
+        Returns:
+            tuple(`numpy.ndarray`, `numpy.ndarray`): Sorted row positions and the table
+                position of the first author of each
+        """
+        contains = self._contains(entries, 'repaired', _repair_name(search_term))
+        contains_folded = self._contains(entries, 'folded', fold_name(search_term))
+
+        # Authors containing the term as typed come first, then those containing it folded
+        priority = np.where(contains, 0, np.where(contains_folded, 1, 2))
+        entry_rows = self.table['row'].to_numpy()[entries]
+        order = np.lexsort((entries, priority, entry_rows))
+        order = order[priority[order] < 2]
+
+        rows, first = np.unique(entry_rows[order], return_index=True)
+
+        return rows, entries[order[first]]
+
+    def first_author_rows(self, search_name):
+        """ Row positions where search_name is a word of the first author
+
+        Args:
+            search_name (str): Folded search name, see `fold_name`
+
+        Returns:
+            `numpy.ndarray`: Sorted row positions
+        """
+        first = self.table['position'].to_numpy() == 0
+        has_word = np.isin(self.table['folded'].cat.codes.to_numpy(), self._word_names(search_name))
+
+        return self.table['row'].to_numpy()[first & has_word].astype(np.intp)
+
+    def find(self, search_name, limit=10, min_score=0.3):
+        """ Surnames most similar to search_name, for fuzzy and variant lookups
+
+        Similarity is the Dice coefficient of the trigrams of the folded names. Only
+        the surnames sharing a trigram with search_name are scored, found in the
+        trigram index rather than by scanning all names.
+
+        Args:
+            search_name (str): Folded surname, see `fold_name`
+            limit (int, optional): Number of candidates, default 10
+            min_score (float, optional): Lowest score returned, default 0.3
+
+        Returns:
+            `pandas.DataFrame`: surname (folded), score (1 for the same trigrams) and rows
+                (number of rows with an author of that surname), best first
+        """
+        if self._grams is None:
+            self._build_grams()
+
+        grams = _trigrams(search_name)
+        codes = self._grams.get_indexer(list(grams))
+        codes = codes[codes >= 0]
+        starts = np.searchsorted(self._gram_codes, codes)
+        ends = np.searchsorted(self._gram_codes, codes, side='right')
+
+        found = [self._gram_surnames[start:end] for start, end in zip(starts, ends)]
+        ids, shared = np.unique(np.concatenate(found or [np.array([], dtype=np.intp)]), return_counts=True)
+        scores = 2 * shared / (len(grams) + self._surname_grams[ids])
+
+        keep = scores >= min_score
+        ids, scores = ids[keep], scores[keep]
+        order = np.lexsort((-self._surname_rows[ids], -scores))[:limit]
+
+        return pd.DataFrame({
+            'surname': self._surnames[ids[order]],
+            'score': scores[order],
+            'rows': self._surname_rows[ids[order]],
+        })
+
+    def publication_counts(self):
+        """ Number of rows listing each author, blank authors are left out
+
+        Returns:
+            `pandas.Series`: Count per normalized name, largest first
+        """
+        entries = self.table[['row', 'name']].drop_duplicates()
+        entries = entries[~entries['name'].isin(['', 'nan'])]
+        counts = entries.groupby('name', observed=True).size()
+
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def get_author(self, pos, search_term):
+        """ Returns the first author in row pos containing search_term, see `first_authors`
+
+        Args:
+            pos (int): Row position
+            search_term (str): Substring to be used to match full name, as typed
+
+        Returns:
+            `pandas.Series`: Table entry, None if not found
+        """
+        rows, first = self.first_authors(self._row_entries(np.array([pos])), search_term)
+        if not len(first):
+            return None
+
+        return self.table.iloc[first[0]]
+
+    def get_full_name(self, pos, search_term):
+        """ Returns the first name in row pos containing search_term
+
+        Args:
+            pos (int): Row position
+            search_term (str): Substring to be used to match full name, as typed
+
+        Returns:
+            str: Normalized name, empty if not found
+        """
+        author = self.get_author(pos, search_term)
+
+        return '' if author is None else author['name']
+
+    def _explode(self, positions, authors):
+        """ Table entries for the AUTHORS values of positions """
+        names = pd.Series(authors.to_numpy(dtype=object), index=positions).map(str).str.split(';').explode()
+        codes, unique_names = pd.factorize(names.str.strip())
+
+        # Names are parsed once per distinct name, 'Surname, Given' or 'Surname Given'
+        unique_names = pd.Series(unique_names, dtype=object)
+        parts = unique_names.str.extract(r'^(?P<surname>[^,]*?)\s*,\s*(?P<given>.*)$')
+        words = unique_names.str.extract(r'^(?P<surname>\S*)\s*(?P<given>.*)$')
+        has_comma = parts['surname'].notnull().to_numpy()
+
+        def categorical(values):
+            value_codes, categories = pd.factorize(values)
+            return pd.Categorical.from_codes(value_codes[codes], categories)
+
+        return pd.DataFrame({
+            'row': names.index.to_numpy(dtype=np.int32),
+            'position': names.groupby(level=0).cumcount().to_numpy(dtype=np.int16),
+            'name': categorical(unique_names.str.lower()),
+            'repaired': categorical(unique_names.map(_repair_name)),
+            'folded': categorical(unique_names.map(fold_name)),
+            'surname': categorical(np.where(has_comma, parts['surname'], words['surname'])),
+            'given': categorical(np.where(has_comma, parts['given'], words['given'])),
+        })
+
+    def _as_table(self, table):
+        return table.astype({
+            'row': np.int32,
+            'position': np.int16,
+            'name': 'category',
+            'repaired': 'category',
+            'folded': 'category',
+            'surname': 'category',
+            'given': 'category',
+        })
+
+    def _build_words(self):
+        """ Index the words of each folded name, sorted by word code then row """
+        self._grams = None
+        categories = self.table['folded'].cat.categories
+        name_words = pd.Series(categories, dtype=object).str.split().explode().dropna()
+
+        word_codes, self.words = pd.factorize(name_words)
+        name_codes = name_words.index.to_numpy()
+
+        # Names of each word, sorted by word code
+        order = np.argsort(word_codes, kind='stable')
+        self._name_word_codes = word_codes[order]
+        self._name_word_names = name_codes[order]
+
+        # Rows of each word
+        pairs = pd.DataFrame({
+            'row': self.table['row'].to_numpy(),
+            'name': self.table['folded'].cat.codes.to_numpy(),
+        }).merge(pd.DataFrame({'name': name_codes, 'word': word_codes}), on='name')
+        pairs = pairs[['word', 'row']].drop_duplicates().sort_values(['word', 'row'])
+
+        self._word_codes = pairs['word'].to_numpy(dtype=np.int32)
+        self._word_rows = pairs['row'].to_numpy(dtype=np.int32)
+
+    def _word_names(self, word):
+        """ Folded name codes of the names with word """
+        if word not in self.words:
+            return np.array([], dtype=np.intp)
+
+        code = self.words.get_loc(word)
+        start, end = np.searchsorted(self._name_word_codes, [code, code + 1])
+
+        return self._name_word_names[start:end]
+
+    def _build_grams(self):
+        """ Index the trigrams of each folded surname, sorted by trigram code """
+        surname_ids, self._surnames = pd.factorize(self.table['surname'].cat.categories.map(fold_name))
+
+        # Rows with an author of each folded surname
+        entries = pd.DataFrame({
+            'row': self.table['row'].to_numpy(),
+            'surname': surname_ids[self.table['surname'].cat.codes.to_numpy()],
+        }).drop_duplicates()
+        self._surname_rows = np.bincount(entries['surname'], minlength=len(self._surnames))
+
+        surname_grams = pd.Series([sorted(_trigrams(surname)) for surname in self._surnames], dtype=object)
+        self._surname_grams = surname_grams.map(len).to_numpy()
+
+        grams = surname_grams.explode().dropna()
+        gram_codes, self._grams = pd.factorize(grams)
+        order = np.argsort(gram_codes, kind='stable')
+        self._gram_codes = gram_codes[order]
+        self._gram_surnames = grams.index.to_numpy()[order]
+
+    def _contains(self, entries, column, substring):
+        """ Whether the column value of each of entries contains substring, tested once per value """
+        codes, inverse = np.unique(self.table[column].cat.codes.to_numpy()[entries], return_inverse=True)
+        contains = self.table[column].cat.categories[codes].str.contains(substring, regex=False)
+
+        return np.asarray(contains, dtype=bool)[inverse]
+
+    def _row_entries(self, rows):
+        """ Table positions of all entries of the sorted rows """
+        row_values = self.table['row'].to_numpy()
+        starts = np.searchsorted(row_values, rows)
+        ends = np.searchsorted(row_values, rows, side='right')
+
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+        return offsets + np.arange(lengths.sum())
+
+
+# Letters that NFKD doesn't split into an ASCII letter and accents
+FOLD_LETTERS = str.maketrans({'ß': 'ss', 'æ': 'ae', 'œ': 'oe', 'ø': 'o', 'ł': 'l', 'đ': 'd', 'ð': 'd', 'þ': 'th'})
+
+
+def _repair_name(name):
+    """ Lowercase name with mojibake repaired, e.g. 'JelÃ­nkovÃ¡' -> 'jelínková'
+
+    Mojibake is repaired before lowercasing, which would change the characters it is made of.
+
+    Args:
+        name (str): Name or search term
+
+    Returns:
+        str: Repaired name
+    """
+    return _repair_mojibake(str(name).strip()).lower()
+
+
+def fold_name(name):
+    """ Lowercase name with mojibake repaired and accents removed
+
+    e.g. 'JelÃ­nkovÃ¡', 'Jelínková' and 'jelinkova' all fold to 'jelinkova'
+
+    Args:
+        name (str): Name or search term
+
+    Returns:
+        str: Folded name
+    """
+    name = _repair_name(name).translate(FOLD_LETTERS)
+    if name.isascii():
+        return name
+
+    return ''.join(char for char in unicodedata.normalize('NFKD', name) if not unicodedata.combining(char))
+
+
+def _repair_mojibake(text):
+    """ Undo UTF-8 that was decoded as cp1252 or latin-1, up to twice, e.g. 'MÃ¼ller' -> 'Müller' """
+    for _ in range(2):
+        if text.isascii():
+            break
+
+        try:
+            text = b''.join(_cp1252_encode(char) for char in text).decode('utf-8')
+        except UnicodeError:
+            # Not mojibake, e.g. 'Müller' is not valid UTF-8 as cp1252
+            break
+
+    return text
+
+
+def _cp1252_encode(char):
+    """ Byte of char in cp1252, or latin-1 for the bytes cp1252 leaves undefined """
+    try:
+        return char.encode('cp1252')
+    except UnicodeEncodeError:
+        return char.encode('latin-1')
+
+
+def _trigrams(word):
+    """ Set of the trigrams of word, padded so short words and word starts count """
+    padded = '  {} '.format(word)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
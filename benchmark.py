@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+""" Time the main EraFixer operations on synthetic workbooks
+
+Each operation runs on a freshly loaded copy of the workbook (from the
+`SheetCache`, so loading stays cheap) and is timed without and then with
+`tracemalloc` for its peak memory. Results can be written to a JSON file and
+compared against an earlier one to see regressions, including an operation
+leaving a different sheet behind, see `frame_sha1`.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import synthetic
+from erafixer import COL_LOOKUP, EraFixer
+
+
+def _get_matching_rows(fixer, workdir):
+    fixer.get_matching_rows('smith', COL_LOOKUP['author'])
+    fixer.get_matching_rows('optics', COL_LOOKUP['journal'])
+
+
+def _set_author_discipline(fixer, workdir):
+    fixer.set_author_discipline('gee', 'astro')
+
+
+def _set_forc_string(fixer, workdir):
+    fixer.set_forc_string('0201:60,0206:40', author='steel')
+    fixer.set_forc_string('0299', justify_string='0201', journal='astrophysical')
+
+
+def _carry_forward_forcs(fixer, workdir):
+    fixer.carry_forward_forcs()
+
+
+# Splits, merges and retires some of the synthetic codes, see `erafixer.load_concordance`
+CONCORDANCE = [
+    {'old': '0202', 'new': '0201', 'weight': 1.0},
+    {'old': '0202', 'new': '0203', 'weight': 1.0},
+    {'old': '0299', 'new': '0206', 'weight': None},
+    {'old': '0404', 'new': None, 'weight': None},
+    {'old': '1001', 'new': '4601', 'weight': None},
+]
+
+
+def _apply_concordance(fixer, workdir):
+    fixer.carry_forward_forcs()
+    fixer.apply_concordance(CONCORDANCE)
+
+
+def _split_disciplines(fixer, workdir):
+    fixer.set_journal_discipline('astro', 'astro')
+    fixer.set_journal_discipline('optic', 'photonics')
+    fixer.split_disciplines(os.path.join(workdir, 'split'))
+
+
+def _save(fixer, workdir):
+    fixer.carry_forward_forcs()
+    fixer.save()
+
+
+def _save_incremental(fixer, workdir):
+    fixer.set_author_discipline('gee', 'astro')
+    fixer.save(incremental=True)
+
+
+# Operation name to a function of (fixer, workdir)
+OPERATIONS = {
+    'get_matching_rows': _get_matching_rows,
+    'set_author_discipline': _set_author_discipline,
+    'set_forc_string': _set_forc_string,
+    'carry_forward_forcs': _carry_forward_forcs,
+    'apply_concordance': _apply_concordance,
+    'split_disciplines': _split_disciplines,
+    'save': _save,
+    'save_incremental': _save_incremental,
+}
+
+
+def run(rows, operations=None, workdir=None, memory=True):
+    """ Benchmark the operations on a synthetic workbook of rows rows
+
+    Args:
+        rows (int): Number of rows
+        operations (list(str), optional): Names from `OPERATIONS`, default all
+        workdir (str, optional): Directory for workbooks, kept between runs so each
+            size is only generated once, default a temporary directory
+        memory (bool, optional): Also measure peak memory, default True
+
+    Returns:
+        list(dict): One result per operation with rows, seconds, rows_per_second, peak_mb
+            and the sha1 of the sheet it left, see `frame_sha1`
+    """
+    operations = operations or list(OPERATIONS)
+    keep_workdir = workdir is not None
+    if keep_workdir:
+        os.makedirs(workdir, exist_ok=True)
+    else:
+        workdir = tempfile.mkdtemp(prefix='erafixer_benchmark_')
+
+    source = os.path.join(workdir, 'synthetic_{}.xlsx'.format(rows))
+    if not os.path.exists(source):
+        synthetic.make_workbook(source, rows)
+
+    fn = os.path.join(workdir, 'work_{}.xlsx'.format(rows))
+    shutil.copy(source, fn)
+
+    results = list()
+    state = dict()
+
+    def load():
+        state['fixer'] = EraFixer(fn, sheet_index=1)
+
+    def frame():
+        return state['fixer'].df
+
+    _measure(results, 'load', rows, memory, load, frame=frame)
+
+    # Later loads come from the cache, written by the first one
+    def reset():
+        shutil.copy(source, fn)
+        state['fixer'] = EraFixer(fn, sheet_index=1, cache=True)
+
+    for name in operations:
+        def operation():
+            OPERATIONS[name](state['fixer'], workdir)
+
+        _measure(results, name, rows, memory, operation, reset, frame)
+
+    if not keep_workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """ Compare results against baseline results
+
+    Args:
+        results (list(dict)): Output of `run`
+        baseline (list(dict)): Earlier output of `run`
+        tolerance (float, optional): Allowed slowdown or memory growth as a fraction, default 0.2
+
+    Returns:
+        list(str): Description of each regression, a changed sheet is one whatever the timings
+    """
+    previous = {(result['operation'], result['rows']): result for result in baseline}
+
+    regressions = list()
+    for result in results:
+        before = previous.get((result['operation'], result['rows']))
+        if before is None:
+            continue
+
+        if result.get('sha1') and before.get('sha1') and result['sha1'] != before['sha1']:
+            regressions.append("{} ({} rows): sheet changed, sha1 {} -> {}".format(
+                result['operation'], result['rows'], before['sha1'][:8], result['sha1'][:8]))
+
+        for key in ['seconds', 'peak_mb']:
+            if result.get(key) is None or not before.get(key):
+                continue
+
+            change = result[key] / before[key] - 1
+            if change > tolerance:
+                regressions.append("{} ({} rows): {} {:.3g} -> {:.3g} (+{:.0%})".format(
+                    result['operation'], result['rows'], key, before[key], result[key], change))
+
+    return regressions
+
+
+def print_results(results):
+    """ Print a table of results from `run` """
+    print("{:<24} {:>9} {:>10} {:>14} {:>10}".format('operation', 'rows', 'seconds', 'rows/second', 'peak MB'))
+    for result in results:
+        peak = '' if result['peak_mb'] is None else '{:.1f}'.format(result['peak_mb'])
+        print("{:<24} {:>9} {:>10.3f} {:>14.0f} {:>10}".format(
+            result['operation'], result['rows'], result['seconds'], result['rows_per_second'], peak))
+
+
+def frame_sha1(df):
+    """ SHA-1 of the columns, index and values of df
+
+    Args:
+        df (`pandas.DataFrame`): Sheet
+
+    Returns:
+        str: Hex digest
+
+    Example:
+        >>> df = pd.DataFrame({'FOR1': ['0201', 201, None]})
+        >>> frame_sha1(df) == frame_sha1(df.copy()), frame_sha1(df) == frame_sha1(df.iloc[:2])
+        (True, False)
+    """
+    digest = hashlib.sha1(json.dumps([str(col) for col in df.columns]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _measure(results, name, rows, memory, operation, reset=None, frame=None):
+    """ Time operation, then run it again under tracemalloc, appending the result
+
+    frame returns the sheet the timed run left, for its `frame_sha1`.
+    """
+    if reset is not None:
+        reset()
+
+    start = time.perf_counter()
+    value = operation()
+    seconds = time.perf_counter() - start
+    sha1 = None if frame is None else frame_sha1(frame())
+
+    peak_mb = None
+    if memory:
+        if reset is not None:
+            reset()
+
+        tracemalloc.start()
+        try:
+            operation()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+
+    results.append({
+        'operation': name,
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds else None,
+        'peak_mb': peak_mb,
+        'sha1': sha1,
+    })
+
+    return value
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    import warnings
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark EraFixer operations on synthetic workbooks")
+    parser.add_argument('rows', nargs='*', type=int, default=synthetic.SIZES[:3],
+                        help='Workbook sizes, default {}'.format(' '.join(str(size) for size in synthetic.SIZES[:3])))
+    parser.add_argument('--operations', nargs='+', choices=list(OPERATIONS),
+                        help='Operations to run, default all')
+    parser.add_argument('--workdir',
+                        help='Directory for the synthetic workbooks, kept so they are only generated once')
+    parser.add_argument('--no_memory', action='store_true', default=False,
+                        help="Don't measure peak memory, which runs every operation twice")
+    parser.add_argument('--output',
+                        help='Write the results to this JSON file')
+    parser.add_argument('--baseline',
+                        help='Compare against the results in this JSON file, exits with 1 on regressions')
+    parser.add_argument('--tolerance', default=0.2, type=float,
+                        help='Allowed slowdown or memory growth against the baseline, default 0.2')
+
+    args = parser.parse_args()
+
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error("Baseline file does not exist")
+
+    # Keep the output readable, the workbooks hold mixed types on purpose
+    warnings.filterwarnings('ignore', message=r'Columns \(.*\) have mixed types', category=pd.errors.DtypeWarning)
+
+    results = list()
+    for rows in args.rows:
+        results.extend(run(rows, args.operations, workdir=args.workdir, memory=not args.no_memory))
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), tolerance=args.tolerance)
+
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+
+        if regressions:
+            sys.exit(1)
@@ -6,8 +6,13 @@ def show_matches(erafixer, row_match, author):
         df_row = erafixer.df.iloc[row_idx]
 
         if i == 0:
-            out += "<dt>Full Name</dt><dd>" + \
-                erafixer.get_full_name(df_row['AUTHORS'], author).title() + '</dd>'
+            author_entry = erafixer.get_author(df_row.name, author)
+            if author_entry is not None:
+                out += "<dt>Full Name</dt><dd>" + author_entry['name'].title() + '</dd>'
+                out += "<dt>Surname</dt><dd>" + author_entry['surname'] + '</dd>'
+                out += "<dt>Given</dt><dd>" + author_entry['given'] + '</dd>'
+            else:
+                out += "<dt>Full Name</dt><dd></dd>"
             out += "<dt>&nbsp;</dt><dd>&nbsp;</dd>"
             
         out += "<dt>Authors:</dt><dd>" +  df_row['AUTHORS'] + "</dd>"
@@ -1,11 +1,32 @@
 #!/usr/bin/env python
 
+import atexit
+import contextlib
+import functools
+import json
 import os
+import shutil
 import sys
+import threading
+import time
+import weakref
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
 import numpy as np
 import pandas as pd
+from pandas.io.parsers import TextParser
 import re
 
+import session
+import shared_store
+import xlsx_patch
+from author_table import AuthorTable, fold_name
+from keyword_matcher import KeywordMatcher
+from operation_log import OperationLog
+from profiling import Profile
+from sheet_cache import SheetCache, decode_frame, encode_frame, file_sha1
+from summary import Summary, print_summary
+
 PHYSASTRO = ['quantum', 'astro', 'photonics', 'biophotonics']
 COL_LOOKUP = {
     'author': 'AUTHORS',
@@ -30,12 +51,252 @@ COL_LOOKUP = {
 }
 
 
+# Column types cleaned after parsing. HANDLED holds one of the states 0 (unhandled),
+# 1, 2 (carried forward), 3 (ambiguous concordance), 4 (concordance applied), 99 (ClawbackNeeded)
+# or -1 (confused). Blank states are read as 0, a sheet with other unreadable states is refused.
+COL_DTYPES = {
+    'ERA_18_FOR4_ClawBack_Justify': 'object',
+    'ARCFORC': 'object',
+    'Staff_Comments': 'object',
+    'Category': 'object',
+    'ARIS_UPDATED': 'object',
+    'YEAR': 'int64',
+    'DEPARTMENT': 'object',
+    'First_MQ_Authors_Faculty': 'object',
+    'AUTHORS': 'object',
+    'TITLE': 'object',
+    'PUBLISHER': 'object',
+    'PARENT_DOC': 'object',
+    'EDITOR': 'object',
+    'VOL': 'object',
+    'NUMB': 'object',
+    'EDITION': 'object',
+    'START_PAGE': 'object',
+    'END_PAGE': 'object',
+    'PLACE': 'object',
+    'ISSBN': 'object',
+    'DOI': 'object',
+    'HANDLED': 'int8',
+    'DISCIPLINE': 'category',
+}
+
+# Columns EraFixer reads or writes, the only ones parsed in low memory mode
+WORKING_COLUMNS = list(COL_LOOKUP.values()) + \
+    [col for col in list(COL_DTYPES) + ['FORC_STRING'] if col not in COL_LOOKUP.values()]
+
+
+# Columns the operations change, the writable columns of a `shared_store.SharedStore`
+STORE_COLUMNS = ['HANDLED', 'DISCIPLINE', 'FORC_STRING'] + \
+    [COL_LOOKUP[key] for key in COL_LOOKUP if key.endswith('_e18')] + [COL_LOOKUP['clawback']]
+
+
+# Keys of the FOR code and percentage columns in COL_LOOKUP
+FOR_CODE_KEYS = [key for key in COL_LOOKUP if re.match(r'for\d_e\d\d$', key)]
+FOR_PERC_KEYS = [key for key in COL_LOOKUP if re.match(r'for\dperc_e\d\d$', key)]
+
+
 forc_re = re.compile('''
     (?P<code1>\d{2,4}):?(?P<code1_perc>\d{2})?,?
     (?P<code2>\d{2,4})?:?(?P<code2_perc>\d{2})?,?
     (?P<code3>\d{2,4})?:?(?P<code3_perc>\d{2})?,?
 ''', re.X)
 
+# forc_re matching at the start only, as `re.match` does
+_forc_anchored_re = re.compile('^' + forc_re.pattern, re.X)
+
+# Columns of a parsed FORC_STRING, see `parse_forc_strings`
+FORC_COLUMNS = ['code1', 'code1_perc', 'code2', 'code2_perc', 'code3', 'code3_perc']
+
+
+def parse_forc_strings(forc_strings):
+    """Parse many FORC_STRINGs at once, e.g. the FORC_STRING column
+
+    Each distinct string is only parsed once. Missing percentages are completed
+    the same way for every string: no percentages means 100% for code 1, with two
+    codes code 2 gets the rest, with three codes code 3 gets the rest.
+
+    Args:
+        forc_strings (`pandas.Series`): FORC_STRINGs, e.g. '0201:40,0203'
+
+    Returns:
+        `pandas.DataFrame`: code1, code1_perc, code2, code2_perc, code3, code3_perc and
+            error for each string, with the index of forc_strings. Codes are NaN if not
+            given, error is None for valid and blank strings and the reason otherwise
+    """
+    codes, strings = pd.factorize(forc_strings)
+    parsed = pd.Series(strings, dtype=object).map(str).str.extract(_forc_anchored_re)
+    p1, p2, p3 = [pd.to_numeric(parsed[col]).fillna(0).to_numpy(dtype=float)
+                  for col in ['code1_perc', 'code2_perc', 'code3_perc']]
+
+    # Complete the missing percentages
+    p1 = np.where((p1 == 0) & (p2 == 0) & (p3 == 0), 100., p1)
+    below = p1 < 100
+    p2 = np.where(below & (p2 == 0) & parsed['code3'].isnull().to_numpy(), 100 - p1, p2)
+    p3 = np.where(below & (p1 + p2 < 100) & (p3 == 0), 100 - p1 - p2, p3)
+
+    result = pd.DataFrame({
+        'code1': parsed['code1'], 'code1_perc': p1,
+        'code2': parsed['code2'], 'code2_perc': p2,
+        'code3': parsed['code3'], 'code3_perc': p3,
+    }).astype(object)
+
+    invalid = parsed['code1'].isnull().to_numpy()
+    bad_sum = ~invalid & (p1 + p2 + p3 != 100)
+    error = np.where(invalid, "FORC_STRING not valid", np.where(bad_sum, "Percentages don't add to 100", None))
+    result.loc[invalid | bad_sum, FORC_COLUMNS] = np.nan
+
+    # Blank strings have code -1 and pick the appended blank entry
+    result.loc[len(result)] = np.nan
+    result = result.iloc[codes]
+    result.index = forc_strings.index
+    result['error'] = pd.Series(np.append(error, None).astype(object)[codes], index=result.index, dtype=object)
+
+    return result
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_forc(forc_string):
+    """ Parse a single FORC_STRING, see `parse_forc_strings`
+
+    Returns:
+        tuple: code1, code1_perc, code2, code2_perc, code3, code3_perc, with None for
+            codes not given
+
+    Raises:
+        Exception: The FORC_STRING is not valid or the percentages don't add to 100
+    """
+    row = parse_forc_strings(pd.Series([forc_string], dtype=object)).iloc[0]
+    if row['error'] is not None:
+        raise Exception(row['error'])
+
+    return tuple(None if pd.isnull(value) else value for value in row.iloc[:6])
+
+
+def _canonical_code(code):
+    """ Canonical FOR code for a cell holding a float, string or blank
+
+    Numeric codes are zero-padded to 2 or 4 digits, e.g. 201.0 -> '0201' and 2 -> '02'.
+    Anything else (e.g. 'MD') is kept as a stripped string.
+
+    Args:
+        code: Cell value
+
+    Returns:
+        str: Canonical code, NaN if blank
+    """
+    if isinstance(code, (int, float, np.number)) and not isinstance(code, bool):
+        if np.isnan(code):
+            return np.nan
+
+        if float(code).is_integer():
+            code = int(code)
+
+    code = str(code).strip()
+    if re.match(r'\d+\.0*$', code):
+        code = code.split('.')[0]
+
+    if code in ['', 'nan', 'None']:
+        return np.nan
+
+    if code.isdigit() and len(code) < 4:
+        code = code.zfill(2 if len(code) <= 2 else 4)
+
+    return code
+
+
+def _canonical_codes(codes):
+    """ Canonical FOR codes for a column, see `_canonical_code`
+
+    Args:
+        codes (`pandas.Series`): FOR code column as parsed from the spreadsheet
+
+    Returns:
+        `pandas.Series`: Categorical column of canonical codes
+    """
+    lookup = {code: _canonical_code(code) for code in codes.dropna().unique()}
+    return codes.map(lookup).astype('category')
+
+
+def _percentages(percs):
+    """ Parse a column of FOR percentages as float32, NaN if blank or not a number """
+    return pd.to_numeric(percs, errors='coerce').astype('float32')
+
+
+def _code_startswith(code, codes):
+    """ Check if code is given and starts with each of codes, blank codes always match
+
+    The check is done once per category as an integer range check, e.g. '0206'
+    starts with '02' because 206 // 10**2 == 2.
+
+    Args:
+        code (str): Requested code, may be None
+        codes (`pandas.Series`): Categorical column of canonical codes
+
+    Returns:
+        `numpy.ndarray`: Boolean array with one entry per row
+    """
+    if code is None or code == '':
+        return np.zeros(len(codes), dtype=bool)
+
+    categories = codes.cat.categories.astype(str)
+    widths = categories.str.len().to_numpy()
+    values = pd.to_numeric(pd.Series(categories), errors='coerce').to_numpy()
+
+    shift = len(code) - widths
+    with np.errstate(invalid='ignore'):
+        starts = (categories.str.isdigit() & (shift >= 0) &
+                  (int(code) // 10 ** np.clip(shift, 0, None) == values))
+
+    # Blanks have category code -1, which picks the appended value
+    return np.append(np.asarray(starts, dtype=bool), True)[codes.cat.codes.to_numpy()]
+
+
+def _code_equals(code, codes):
+    """ Check if each of codes is equal to code, blanks never match
+
+    Args:
+        code (str): Requested code, may be None
+        codes (`pandas.Series`): Categorical column of canonical codes
+
+    Returns:
+        `numpy.ndarray`: Boolean array with one entry per row
+    """
+    if code is None or code not in codes.cat.categories:
+        return np.zeros(len(codes), dtype=bool)
+
+    return codes.cat.codes.to_numpy() == codes.cat.categories.get_loc(code)
+
+
+def _code_contains(substring, codes):
+    """ Check if each of codes contains substring, e.g. 'MD'
+
+    Args:
+        substring (str): Substring to look for
+        codes (`pandas.Series`): Categorical column of canonical codes
+
+    Returns:
+        `numpy.ndarray`: Boolean array with one entry per row
+    """
+    contains = codes.cat.categories.astype(str).str.contains(substring, regex=False)
+    # Blanks have category code -1, which picks the appended value
+    return np.append(np.asarray(contains, dtype=bool), False)[codes.cat.codes.to_numpy()]
+
+
+def _profiled(name):
+    """ Decorator timing an `EraFixer` method as the phase name when profiling """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.profile is None:
+                return method(self, *args, **kwargs)
+
+            with self.profile.phase(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
 
 def main(ERAFILE,
          author=None,
@@ -44,63 +305,349 @@ def main(ERAFILE,
          split_disciplines=False,
          prefix=None,
          carry_forward_forcs=False,
+         concordance=None,
          forc_string=None,
          justify_string=None,
          sheet_index=None,
+         rules=None,
+         journals=None,
+         cache=False,
+         incremental=False,
+         workers=None,
+         low_memory=False,
+         profile=None,
+         serve=None,
+         flush_interval=60,
+         connect=None,
+         flush=False,
+         shutdown=False,
+         oplog=False,
+         materialize=False,
+         undo=False,
+         history=False,
+         replay=None,
+         dry_run=False,
+         store=False,
+         export=False,
+         summary=False,
+         workbooks=None,
          verbose=False,
          debug=False,
          *args, **kwargs
          ):
     """ Creates a EraFixer object and decides which method to call based on input params """
 
-    erafixer = EraFixer(fn=ERAFILE, sheet_index=sheet_index, verbose=verbose, debug=debug)
+    if connect:
+        # Send the command to a running session instead, which also answers with its summary on --summary
+        request = {'fn': ERAFILE, 'summary': summary}
+        if (author and discipline) or (journal and discipline) or forc_string:
+            request.update(command='rule', author=author, journal=journal, discipline=discipline,
+                           forc_string=forc_string, justify_string=justify_string)
+        elif carry_forward_forcs:
+            request.update(command='carry_forward_forcs')
+        elif split_disciplines:
+            request.update(command='split_disciplines', prefix=prefix, workers=workers)
+        elif shutdown:
+            request.update(command='shutdown')
+        elif flush:
+            request.update(command='save')
+        elif summary:
+            request.update(command='summary', summary=False)
+
+        response = session.send(connect, request)
+        if not response.pop('ok'):
+            print("Session error: {}".format(response['error']))
+            sys.exit(1)
 
-    if (author and discipline):
-        erafixer.set_author_discipline(author, discipline)
-        erafixer.save()
-    elif (journal and discipline):
-        erafixer.set_journal_discipline(journal, discipline)
-        erafixer.save()
-    elif split_disciplines:
-        erafixer.split_disciplines(prefix)
-    elif carry_forward_forcs:
-        erafixer.carry_forward_forcs()
-        erafixer.save()
-    elif forc_string:
-        erafixer.set_forc_string(forc_string, justify_string=justify_string, author=author, journal=journal)
-        erafixer.save()
+        if request.get('command') == 'summary':
+            print_summary(response)
+            return
 
+        report = response.pop('summary', None)
+        for key, value in response.items():
+            print("{}: {}".format(key, value))
+        if report is not None:
+            print_summary(report)
+        return
+
+    if workbooks:
+        rule_list = load_rules(rules)
+        results = apply_rules_to_workbooks(workbooks, rule_list, workers=workers, incremental=incremental,
+                                           sheet_index=sheet_index, cache=cache, low_memory=low_memory,
+                                           verbose=verbose, debug=debug)
+        print_workbook_results(results, rule_list)
+        if any(result['error'] for result in results):
+            sys.exit(1)
+        return
+    elif history:
+        print_history(OperationLog(ERAFILE))
+        return
+    elif replay:
+        replay_log(ERAFILE, replay[0], replay[1], verbose=verbose, debug=debug)
+        return
+
+    # Keep stdout for the responses of a session served on stdin/stdout
+    output = contextlib.redirect_stdout(sys.stderr) if serve == '-' else contextlib.nullcontext()
+    with output:
+        erafixer = EraFixer(fn=ERAFILE, sheet_index=sheet_index, cache=cache, low_memory=low_memory,
+                            profile=bool(profile), oplog=oplog or materialize or undo, store=store,
+                            verbose=verbose, debug=debug)
+
+    def save():
+        # With an operation log the workbook is only written on --materialize, with a shared
+        # store on --export and never on --dry_run
+        if not (oplog or undo or store or dry_run) or materialize or export:
+            erafixer.save(incremental=incremental)
+
+    with erafixer.dry_run() if dry_run else contextlib.nullcontext() as report:
+        if serve:
+            session.serve(session.Session(erafixer, flush_interval=flush_interval, incremental=incremental), serve)
+        elif rules:
+            results = erafixer.apply_rules(load_rules(rules))
+            save()
+            print_rule_results(results)
+        elif journals:
+            assigned, conflicts = erafixer.set_journal_disciplines(load_journal_list(journals))
+            save()
+            print_journal_results(assigned, conflicts)
+        elif (author and discipline):
+            erafixer.set_author_discipline(author, discipline)
+            save()
+        elif (journal and discipline):
+            erafixer.set_journal_discipline(journal, discipline)
+            save()
+        elif split_disciplines:
+            erafixer.split_disciplines(prefix, workers=workers)
+        elif carry_forward_forcs or concordance:
+            if carry_forward_forcs:
+                erafixer.carry_forward_forcs()
+            if concordance:
+                result = erafixer.apply_concordance(load_concordance(concordance))
+            save()
+            if concordance:
+                print_concordance_results(result)
+        elif forc_string:
+            erafixer.set_forc_string(forc_string, justify_string=justify_string, author=author, journal=journal)
+            save()
+        elif undo:
+            erafixer.undo()
+            save()
+        elif materialize:
+            erafixer.save(incremental=incremental)
+        elif export:
+            erafixer.save()
+
+    if dry_run:
+        print_dry_run(report)
+
+    if summary:
+        print_summary(erafixer.get_summary().report())
+
+    if profile:
+        write_profile(erafixer, profile)
 
-class EraFixer(object):
-    """ ERA Fixer class """
 
-    def __init__(self, fn=None, sheet_index=None, verbose=False, debug=False):
+class EraFixer(object):
+    """ ERA Fixer class
+
+    Args:
+        fn (str): Excel file name
+        sheet_index (int, optional): Sheet to use, prompts if not given and more than one sheet
+        cache (bool, optional): Keep a `SheetCache` next to the workbook to skip parsing
+            the workbook when it hasn't changed, default False
+        low_memory (bool, optional): Stream the sheet and only keep `WORKING_COLUMNS`, the
+            other columns are left untouched in the workbook on save, default False
+        profile (bool, optional): Record phase timings in `self.profile`, default False
+        oplog (bool, optional): Record every change in an `OperationLog` next to the workbook
+            and replay the logged operations that haven't been saved yet, default False
+        store (bool, optional): Work on a `shared_store.SharedStore` next to the workbook,
+            shared with other processes, created from the workbook if it doesn't exist.
+            Changes are written to the store as they are made and `save` exports the
+            store to the workbook, default False
+        verbose (bool, optional): Show some output, default False
+        debug (bool, optional): Show lots of output, default False
+    """
+
+    def __init__(self, fn=None, sheet_index=None, cache=False, low_memory=False, profile=False, oplog=False,
+                 store=False, verbose=False, debug=False):
         assert os.path.exists(fn)
+        if store and (low_memory or oplog):
+            raise Exception("A shared store can't be combined with low memory mode or an operation log")
+
         self.verbose = verbose
         self.debug = debug
+        self.profile = Profile() if profile else None
 
         self.sheet_index = 0
         self.fn = fn
+        self.cache = SheetCache(fn) if cache else None
+        self.low_memory = low_memory
         self.xls = None
+        self.sheet_names = None
         self.df = None
+        self._other_sheets = dict()
+        self.author_table = None
+        self._parsed_forcs = None
+        self._normalized_forcs = None
+        self.dirty = defaultdict(set)
+        self._sheet_columns = None
+        self._sheet_rows = None
+        self._sheet_layout = None
+        self.oplog = None
+        self.store = shared_store.SharedStore(fn + '.store') if store else None
+        self._recorders = list()
+        self._dry_run = False
+        self._save_lock = threading.Lock()
+        self._save_executor = None
+        self._queued_save = None
+        self._save_future = None
+        self._async_incremental = False
+        self._summary = None
         self.sheet_index = sheet_index
 
         self._parse_excel()
 
+        if oplog:
+            self._open_oplog()
+
+    def apply_rule(self, author=None, journal=None, discipline=None, forc_string=None, justify_string=None):
+        """Apply a single rule, choosing the method the same way as the command line
+
+        Args:
+            author (str, optional): Author to be matched
+            journal (str, optional): Journal to be matched
+            discipline (str, optional): Discipline to be set for author or journal
+            forc_string (str, optional): FORC_STRING to be applied
+            justify_string (str, optional): Justification string for `forc_string`
+
+        Returns:
+            list: List of matching indices, None if the rule has nothing to do
+        """
+        if (author and discipline):
+            return self.set_author_discipline(author, discipline)
+        elif (journal and discipline):
+            return self.set_journal_discipline(journal, discipline)
+        elif forc_string:
+            return self.set_forc_string(forc_string, justify_string=justify_string, author=author, journal=journal)
+
+    @_profiled('apply_rules')
+    def apply_rules(self, rules):
+        """Apply a list of rules in order without saving
+
+        Each rule gives the same result as running the corresponding command on its own,
+        see `load_rules` for the rule format.
+
+        Args:
+            rules (list(dict)): Rules with keys matching the arguments of `apply_rule`
+
+        Returns:
+            list(dict): The rules, each with the number of matching rows added as 'matches'
+                and the reason a rule was skipped as 'error'
+        """
+        # All FORC_STRINGs are checked up front, a rule with an invalid one is skipped
+        forc_strings = pd.Series([rule.get('forc_string') for rule in rules], dtype=object)
+        errors = parse_forc_strings(forc_strings)['error'].tolist() if rules else list()
+
+        results = list()
+        for rule, error in zip(rules, errors):
+            result = dict(rule)
+            if error is not None:
+                self._print("Skipping rule {}: {}", rule, error)
+                result['error'] = error
+                matching_indices = None
+            else:
+                matching_indices = self.apply_rule(**rule)
+                if matching_indices is None:
+                    self._print("Nothing to do for rule {}", rule)
+
+            result['matches'] = len(matching_indices or [])
+            results.append(result)
+
+        return results
+
     def set_author_discipline(self, search_term, disc):
         """ Thin-wrapper around `set_discipline` with author column name
 
         See docstring for `set_discipline`
          """
-        self.set_discipline(search_term, disc, COL_LOOKUP['author'])
+        return self.set_discipline(search_term, disc, COL_LOOKUP['author'])
 
     def set_journal_discipline(self, search_term, disc):
         """ Thin-wrapper around `set_discipline` with journal column name
 
         See docstring for `set_discipline`
          """
-        self.set_discipline(search_term, disc, COL_LOOKUP['journal'])
+        return self.set_discipline(search_term, disc, COL_LOOKUP['journal'])
 
+    @_profiled('set_journal_disciplines')
+    def set_journal_disciplines(self, journal_disciplines):
+        """Sets the discipline of rows matching any journal keyword of a discipline
+
+        All keywords are matched in a single pass over the journal column (see
+        `match_journals`). As with `set_discipline` only rows with a blank DISCIPLINE
+        are set and HANDLED=1 is set if the discipline is not a PhysAstro discipline.
+        Rows matching keywords of more than one discipline are left as they are.
+
+        Args:
+            journal_disciplines (dict): Discipline to a list of journal keywords
+
+        Returns:
+            tuple(dict, dict): Discipline to a list of matching indices, and index to
+                a list of disciplines for the conflicting rows
+        """
+        keyword_disciplines = defaultdict(set)
+        for disc, keywords in journal_disciplines.items():
+            for keyword in keywords:
+                keyword_disciplines[str(keyword).lower().strip()].add(disc)
+
+        # Disciplines of each distinct journal name, rows pick theirs by code
+        codes, found = self._match_journal_names(list(keyword_disciplines))
+        journal_discs = [
+            sorted(set(disc for keyword in keywords for disc in keyword_disciplines[keyword]), key=str)
+            for keywords in found
+        ]
+        counts = np.array([len(discs) for discs in journal_discs], dtype=int)[codes]
+        blank = self.df['DISCIPLINE'].isnull().to_numpy()
+
+        conflicts = dict()
+        for pos in np.flatnonzero(blank & (counts > 1)):
+            conflicts[self.df.index[pos]] = journal_discs[codes[pos]]
+
+        assigned = dict()
+        single = blank & (counts == 1)
+        disc_codes = {disc: i for i, disc in enumerate(journal_disciplines)}
+        row_disc = np.array([disc_codes[discs[0]] if len(discs) == 1 else -1 for discs in journal_discs])[codes]
+        for disc in journal_disciplines:
+            matched = single & (row_disc == disc_codes[disc])
+
+            self._print("Setting discipline to '{}' for {} journal keywords on {} rows",
+                        disc, len(journal_disciplines[disc]), matched.sum())
+            self._apply_operation('set_discipline', matched, discipline=disc)
+
+            assigned[disc] = list(self.df.index[matched])
+
+        if conflicts:
+            self._print("{} rows match journals of more than one discipline", len(conflicts))
+
+        return assigned, conflicts
+
+    def match_journals(self, keywords):
+        """Find every keyword contained in the journal column of each row
+
+        Matching is the same naive, case insensitive substring match as
+        `get_matching_mask` but all keywords are found in one scan of each
+        distinct journal name.
+
+        Args:
+            keywords (list(str)): Journal keywords
+
+        Returns:
+            list(list(str)): Lowercase keywords found in each row, in order of keywords
+        """
+        codes, found = self._match_journal_names(keywords)
+        return [found[code] for code in codes]
+
+    @_profiled('set_discipline')
     def set_discipline(self, search_term, disc, column):
         """Sets the discipline based on either the given author or journal
 
@@ -112,229 +659,149 @@ class EraFixer(object):
             search_term (str): Term to be matched, should be full last name or full word from journal
             disc (str): Discipline to be set
 
+        Returns:
+            list: List of matching indices
         """
 
-        matching_indices = self.get_matching_rows(search_term, column)
+        matched = self.get_matching_mask(search_term, column)
 
         # Set the discipline on matched rows
-        self._print("Setting discipline to '{}' for '{}' on {} rows".format(disc, search_term, len(matching_indices)))
-        self.df.loc[matching_indices, ('DISCIPLINE')] = disc
-        if disc not in PHYSASTRO:
-            self._print("'{}' not in PhysAstro, setting HANDLED=1".format(disc))
-            self.df.loc[matching_indices, ('HANDLED')] = 1
+        self._print("Setting discipline to '{}' for '{}' on {} rows", disc, search_term, matched.sum())
+        self._apply_operation('set_discipline', matched, discipline=disc)
 
-    def split_disciplines(self, prefix):
+        return list(self.df.index[matched])
+
+    @_profiled('split_disciplines')
+    def split_disciplines(self, prefix, workers=None):
         """Output an excel file for each discipline with filename PREFIX_DISC.xlsx
 
+        The rows are grouped in a single pass and the files are written in parallel
+        on a process pool.
+
         Args:
             prefix (str): Prefix for filename
+            workers (int, optional): Number of processes writing files, 1 writes them one
+                after another, default the number of CPUs
 
         Returns:
-            list(str): List of saved file names
+            list(str): List of saved file names, in order of first appearance of the discipline
         """
-        disc_list = self.df.DISCIPLINE.unique()
-
-        save_list = list()
-
-        for disc in disc_list:
+        frames = list()
+        for disc, df in self.df.groupby('DISCIPLINE', sort=False, observed=True):
             if str(disc) in ['', 'nan']:
                 continue
 
-            df = self.df.query('DISCIPLINE == "{}"'.format(disc))
-            save_name = self.save(df=df, save_name='{}_{}'.format(prefix, disc))
-            save_list.append(save_name)
+            save_name = '{}_{}.xlsx'.format(prefix, disc)
+            self._debug("Writing dataframe to {} with {} records", save_name, len(df))
+            frames.append((self._to_excel_frame(df), save_name))
+
+        if workers == 1 or len(frames) < 2:
+            for df, save_name in frames:
+                _write_excel(df, save_name)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_write_excel, df, save_name) for df, save_name in frames]
+                for future in futures:
+                    future.result()
+
+        save_list = [save_name for df, save_name in frames]
+        for save_name in save_list:
+            self._print("File saved: {}", save_name)
 
         return save_list
 
+    @_profiled('carry_forward_forcs')
     def carry_forward_forcs(self):
         """ For each line, if there are values for 2015 FOR codes and HANDLED
 
+        Returns:
+            list: List of matching indices
         """
         self._print("Copying 2015 FOR codes to 2018 for unhandled rows")
 
         # Find rows that are not handled yet
-        matching_indices = self.get_matching_rows(0, 'HANDLED', blank_discipline=False)
-        self._print("Found {} total unhandled rows".format(len(matching_indices)))
+        matched = self.get_matching_mask(0, 'HANDLED', blank_discipline=False)
+        self._print("Found {} total unhandled rows", matched.sum())
 
-        for col_2015 in COL_LOOKUP.keys():
-            # Only looking at _e15 FOR code columns
-            if 'e15' not in col_2015:
-                continue
+        self._apply_operation('carry_forward_forcs', matched)
 
-            col_2018 = col_2015.replace('e15', 'e18')
+        return list(self.df.index[matched])
 
-            # Find 2015 columns that do not have blank values
-            has_2015_mask = pd.notnull(self.df.loc[matching_indices, (COL_LOOKUP[col_2015])])
+    @_profiled('apply_concordance')
+    def apply_concordance(self, concordance):
+        """Remap the 2018 FOR codes of carried forward rows (HANDLED=2) to new codes
 
-            self._print("Moving {} values to {}".format(has_2015_mask.sum(), col_2018))
+        Each code is replaced by its new codes from the concordance, with its percentage
+        split by their weights, codes not in the concordance are kept. A new code reached
+        from several old codes gets the sum of their percentages, and the percentages of
+        each row are renormalized to whole numbers adding to 100.
 
-            # Copy to 2018 columns
-            self.df.loc[has_2015_mask, (COL_LOOKUP[col_2018])] = \
-                self.df.loc[has_2015_mask, (COL_LOOKUP[col_2015])]
+        The other rows get HANDLED=4, so running the concordance again leaves them
+        alone, e.g. when a code is remapped to a code that is itself remapped. Rows
+        that can't be remapped are left as they are with HANDLED=3: rows with a
+        retired code or a code split without weights, rows that would need more than
+        four codes and rows with a code but no percentage.
 
-            # Mark row as handled
-            self.df.loc[has_2015_mask, ('HANDLED')] = 2
+        Args:
+            concordance (list(dict)): Mappings with old, new and weight, see `load_concordance`
 
+        Returns:
+            dict: Number of matched, remapped and ambiguous rows
+        """
+        self._print("Remapping the 2018 FOR codes of carried forward rows with {} mappings", len(concordance))
+
+        matched = self.get_matching_mask(2, 'HANDLED', blank_discipline=False)
+        self._print("Found {} carried forward rows", matched.sum())
+
+        result = self._apply_operation('apply_concordance', matched, concordance=concordance)
+
+        return dict(result or {'remapped': 0, 'ambiguous': 0}, matched=int(matched.sum()))
+
+    @_profiled('set_forc_string')
     def set_forc_string(self, forc_string, justify_string=None, author=None, journal=None):
-        self._print("Applying FORC_STRING '{}'".format(forc_string))
+        """Apply the FORC_STRING to the unhandled rows of author or journal, or all unhandled rows
+
+        Each matching row gets one outcome from the decision table below, in order:
+            * 2018 codes contain 'MD': apply codes, HANDLED=1
+            * all requested codes present (2 digit forms count, e.g. 0206 is fine
+              if 02 is listed): apply codes, HANDLED=1
+            * not all present and no justify_string: HANDLED=99 (ClawbackNeeded)
+            * one code given but not present: code to FOR4 at 100% with the
+              justify_string as clawback, HANDLED=1
+            * multiple codes given, code 2 (or else code 3) not present: if it has
+              at least 66% move it to FOR4 and HANDLED=1, otherwise HANDLED=99
+            * anything else: left unhandled
+
+        Args:
+            forc_string (str): FORC_STRING, e.g. '0201:40,0203'
+            justify_string (str, optional): Justification for codes that are not present
+            author (str, optional): Author to be matched
+            journal (str, optional): Journal to be matched
+
+        Returns:
+            list: List of matching indices
+        """
+        self._print("Applying FORC_STRING '{}'", forc_string)
 
         try:
-            code1, code1_perc, code2, code2_perc, code3, code3_perc = self._parse_forc_string(forc_string)
+            self._parse_forc_string(forc_string)
         except Exception as e:
             self._print(e)
-            return
+            return []
 
         # Get matching rows
         if author:
-            matching_indices = self.get_matching_rows(
+            matched = self.get_matching_mask(
                 author, COL_LOOKUP['author'], skip_handled=True, blank_discipline=False)
         elif journal:
-            matching_indices = self.get_matching_rows(
+            matched = self.get_matching_mask(
                 journal, COL_LOOKUP['journal'], skip_handled=True, blank_discipline=False)
         else:
-            matching_indices = self.get_matching_rows(0, 'HANDLED', skip_handled=True, blank_discipline=False)
-
-        for idx, row in self.df.loc[matching_indices].iterrows():
-            # Save the FORC_STRING
-            self.df.set_value(idx, 'FORC_STRING', forc_string)
-
-            default_code1 = str(row.loc[COL_LOOKUP['for1_e18']])
-            default_code2 = str(row.loc[COL_LOOKUP['for2_e18']])
-            default_code3 = str(row.loc[COL_LOOKUP['for3_e18']])
-
-            if(default_code1 == 'nan'):
-                default_code1 = ''
-            if(default_code2 == 'nan' or default_code2 == 'None'):
-                default_code2 = ''
-            if(default_code3 == 'nan' or default_code3 == 'None'):
-                default_code3 = ''
-
-            # If MD, apply codes
-            if ('MD' in default_code1) or ('MD' in default_code2) or ('MD' in default_code2):
-                self._debug("Found 'MD', applying codes and marking HANDLED=1")
-                self.df.set_value(idx, COL_LOOKUP['for1_e18'], code1)
-                self.df.set_value(idx, COL_LOOKUP['for2_e18'], code2)
-                self.df.set_value(idx, COL_LOOKUP['for3_e18'], code3)
-                self.df.set_value(idx, COL_LOOKUP['for1perc_e18'], code1_perc)
-                self.df.set_value(idx, COL_LOOKUP['for2perc_e18'], code2_perc)
-                self.df.set_value(idx, COL_LOOKUP['for3perc_e18'], code3_perc)
-
-                # Mark handled
-                self.df.set_value(idx, 'HANDLED', 1)
+            matched = self.get_matching_mask(0, 'HANDLED', skip_handled=True, blank_discipline=False)
 
-                continue
-
-            # Correct some string/float ugliness and add prefix 0
-            if default_code1 > '' and not default_code1.startswith('0'):
-                default_code1 = ('0' + default_code1).replace('.0', '')
-            if default_code2 is not None and default_code2 > '' and not default_code2.startswith('0'):
-                default_code2 = ('0' + default_code2).replace('.0', '')
-            if default_code3 is not None and default_code3 > '' and not default_code3.startswith('0'):
-                default_code3 = ('0' + default_code3).replace('.0', '')
-
-            # If all the requested codes are present,
-            # or their 2 digit forms are present, (eg 0206 is fine if 02 is listed)
-            default_code1_present = default_code1 > ''
-            default_code2_present = default_code2 > ''
-            default_code3_present = default_code3 > ''
-
-            code1_present = code1 is not None and code1 > '' and code1.startswith(default_code1)
-            code2_present = code2 is not None and code2 > '' and code2.startswith(default_code2)
-            code3_present = code3 is not None and code3 > '' and code3.startswith(default_code3)
-
-            provided_codes = (code1_present, code2_present, code3_present)
-            default_codes = (default_code1_present, default_code2_present, default_code3_present)
-
-            if provided_codes == default_codes:
-                self._debug("All codes present, applying FORC_STRING and marking HANDLED=1")
-                self.df.set_value(idx, COL_LOOKUP['for1_e18'], code1)
-                self.df.set_value(idx, COL_LOOKUP['for2_e18'], code2)
-                self.df.set_value(idx, COL_LOOKUP['for3_e18'], code3)
-                self.df.set_value(idx, COL_LOOKUP['for1perc_e18'], code1_perc)
-                self.df.set_value(idx, COL_LOOKUP['for2perc_e18'], code2_perc)
-                self.df.set_value(idx, COL_LOOKUP['for3perc_e18'], code3_perc)
-
-                # Mark handled
-                self.df.set_value(idx, 'HANDLED', 1)
-            else:
-                # If some of the requested codes are not present
-                # (and not saved by MD or 2 digit codes)
-                # and --justify flag is not present
-                # set HANDLED=99
-                if justify_string is None:
-                    self._debug("Not all codes present and not justify, marking HANDLED=99")
-                    # Mark ClawbackNeeded
-                    self.df.HANDLED = self.df.HANDLED.apply(str)
-                    self.df.set_value(idx, 'HANDLED', 99)
-                else:
-                    # First check if code is missing (blank)
-                    missing_code_1 = default_code1_present and not code1_present
-                    missing_code_2 = default_code2_present and not code2_present
-                    missing_code_3 = default_code3_present and not code3_present
-
-                    # Then check if code doesn't match (NOTE: The above is probably
-                    # redundant but a little cleaner to read)
-                    missing_code_1 = missing_code_1 or (default_code1 != code1)
-                    missing_code_2 = missing_code_2 or (default_code2 != code2)
-                    missing_code_3 = missing_code_3 or (default_code3 != code3)
-
-                    if missing_code_1:
-                        self._debug("Missing code 1, Default: {} \t Provided: {}".format(default_code1, code1))
-
-                    if missing_code_2:
-                        self._debug("Missing code 2, Default: {} \t Provided: {}".format(default_code2, code2))
-
-                    if missing_code_3:
-                        self._debug("Missing code 3, Default: {} \t Provided: {}".format(default_code3, code3))
-
-                    # One code, not present - have justify
-                    if (missing_code_1 and not code2_present and not code3_present):
-                        self._debug("One code given but not present, setting justify")
-                        # Assign code to FOR4 and set percent=100, clawback=justify, set HANDLED=1
-                        self.df.set_value(idx, COL_LOOKUP['for4_e18'], code1)
-                        self.df.set_value(idx, COL_LOOKUP['for4perc_e18'], 100)
-                        self.df.set_value(idx, COL_LOOKUP['clawback'], justify_string)
-                        self.df.set_value(idx, 'HANDLED', 1)
-                        continue
-
-                    # Multiple codes, one not present - have justify
-                    if (code1_present and (missing_code_2 or missing_code_3)):
-                        self._debug("Multiple codes given but not present, setting justify")
-                        if missing_code_2:
-                            if code2_perc >= 66:
-                                self.df.set_value(idx, COL_LOOKUP['for4_e18'], code2)
-                                self.df.set_value(idx, COL_LOOKUP['for4perc_e18'], code2_perc)
-                                self._debug("Missing code is greater than 66%, putting in FOR4 and setting HANDLED=1")
-
-                                # Set code 1 to remaining percentage
-                                self.df.set_value(idx, COL_LOOKUP['for1perc_e18'], 100 - code2_perc)
-
-                                self.df.set_value(idx, 'HANDLED', 1)
-                            else:
-                                self._debug("Missing code is less than 66%, setting HANDLED=99")
-                                self.df.set_value(idx, 'HANDLED', 99)
-
-                        elif missing_code_3:
-                            if code3_perc >= 66:
-                                self.df.set_value(idx, COL_LOOKUP['for4_e18'], code3)
-                                self.df.set_value(idx, COL_LOOKUP['for4perc_e18'], code3_perc)
-                                self._debug("Missing code is greater than 66%, putting in FOR4 and setting HANDLED=1")
-
-                                # Set code 1 and 2 to remaining percentage split evenly
-                                self.df.set_value(idx, COL_LOOKUP['for1perc_e18'], 100 - int(code3_perc / 2))
-                                self.df.set_value(idx, COL_LOOKUP['for2perc_e18'], 100 - int(code3_perc / 2))
-
-                                self.df.set_value(idx, 'HANDLED', 1)
-                            else:
-                                self._debug("Missing code is less than 66%, setting HANDLED=99 (ClawbackNeeded)")
-                                self.df.set_value(idx, 'HANDLED', 99)
-
-                        elif(code1_present and code2_present and code3_present):
-                            self._debug("Multiple codes given but not present, setting HANDLED=-1 (confused)")
-                            self.df.set_value(idx, 'HANDLED', -1)
-                    else:
-                        print("I shouldn't be here")
+        self._apply_operation('set_forc_string', matched, forc_string=forc_string, justify_string=justify_string)
 
+        return list(self.df.index[matched])
 
 ################################################################################
 # Helper methods
@@ -351,51 +818,89 @@ class EraFixer(object):
         Returns:
             list: List of matching indices
         """
-        self._debug("Matching {}={}".format(column, search_term))
-        # Get rows that have a naive match
-        naive_matches = [
-            idx
-            for idx, row in self.df.iterrows()
-            if str(search_term).lower().strip() in str(row[column]).lower()
-        ]
-        self._debug("Found {} naive matches for {}={}".format(len(naive_matches), column, search_term))
+        mask = self.get_matching_mask(search_term, column,
+                                      skip_handled=skip_handled, blank_discipline=blank_discipline)
 
-        if column in COL_LOOKUP.values():
-            # Do a more specific match, e.g. 'Gee' should not match 'McGee' for author
-            exact_matches = list()
-            for idx, row in self.df.loc[naive_matches].iterrows():
-                if self._match_name(row[column], search_term, column):
-                    exact_matches.append(idx)
+        return list(self.df.index[mask])
+
+    @_profiled('match')
+    def get_matching_mask(self, search_term, column, skip_handled=False, blank_discipline=True):
+        """Boolean mask version of `get_matching_rows`
 
-            self._debug("Found {} exact matches for '{}'".format(len(exact_matches), search_term))
+        The whole column is matched at once, first with a naive substring match and then,
+        for the author column, with a whole word match against the name found in the
+        author list (e.g. 'Gee' should not match 'McGee').
+
+        Args:
+            search_term (str): Term to be matched, should be full last name or full word from journal
+            column (str): Matching column name from spreadsheet
+            skip_handled (bool, optional): Only match rows with HANDLED=0, default False
+            blank_discipline (bool, optional): Should matching rows have a blank discipline, default True
+
+        Returns:
+            `numpy.ndarray`: Boolean array with one entry per row
+        """
+        self._debug("Matching {}={}", column, search_term)
+
+        if column == COL_LOOKUP['author']:
+            # Whole word match against the author table, e.g. 'Gee' should not match 'McGee',
+            # given the term as typed so mojibake in it can be repaired
+            mask = np.zeros(len(self.df), dtype=bool)
+            mask[self._get_author_table().match(search_term)] = True
+            search_term = str(search_term).lower().strip()
+            if self.debug:
+                self._debug("Found {} author table matches for {}={}", mask.sum(), column, search_term)
+        elif column == 'HANDLED':
+            search_term = str(search_term).lower().strip()
+            mask = (self.df['HANDLED'] == int(search_term)).to_numpy()
+            if self.debug:
+                self._debug("Found {} rows with {}={}", mask.sum(), column, search_term)
+        else:
+            search_term = str(search_term).lower().strip()
+            values = self.df[column].map(str).str.lower()
+
+            # Get rows that have a naive match
+            mask = values.str.contains(search_term, regex=False).to_numpy(dtype=bool, copy=True)
+            if self.debug:
+                self._debug("Found {} naive matches for {}={}", mask.sum(), column, search_term)
+
+        if column in COL_LOOKUP.values():
+            if self.debug:
+                self._debug("Found {} exact matches for '{}'", mask.sum(), search_term)
 
             # Skip handled
             if skip_handled:
-                exact_matches = list(self.df.loc[exact_matches].query("HANDLED == 0").index)
-                self._debug("Found {} matches for '{}' with HANDLED=0".format(len(exact_matches), search_term))
+                mask &= (self.df['HANDLED'] == 0).to_numpy(dtype=bool)
+                if self.debug:
+                    self._debug("Found {} matches for '{}' with HANDLED=0", mask.sum(), search_term)
 
             # Filter discipline
             if blank_discipline:
-                exact_matches = list(self.df.loc[exact_matches][pd.isnull(
-                    self.df.loc[exact_matches, 'DISCIPLINE'])].index)
-                self._debug("Found {} matches for '{}' with empty discipline".format(len(exact_matches), search_term))
+                mask &= self.df['DISCIPLINE'].isnull().to_numpy()
+                if self.debug:
+                    self._debug("Found {} matches for '{}' with empty discipline", mask.sum(), search_term)
 
-            self._debug("Found {} total rows for {}={}".format(len(exact_matches), column, search_term))
-        else:
-            exact_matches = naive_matches
+            if self.debug:
+                self._debug("Found {} total rows for {}={}", mask.sum(), column, search_term)
 
-        return exact_matches
+        return mask
 
-    def get_full_name(self, author_list, search_term):
+    def get_full_name(self, author_list, search_term, idx=None):
         """ Returns full matching name in author_list for search_term
 
         Args:
             author_list (str): Full author list string
             search_term (str): Substring to be used to match full name
+            idx (optional): Index of the row holding author_list, if given the name
+                is looked up in the author table instead of the string
 
         Returns:
-            TYPE: Description
+            str: Lowercase full name, empty if not found
         """
+        if idx is not None and ';' not in search_term:
+            author_table = self._get_author_table()
+            return author_table.get_full_name(self.df.index.get_loc(idx), search_term)
+
         author_list = author_list.lower().strip()
         search_term = search_term.lower().strip()
         full_name = ''
@@ -421,29 +926,648 @@ class EraFixer(object):
 
         return full_name
 
-    def get_journal_name(self, journal_name, search_term):
-        """ Returns full matching name in journal_name for search_term
+    def _match_journal_names(self, keywords):
+        """ Match keywords against each distinct journal name
+
+        Returns:
+            tuple(`numpy.ndarray`, list): Code of the journal name of each row, and the
+                lowercase keywords found in each journal name
+        """
+        matcher = KeywordMatcher([str(keyword).lower().strip() for keyword in keywords])
+
+        codes, journals = pd.factorize(self.df[COL_LOOKUP['journal']].map(str).str.lower())
+        found = [matcher.find(journal) for journal in journals]
+        self._debug("Matched {} journal keywords against {} journal names", len(keywords), len(journals))
+
+        # Blank journals have code -1 and pick the appended entry
+        found.append(list())
+        return codes, found
+
+    def _apply_operation(self, name, mask, **args):
+        """Apply one of `OPERATIONS` to the masked rows, recording it in the operation log
+
+        The previous value of every cell changed is kept with the record, for `undo`.
 
         Args:
-            journal_name (str): Full journal list string
-            search_term (str): Substring to be used to match full name
+            name (str): Operation name
+            mask (`numpy.ndarray`): Boolean array of the matched rows
+            **args: Arguments of the operation
 
         Returns:
-            TYPE: Description
+            Whatever the operation returns
         """
-        journal_name = journal_name.lower().strip()
-        search_term = search_term.lower().strip()
-        full_name = ''
+        if self.oplog is None or self._dry_run or not mask.any():
+            with self._store_lock(mask):
+                return getattr(self, OPERATIONS[name])(mask, **args)
 
-        # Look for search_term in string
-        match_start = journal_name.find(search_term)
-        if(match_start >= 0):
-            full_name = journal_name
+        with self._recording() as before:
+            result = getattr(self, OPERATIONS[name])(mask, **args)
 
-        return full_name
+        record = self.oplog.record_operation(name, args, self.df.index[mask].tolist(), before)
+        self._debug("Logged operation {} '{}' on {} rows", record['seq'], name, len(record['rows']))
+
+        return result
+
+    def _set_discipline_rows(self, mask, discipline):
+        """ Set DISCIPLINE on masked rows, and HANDLED=1 if not a PhysAstro discipline """
+        self._assign(mask, 'DISCIPLINE', discipline)
+        if discipline not in PHYSASTRO:
+            self._print("'{}' not in PhysAstro, setting HANDLED=1", discipline)
+            self._assign(mask, 'HANDLED', 1)
 
-    def save(self, df=None, save_name=None):
+    def _carry_forward_rows(self, mask):
+        """Copy the 2015 FOR codes to 2018 and set HANDLED=2 on masked rows with 2015 codes
 
+        The cells to copy are found for the whole block of 2015 columns at once, then
+        each 2018 column gets its cells in a single assignment.
+        """
+        keys_2015 = [key for key in COL_LOOKUP if 'e15' in key]
+        cols_2015 = [COL_LOOKUP[key] for key in keys_2015]
+        cols_2018 = [COL_LOOKUP[key.replace('e15', 'e18')] for key in keys_2015]
+
+        # Cells of the masked rows with a 2015 value
+        copy = mask[:, None] & self.df[cols_2015].notnull().to_numpy()
+
+        for i, (col_2015, col_2018) in enumerate(zip(cols_2015, cols_2018)):
+            self._print("Moving {} values to {}", copy[:, i].sum(), col_2018)
+            self._assign(copy[:, i], col_2018, self.df[col_2015].to_numpy()[copy[:, i]])
+
+        # Mark row as handled
+        self._assign(copy.any(axis=1), 'HANDLED', 2)
+
+    def _apply_concordance_rows(self, mask, concordance):
+        """Remap the 2018 FOR codes on masked rows, see `apply_concordance`
+
+        The four code/percentage pairs of all masked rows are stacked into one long
+        table and joined with the concordance, so every row is remapped at once.
+
+        Returns:
+            dict: Number of remapped and ambiguous rows
+        """
+        code_cols = [COL_LOOKUP['for{}_e18'.format(num)] for num in range(1, 5)]
+        perc_cols = [COL_LOOKUP['for{}perc_e18'.format(num)] for num in range(1, 5)]
+
+        positions = np.flatnonzero(mask)
+        codes = self.df[code_cols].to_numpy(dtype=object)[positions]
+        percs = self.df[perc_cols].to_numpy(dtype=float)[positions]
+
+        # One line per code, in column order
+        pairs = pd.DataFrame({
+            'row': np.repeat(np.arange(len(positions)), len(code_cols)),
+            'slot': np.tile(np.arange(len(code_cols)), len(positions)),
+            'code': codes.ravel(),
+            'perc': percs.ravel(),
+        })
+        pairs = pairs[pairs['code'].notnull()]
+
+        table = _concordance_table(concordance)
+        joined = pairs.merge(table, how='left', left_on='code', right_on='old')
+
+        # Codes not in the concordance are kept
+        kept = joined['old'].isnull().to_numpy()
+        joined.loc[kept, 'new'] = joined.loc[kept, 'code']
+        joined.loc[kept, 'weight'] = 1.0
+        joined['ambiguous'] = joined['ambiguous'].fillna(False).astype(bool) | joined['perc'].isnull()
+        joined['perc'] = joined['perc'] * joined['weight']
+
+        # New codes of each row in order of first appearance, merging repeated codes
+        ambiguous = np.zeros(len(positions), dtype=bool)
+        ambiguous[joined.loc[joined['ambiguous'], 'row'].to_numpy()] = True
+        joined = joined[~ambiguous[joined['row'].to_numpy()]]
+        merged = joined.groupby(['row', 'new'], sort=False)['perc'].sum().reset_index()
+
+        total = merged.groupby('row')['perc'].transform('sum').to_numpy()
+        counts = merged.groupby('row')['new'].transform('size').to_numpy()
+        ambiguous[merged.loc[(counts > len(code_cols)) | ~(total > 0), 'row'].to_numpy()] = True
+        merged = merged[~ambiguous[merged['row'].to_numpy()]].reset_index(drop=True)
+
+        # Renormalize to whole percentages adding to 100, the largest remainders get the rest
+        scaled = merged['perc'] * 100 / merged.groupby('row')['perc'].transform('sum')
+        whole = np.floor(scaled + 1e-9)
+        rest = 100 - whole.groupby(merged['row']).transform('sum')
+        order = pd.DataFrame({'row': merged['row'], 'remainder': whole - scaled}).sort_values(
+            ['row', 'remainder'], kind='stable')
+        rank = order.groupby('row').cumcount().reindex(merged.index)
+        merged['perc'] = whole + (rank < rest)
+
+        new_codes = np.full(codes.shape, np.nan, dtype=object)
+        new_percs = np.full(percs.shape, np.nan)
+        slots = merged.groupby('row').cumcount().to_numpy()
+        new_codes[merged['row'].to_numpy(), slots] = merged['new'].to_numpy()
+        new_percs[merged['row'].to_numpy(), slots] = merged['perc'].to_numpy()
+
+        self._debug("Remapping {} rows, {} rows are ambiguous", (~ambiguous).sum(), ambiguous.sum())
+        remapped = np.zeros(len(positions), dtype=bool)
+        for cols, old, new in [(code_cols, codes, new_codes), (perc_cols, percs, new_percs)]:
+            changed = ~ambiguous[:, None] & ~((old == new) | (pd.isnull(old) & pd.isnull(new)))
+            remapped |= changed.any(axis=1)
+
+            for i, col in enumerate(cols):
+                rows = np.zeros(len(self.df), dtype=bool)
+                rows[positions[changed[:, i]]] = True
+                self._assign(rows, col, new[changed[:, i], i])
+
+        rows = np.zeros(len(self.df), dtype=bool)
+        rows[positions[~ambiguous]] = True
+        self._debug("Marking {} rows with the concordance applied HANDLED=4", (~ambiguous).sum())
+        self._assign(rows, 'HANDLED', 4)
+
+        rows = np.zeros(len(self.df), dtype=bool)
+        rows[positions[ambiguous]] = True
+        self._print("Marking {} rows with ambiguous mappings HANDLED=3", ambiguous.sum())
+        self._assign(rows, 'HANDLED', 3)
+
+        return {'remapped': int(remapped.sum()), 'ambiguous': int(ambiguous.sum())}
+
+    def _set_forc_string_rows(self, mask, forc_string, justify_string=None):
+        """ Apply the FORC_STRING to masked rows, see `set_forc_string` """
+        code1, code1_perc, code2, code2_perc, code3, code3_perc = self._parse_forc_string(forc_string)
+
+        # Save the FORC_STRING
+        self._assign(mask, 'FORC_STRING', forc_string)
+
+        codes = (code1, code2, code3)
+
+        # Per-column "present" arrays for the 2018 codes and the requested codes
+        default_codes = [self.df[COL_LOOKUP['for{}_e18'.format(i)]] for i in (1, 2, 3)]
+        default_present = [default.notnull().to_numpy() for default in default_codes]
+        code_present = [_code_startswith(code, default) for code, default in zip(codes, default_codes)]
+
+        # Outcomes
+        is_md = mask & np.any([_code_contains('MD', default) for default in default_codes], axis=0)
+        all_present = mask & ~is_md & np.all(
+            [cp == dp for cp, dp in zip(code_present, default_present)], axis=0)
+        not_present = mask & ~is_md & ~all_present
+
+        self._debug("Found 'MD' on {} rows, applying codes and marking HANDLED=1", is_md.sum())
+        self._debug("All codes present on {} rows, applying FORC_STRING and marking HANDLED=1", all_present.sum())
+        self._apply_codes(is_md | all_present, code1, code1_perc, code2, code2_perc, code3, code3_perc)
+        self._assign(is_md | all_present, 'HANDLED', 1)
+
+        if justify_string is None:
+            # If some of the requested codes are not present (and not saved by MD or 2 digit codes)
+            self._debug("Not all codes present and not justify on {} rows, marking HANDLED=99", not_present.sum())
+            self._assign(not_present, 'HANDLED', 99)
+        else:
+            # Missing if blank or doesn't match
+            missing = [(dp & ~cp) | ~_code_equals(code, default)
+                       for dp, cp, default, code in zip(default_present, code_present, default_codes, codes)]
+
+            # One code, not present - have justify
+            one_code = not_present & missing[0] & ~code_present[1] & ~code_present[2]
+            self._debug("One code given but not present on {} rows, setting justify", one_code.sum())
+            self._assign(one_code, COL_LOOKUP['for4_e18'], code1)
+            self._assign(one_code, COL_LOOKUP['for4perc_e18'], 100)
+            self._assign(one_code, COL_LOOKUP['clawback'], justify_string)
+            self._assign(one_code, 'HANDLED', 1)
+
+            # Multiple codes, one not present - have justify
+            multiple_codes = not_present & ~one_code & code_present[0] & (missing[1] | missing[2])
+            missing_code2 = multiple_codes & missing[1]
+            missing_code3 = multiple_codes & ~missing[1] & missing[2]
+            self._debug("Multiple codes given but not present on {} rows, setting justify", multiple_codes.sum())
+
+            if code2_perc >= 66:
+                self._debug("Missing code 2 is greater than 66%, putting in FOR4 and setting HANDLED=1")
+                self._assign(missing_code2, COL_LOOKUP['for4_e18'], code2)
+                self._assign(missing_code2, COL_LOOKUP['for4perc_e18'], code2_perc)
+
+                # Set code 1 to remaining percentage
+                self._assign(missing_code2, COL_LOOKUP['for1perc_e18'], 100 - code2_perc)
+                self._assign(missing_code2, 'HANDLED', 1)
+            else:
+                self._debug("Missing code 2 is less than 66%, setting HANDLED=99")
+                self._assign(missing_code2, 'HANDLED', 99)
+
+            if code3_perc >= 66:
+                self._debug("Missing code 3 is greater than 66%, putting in FOR4 and setting HANDLED=1")
+                self._assign(missing_code3, COL_LOOKUP['for4_e18'], code3)
+                self._assign(missing_code3, COL_LOOKUP['for4perc_e18'], code3_perc)
+
+                # Set code 1 and 2 to remaining percentage split evenly
+                self._assign(missing_code3, COL_LOOKUP['for1perc_e18'], 100 - int(code3_perc / 2))
+                self._assign(missing_code3, COL_LOOKUP['for2perc_e18'], 100 - int(code3_perc / 2))
+                self._assign(missing_code3, 'HANDLED', 1)
+            else:
+                self._debug("Missing code 3 is less than 66%, setting HANDLED=99 (ClawbackNeeded)")
+                self._assign(missing_code3, 'HANDLED', 99)
+
+            # Any other rows are left unhandled, so later rules can still pick them up
+
+    def _restore(self, record):
+        """ Set the cells changed by an operation log record back to their previous values """
+        for column, (rows, values) in record['before'].items():
+            positions = self.df.index.get_indexer(rows)
+            mask = np.zeros(len(self.df), dtype=bool)
+            mask[positions] = True
+
+            # Values in row order, as dtype inferred from the values
+            self._assign(mask, column, pd.Series(values).to_numpy()[np.argsort(positions)])
+
+    @contextlib.contextmanager
+    def _recording(self):
+        """ Collect the previous value of every cell assigned in the block, as column to a dict of row id to value """
+        before = defaultdict(dict)
+        self._recorders.append(before)
+        try:
+            yield before
+        finally:
+            self._recorders.pop()
+
+    def _store_lock(self, mask):
+        """ Context manager holding the shared store locks of the masked rows, if there is a store """
+        if self.store is None or self._dry_run:
+            return contextlib.nullcontext()
+
+        return self.store.lock_rows(np.flatnonzero(mask))
+
+    def _create_store(self):
+        """ Create the shared store from the working sheet as parsed """
+        self._print("Creating store {}", self.store.path)
+
+        # The FOR columns as parsed, they are normalized again when the store is opened
+        base = self.df.copy()
+        base[self._parsed_forcs.columns] = self._parsed_forcs
+        frame, sheet = encode_frame(base)
+
+        with self._phase('store_write'):
+            self.store.create(frame, {col: self.df[col] for col in STORE_COLUMNS if col in self.df}, meta={
+                'sha1': file_sha1(self.fn),
+                'sheet_names': list(self.sheet_names),
+                'sheet_index': self.sheet_index,
+                'sheet': sheet,
+                'sheet_layout': self._sheet_layout,
+            })
+
+    def _check_store(self):
+        """ Raise if the workbook has been saved without going through the store """
+        if file_sha1(self.fn) != self.store.read_meta()['sha1']:
+            raise Exception("{} has been changed outside of {}".format(self.fn, self.store.path))
+
+    @contextlib.contextmanager
+    def _store_export(self):
+        """ Hold the export lock of the shared store while the workbook is written, then record its hash """
+        if self.store is None:
+            yield
+            return
+
+        with self.store.lock('export'):
+            self._check_store()
+            self.store.flush()
+            yield
+            self.store.update_meta(sha1=file_sha1(self.fn))
+
+    def _open_oplog(self):
+        """ Open the operation log and replay the operations not saved in the workbook yet """
+        self.oplog = OperationLog(self.fn)
+        pending = self.oplog.start(self.sheet_index)
+        if pending:
+            self._print("Replaying {} operations from {} not saved in the workbook", len(pending), self.oplog.path)
+            self.replay(pending)
+
+    def _apply_codes(self, mask, code1, code1_perc, code2, code2_perc, code3, code3_perc):
+        """ Set the 2018 FOR codes and percentages on masked rows """
+        self._assign(mask, COL_LOOKUP['for1_e18'], code1)
+        self._assign(mask, COL_LOOKUP['for2_e18'], code2)
+        self._assign(mask, COL_LOOKUP['for3_e18'], code3)
+        self._assign(mask, COL_LOOKUP['for1perc_e18'], code1_perc)
+        self._assign(mask, COL_LOOKUP['for2perc_e18'], code2_perc)
+        self._assign(mask, COL_LOOKUP['for3perc_e18'], code3_perc)
+
+    def _assign(self, mask, column, value):
+        """Set column to value on the masked rows
+
+        Categories are added to categorical columns as needed. Other columns that
+        can't hold value (e.g. a string in a float column) are cast to object.
+        The rows are recorded in `self.dirty` for an incremental save.
+
+        Args:
+            mask (`numpy.ndarray`): Boolean array with one entry per row
+            column (str): Column name
+            value: Value to be set, a scalar or an array with one entry per masked row
+        """
+        if not mask.any():
+            return
+
+        if self._recorders:
+            # Keep the value from before the operation, for undo and dry runs
+            rows = self.df.index[mask].tolist()
+            values = self.df.loc[mask, column].tolist()
+            for recorder in self._recorders:
+                before = recorder[column]
+                for row, old in zip(rows, values):
+                    before.setdefault(row, old)
+
+        if self.store is not None and not self._dry_run:
+            if column not in self.store.columns:
+                raise Exception("{} is not a writable column of {}".format(column, self.store.path))
+
+            # The store first, rows locked by another process leave the working sheet unchanged
+            self.store.write(column, np.flatnonzero(mask), value)
+
+        # Rows leave the summary before the change and are added back after it
+        summary = self._summary if self._summary is not None and column in self._summary.columns else None
+        if summary is not None:
+            positions = np.flatnonzero(mask)
+            summary.remove(self.df, positions, column)
+
+        dtype = self.df[column].dtype
+        if isinstance(value, np.ndarray) and value.dtype.kind in 'iuf' and dtype in [np.int8, np.float32]:
+            # Wider numbers, e.g. values read back for undo, keep the compact column if they fit
+            with np.errstate(invalid='ignore'):
+                cast = value.astype(dtype)
+            if dtype == np.float32 or (cast == value).all():
+                value = cast
+
+        if isinstance(self.df[column].dtype, pd.CategoricalDtype):
+            new_categories = pd.Index(pd.unique(pd.Series(np.ravel(value)).dropna()))
+            new_categories = new_categories.difference(self.df[column].cat.categories)
+            if len(new_categories):
+                self.df[column] = self.df[column].cat.add_categories(new_categories)
+
+        try:
+            self.df.loc[mask, column] = value
+        except (TypeError, ValueError):
+            self.df[column] = self.df[column].astype(object)
+            self.df.loc[mask, column] = value
+
+        if summary is not None:
+            summary.add(self.df, positions, column)
+
+        self.dirty[column].update(self.df.index[mask])
+        if self.profile is not None:
+            self.profile.touch(mask)
+
+    def get_author(self, idx, search_term):
+        """ Returns the author table entry of the first author in row idx containing search_term
+
+        Args:
+            idx: Row index
+            search_term (str): Substring to be used to match the name
+
+        Returns:
+            `pandas.Series`: Entry with name, surname and given, None if not found
+        """
+        return self._get_author_table().get_author(self.df.index.get_loc(idx), search_term)
+
+    def get_first_author_rows(self, search_term):
+        """ Find rows where search_term is a word of the first author
+
+        Args:
+            search_term (str): Full last name of the author
+
+        Returns:
+            list: List of matching indices
+        """
+        positions = self._get_author_table().first_author_rows(fold_name(search_term))
+
+        return list(self.df.index[positions])
+
+    def find_authors(self, search_term, limit=10, min_score=0.3):
+        """ Rank the author surnames most similar to search_term
+
+        Names are compared with accents removed and mojibake repaired, so variant
+        spellings and encodings of a name are found with one lookup.
+
+        Args:
+            search_term (str): Surname, e.g. 'Müller'
+            limit (int, optional): Number of candidates, default 10
+            min_score (float, optional): Lowest similarity returned, from 0 to 1, default 0.3
+
+        Returns:
+            `pandas.DataFrame`: surname, score and number of rows of each candidate, best first
+        """
+        return self._get_author_table().find(fold_name(search_term), limit=limit, min_score=min_score)
+
+    def get_publication_counts(self):
+        """ Number of rows listing each author
+
+        Returns:
+            `pandas.Series`: Count per normalized author name, largest first
+        """
+        return self._get_author_table().publication_counts()
+
+    def get_forc_codes(self):
+        """ Parse the FORC_STRING of every row, see `parse_forc_strings`
+
+        Returns:
+            `pandas.DataFrame`: Codes, percentages and error of each row, NaN for rows
+                without a FORC_STRING
+        """
+        return parse_forc_strings(self.df['FORC_STRING'])
+
+    def get_summary(self):
+        """Progress and FOR apportionment of the working sheet, see `Summary`
+
+        The summary is built from the whole sheet on first use and then kept up to
+        date by every change, so later calls are cheap.
+
+        Returns:
+            `Summary`: Summary of the working sheet
+        """
+        if self._summary is None:
+            with self._phase('summary'):
+                pairs = [(COL_LOOKUP['for{}_e18'.format(num)], COL_LOOKUP['for{}perc_e18'.format(num)])
+                         for num in range(1, 5)]
+                self._summary = Summary(self.df, pairs)
+
+        return self._summary
+
+    def update_author_index(self, indices=None):
+        """ Update the author table after the AUTHORS of some rows have been edited
+
+        Edits are picked up on the next author query anyway, see
+        `AuthorTable.changed_positions`, this only does the work ahead of time.
+
+        Args:
+            indices (list, optional): Edited row indices, default rebuild the whole table
+        """
+        authors = self.df[COL_LOOKUP['author']]
+        if indices is None or self.author_table is None:
+            self.author_table = AuthorTable(authors)
+        else:
+            positions = self.df.index.get_indexer(indices)
+            self.author_table.update(positions, authors.iloc[positions])
+
+    def refresh(self):
+        """Read the shared store into the working sheet, with the changes of other processes
+
+        Matching sees the values of the last refresh, saves refresh first.
+        """
+        if self.store is None:
+            raise Exception("Refresh requires a shared store")
+
+        with self._phase('store_read'):
+            for column in self.store.columns:
+                values = self.store.read(column)
+                if isinstance(values, pd.Categorical) and not isinstance(self.df[column].dtype, pd.CategoricalDtype):
+                    values = np.asarray(values, dtype=object)
+
+                self.df[column] = pd.Series(values, index=self.df.index)
+
+        # Rebuilt on next use, from the columns as read
+        self._summary = None
+
+    @contextlib.contextmanager
+    def lock_rows(self, mask, blocking=False):
+        """Keep other processes sharing the store from changing the masked rows
+
+            with erafixer.lock_rows(erafixer.df.index < 1000):
+                ...
+
+        Args:
+            mask (`numpy.ndarray`): Boolean array of the rows to lock
+            blocking (bool, optional): Wait for rows locked by another process instead
+                of raising, default False
+
+        Raises:
+            Exception: Some of the rows are locked by another process and not blocking
+        """
+        if self.store is None:
+            raise Exception("Locking rows requires a shared store")
+
+        with self.store.lock_rows(np.flatnonzero(mask), blocking=blocking):
+            yield
+
+    @contextlib.contextmanager
+    def lock_discipline(self, discipline, blocking=False):
+        """Keep other processes sharing the store from changing the rows of a discipline
+
+        The rows are those with the discipline after a `refresh`, e.g. to review them
+        without another reviewer changing them in the meantime.
+
+        Args:
+            discipline (str): Discipline
+            blocking (bool, optional): Wait for rows locked by another process instead
+                of raising, default False
+
+        Yields:
+            `numpy.ndarray`: Boolean array of the locked rows
+        """
+        self.refresh()
+        mask = (self.df['DISCIPLINE'] == discipline).to_numpy()
+
+        with self.lock_rows(mask, blocking=blocking):
+            yield mask
+
+    def undo(self):
+        """Undo the last logged operation that hasn't been undone yet
+
+        The cells it changed get their previous values back, which is recorded in
+        the operation log. Like the operations, the undo is only written to the
+        workbook on `save`.
+
+        Returns:
+            dict: Operation log record of the undone operation
+        """
+        if self.oplog is None:
+            raise Exception("Undo requires an operation log")
+
+        record = self.oplog.last_operation()
+        if record is None:
+            raise Exception("Nothing to undo in {}".format(self.oplog.path))
+
+        self._print("Undoing operation {} '{}' on {} rows", record['seq'], record['op'], len(record['rows']))
+        self._restore(record)
+        self.oplog.record_undo(record['seq'])
+
+        return record
+
+    def replay(self, records):
+        """Apply operation log records to the working sheet without logging them again
+
+        Operations are applied to the row ids they matched when they were logged,
+        not matched again.
+
+        Args:
+            records (list(dict)): 'op' and 'undo' records of an `OperationLog`, in order,
+                other records are skipped
+        """
+        operations = dict()
+        for record in records:
+            if record['type'] == 'op':
+                self._debug("Replaying operation {} '{}' on {} rows",
+                            record['seq'], record['op'], len(record['rows']))
+                mask = self.df.index.isin(record['rows'])
+                getattr(self, OPERATIONS[record['op']])(mask, **record['args'])
+                operations[record['seq']] = record
+            elif record['type'] == 'undo':
+                self._debug("Replaying undo of operation {}", record['seq'])
+                self._restore(operations.get(record['seq']) or self.oplog.operation(record['seq']))
+
+    @contextlib.contextmanager
+    def dry_run(self):
+        """Run mutators without keeping their changes, to see what they would change
+
+        Every cell assigned in the block gets its previous value back on exit, and
+        the column dtypes and `self.dirty` are restored too. Nothing is logged.
+
+            with erafixer.dry_run() as report:
+                erafixer.carry_forward_forcs()
+            print_dry_run(report)
+
+        Yields:
+            dict: Filled in on exit, 'columns' maps each column to the number of cells
+                that changed and 'rows' is the number of rows with a changed cell
+        """
+        dtypes = self.df.dtypes.to_dict()
+        dirty = {column: set(rows) for column, rows in self.dirty.items()}
+        dry_run = self._dry_run
+        report = {'columns': dict(), 'rows': 0}
+
+        self._dry_run = True
+        try:
+            with self._recording() as before:
+                yield report
+        finally:
+            changed_rows = set()
+            restore = dict()
+            for column, values in before.items():
+                rows = list(values)
+                old = pd.Series(list(values.values()), dtype=object)
+                new = pd.Series(self.df.loc[rows, column].tolist(), dtype=object)
+                changed = ~((old == new) | (old.isnull() & new.isnull())).to_numpy()
+
+                if changed.any():
+                    report['columns'][column] = int(changed.sum())
+                    changed_rows.update(np.array(rows, dtype=object)[changed].tolist())
+
+                restore[column] = [rows, old.tolist()]
+
+            report['rows'] = len(changed_rows)
+
+            self._restore({'before': restore})
+            for column in restore:
+                if self.df[column].dtype != dtypes[column]:
+                    self.df[column] = self.df[column].astype(dtypes[column])
+
+            self.dirty = defaultdict(set, dirty)
+            self._dry_run = dry_run
+
+    @_profiled('save')
+    def save(self, df=None, save_name=None, incremental=False):
+        """Save the working sheet back to the Excel file, or df to a new file
+
+        The working sheet is replaced inside the existing workbook and the other sheets
+        are copied through untouched (see `xlsx_patch`). If that isn't possible, e.g. the
+        file is not an xlsx, the whole workbook is rewritten.
+
+        With incremental, only the cells in `self.dirty` are written into the existing
+        sheet, keeping their formatting. With a shared store, the store is read first
+        and the whole sheet is written. Changes made directly to `self.df` are not
+        tracked, the sheet is replaced instead if rows or columns have been removed.
+        In low memory mode saves are always incremental, as the sheet can't be replaced.
+        Saves of the working sheet first wait for those started by `save_async`.
+
+        Args:
+            df (`pandas.DataFrame`, optional): DataFrame to save instead of the working sheet
+            save_name (str, optional): File name for df, '.xlsx' is added if missing
+            incremental (bool, optional): Only write changed cells of the working sheet,
+                default False
+
+        Returns:
+            str: Saved file name
+        """
         if df is not None:
             if not save_name:
                 print("Can't save a DataFrame without a save_name")
@@ -451,113 +1575,239 @@ class EraFixer(object):
                 if not save_name.endswith('.xlsx'):
                     save_name += '.xlsx'
 
-                self._debug("Writing dataframe to {} with {} records".format(save_name, len(df)))
-                writer = pd.ExcelWriter(save_name, engine='xlsxwriter')
-                df.to_excel(writer)
-                writer.save()
+                self._debug("Writing dataframe to {} with {} records", save_name, len(df))
+                _write_excel(self._to_excel_frame(df), save_name)
         else:
-            save_name = self.fn
-            # Specify a writer for saving
-            writer = pd.ExcelWriter(save_name, engine='xlsxwriter')
-
-            # Write dataframe to file (all sheets)
-            for sheet in self.xls.sheet_names:
-                self._debug("Writing sheet '{}' to {}".format(sheet, save_name))
+            # Background saves hold older snapshots, they must not overwrite this one
+            self._wait_for_saves()
 
-                if sheet == self.xls.sheet_names[self.sheet_index]:
-                    self.df.to_excel(writer, sheet)
-                else:
-                    self.xls.parse(sheet).to_excel(writer, sheet)
+            if self.store is not None:
+                # The store has the changes of every process, they are all written
+                self.refresh()
+                incremental = False
 
-            # Save the result
-            writer.save()
+            save_name = self._save_sheet(self.df, self.dirty, incremental)
+            self.dirty.clear()
 
-        self._print("File saved: {}".format(save_name))
+        self._print("File saved: {}", save_name)
         return save_name
 
+    def save_async(self, incremental=False):
+        """Save the working sheet on a background thread, see `save`
+
+        The working sheet is snapshotted with copy-on-write, so the snapshot is cheap
+        and later changes don't reach it, and written by a single background thread.
+        A snapshot still waiting for an earlier save to finish is replaced by the next
+        one, so only the newest is written and all their futures get its result.
+        Changes made since the last background save are saved on exit.
+
+        Args:
+            incremental (bool, optional): Only write changed cells, default False
+
+        Returns:
+            `concurrent.futures.Future`: Resolves to the saved file name
+        """
+        if self.store is not None:
+            self.refresh()
+            incremental = False
+
+        future = Future()
+        with self._save_lock:
+            snapshot = {
+                'df': _snapshot(self.df),
+                'dirty': self.dirty,
+                'incremental': incremental,
+                'records': None if self.oplog is None else len(self.oplog.records),
+                'futures': [future],
+            }
+            self.dirty = defaultdict(set)
+            self._async_incremental = incremental
+
+            if self._save_executor is None:
+                self._save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='erafixer-save')
+                # A weak reference, so the hook doesn't keep the instance alive
+                atexit.register(_save_at_exit, weakref.ref(self))
+
+            queued = self._queued_save
+            self._queued_save = snapshot
+            self._save_future = future
+
+            if queued is not None:
+                # Not started yet, the new snapshot holds its changes too
+                self._debug("Replacing a queued save of {}", self.fn)
+                _merge_dirty(snapshot['dirty'], queued['dirty'])
+                snapshot['incremental'] = incremental and queued['incremental']
+                snapshot['futures'] = queued['futures'] + snapshot['futures']
+            else:
+                self._save_executor.submit(self._save_queued)
+
+        return future
+
+    def flush_saves(self):
+        """Wait for the saves started by `save_async`
+
+        Returns:
+            str: Saved file name, None if there was no background save
+
+        Raises:
+            Exception: The error of the last background save
+        """
+        future = self._save_future
+        if future is None:
+            return None
+
+        return future.result()
+
 ################################################################################
 # Private methods
 ################################################################################
 
-    def _parse_forc_string(self, forc_string):
-        match = forc_re.match(forc_string)
-        if match is None:
-            raise Exception("FORC_STRING not valid")
-
-        match = forc_re.match(forc_string)
-        code1 = match.group('code1')
-        code1_perc = match.group('code1_perc')
-        code2 = match.group('code2')
-        code2_perc = match.group('code2_perc')
-        code3 = match.group('code3')
-        code3_perc = match.group('code3_perc')
-
-        if code1_perc is not None:
-            code1_perc = float(code1_perc)
-        else:
-            code1_perc = 0
+    def _save_sheet(self, df, dirty, incremental, records=None):
+        """Write df as the working sheet into the workbook, see `save`
 
-        if code2_perc is not None:
-            code2_perc = float(code2_perc)
-        else:
-            code2_perc = 0
+        Args:
+            df (`pandas.DataFrame`): Working sheet or a snapshot of it
+            dirty (dict): Column to the changed row ids of df
+            incremental (bool): Only write changed cells
+            records (int, optional): Number of operation log records df holds, default all
 
-        if code3_perc is not None:
-            code3_perc = float(code3_perc)
+        Returns:
+            str: Saved file name
+        """
+        save_name = self.fn
+        sheet_name = self.sheet_names[self.sheet_index]
+
+        with self._store_export():
+            saved = False
+            if self.low_memory:
+                self._save_cells(df, dirty)
+                saved = True
+            elif incremental:
+                try:
+                    self._save_cells(df, dirty)
+                    saved = True
+                except Exception as e:
+                    self._debug("Can't update cells ({}), replacing the sheet", e)
+
+            if not saved:
+                try:
+                    self._debug("Replacing sheet '{}' in {}", sheet_name, save_name)
+                    with self._phase('write_sheet:{}'.format(sheet_name)):
+                        xlsx_patch.replace_sheet(self.fn, sheet_name, self._to_excel_frame(df))
+                except Exception as e:
+                    self._debug("Can't replace sheet ({}), rewriting all sheets", e)
+                    self._save_all_sheets(save_name, df)
+
+                # Both write the index as the first column
+                self._sheet_columns = [None] + list(df.columns)
+                self._sheet_rows = df.index.copy()
+
+        if self.oplog is not None:
+            self.oplog.checkpoint(records)
+
+        return save_name
+
+    def _save_queued(self):
+        """ Write the queued snapshot of `save_async`, on the background thread """
+        with self._save_lock:
+            snapshot, self._queued_save = self._queued_save, None
+
+        try:
+            save_name = self._save_sheet(snapshot['df'], snapshot['dirty'], snapshot['incremental'],
+                                         records=snapshot['records'])
+        except Exception as e:
+            # Keep the changes for the next save
+            with self._save_lock:
+                _merge_dirty(self._queued_save['dirty'] if self._queued_save else self.dirty, snapshot['dirty'])
+
+            for future in snapshot['futures']:
+                future.set_exception(e)
         else:
-            code3_perc = 0
+            self._print("File saved: {}", save_name)
+            for future in snapshot['futures']:
+                future.set_result(save_name)
 
-        if (code1_perc == 0 and code2_perc == 0 and code3_perc == 0):
-            code1_perc = 100.
-            code2_perc = 0.
-            code3_perc = 0.
+    def _wait_for_saves(self):
+        """ Wait for the background saves to finish, whether they succeed or not """
+        if self._save_future is not None:
+            wait([self._save_future])
 
-        if code1_perc < 100:
-            if (code2_perc == 0 and code3 is None):
-                code2_perc = 100 - code1_perc
+    def _save_at_exit(self):
+        """ Finish the background saves and save any changes made since """
+        try:
+            self._wait_for_saves()
+            if any(self.dirty.values()):
+                self.save(incremental=self._async_incremental)
+        except Exception as e:
+            print("Can't save {} on exit: {}".format(self.fn, e), file=sys.stderr)
 
-            if (code1_perc + code2_perc < 100 and code3_perc == 0):
-                code3_perc = 100 - code1_perc - code2_perc
+    @_profiled('write_all_sheets')
+    def _save_all_sheets(self, save_name, df):
+        """ Write every sheet to save_name, the other sheets are only parsed once per session """
+        other_sheets = dict()
+        for sheet in self.sheet_names:
+            if sheet != self.sheet_names[self.sheet_index] and sheet not in self._other_sheets:
+                self._debug("Parsing sheet '{}'", sheet)
+                other_sheets[sheet] = self._get_xls().parse(sheet)
 
-        if (code1_perc + code2_perc + code3_perc != 100):
-            raise Exception("Percentages don't add to 100")
+        self._other_sheets.update(other_sheets)
 
-        return (code1, code1_perc, code2, code2_perc, code3, code3_perc,)
+        # Specify a writer for saving
+        writer = pd.ExcelWriter(save_name, engine='xlsxwriter')
 
-    def _match_name(self, full_string, search_name, column):
-        """ Check if search_name is in full_string
+        # Write dataframe to file (all sheets)
+        for sheet in self.sheet_names:
+            self._debug("Writing sheet '{}' to {}", sheet, save_name)
 
-        The search_term should be supplied as the full last name of the author in question.
+            with self._phase('write_sheet:{}'.format(sheet)):
+                if sheet == self.sheet_names[self.sheet_index]:
+                    self._to_excel_frame(df).to_excel(writer, sheet_name=sheet)
+                else:
+                    self._other_sheets[sheet].to_excel(writer, sheet_name=sheet)
 
-        Note:
-            Names are not stored correctly in the excel sheet (should be in UTF-8) but will still
-            match on bad characters.
+        # Save the result
+        writer.close()
 
-        Args:
-            full_string (str): Full author list string
-            search_name (str): Substring to be used to match full name
+    @_profiled('write_cells')
+    def _save_cells(self, df, dirty):
+        """ Write the dirty cells of df, the working sheet, into the workbook
 
-        Returns:
-            bool: If match found, default False
+        Columns that are not in the sheet yet (e.g. an added HANDLED column) are
+        appended in full. Raises if the rows or columns no longer line up with the sheet.
         """
-        full_string = str(full_string).lower().strip()
-        search_name = str(search_name).lower().strip()
-        found = False
+        if self._sheet_columns is None or not df.index.equals(self._sheet_rows):
+            raise Exception("Rows have changed since the sheet was read")
+
+        positions = {col: pos for pos, col in enumerate(self._sheet_columns) if col is not None}
+        missing = [col for col in positions if col not in df.columns]
+        if missing:
+            raise Exception("Columns {} have been removed".format(missing))
+
+        cells = defaultdict(dict)
+        added = list()
+        for col in df.columns:
+            if col in positions:
+                if not dirty.get(col):
+                    continue
+
+                mask = df.index.isin(list(dirty[col]))
+                pos = positions[col]
+            else:
+                mask = np.ones(len(df), dtype=bool)
+                pos = len(self._sheet_columns) + len(added)
+                added.append(col)
+                cells[1][pos] = col
 
-        # Get the name
-        if column == COL_LOOKUP['author']:
-            full_name = self.get_full_name(full_string, search_name)
-            full_name = full_name.split()
-        elif column == COL_LOOKUP['journal']:
-            full_name = self.get_journal_name(full_string, search_name)
-        else:
-            full_name = full_string
+            values = self._to_excel_frame(df.loc[mask, [col]])[col]
+            for row, value in zip(np.flatnonzero(mask) + 2, values):
+                cells[int(row)][pos] = value
 
-        # Test if search_name matches a word in string
-        # Note: For AUTHORS this is a list of strings, for journals a string
-        found = search_name in full_name
+        self._debug("Updating {} rows of sheet '{}' in {}", len(cells), self.sheet_names[self.sheet_index], self.fn)
+        xlsx_patch.patch_cells(self.fn, self.sheet_names[self.sheet_index], cells)
+        self._sheet_columns = self._sheet_columns + added
 
-        return found
+    def _parse_forc_string(self, forc_string):
+        return _parse_forc(forc_string)
 
     def _parse_excel(self):
         """Parse the excel file and return a `pandas.DataFrame` for sheet
@@ -565,16 +1815,26 @@ class EraFixer(object):
         Note: If more than one sheet exists and no `--sheet_index` has been given,
             force a prompt to clarify
         """
-        self._print("Parsing file {}".format(self.fn))
-        try:
-            self.xls = pd.ExcelFile(self.fn, dtype=object)
-        except Exception:
-            print("Can't find excel file: {}".format(self.fn))
-            sys.exit(1)
+        self._print("Parsing file {}", self.fn)
+        if self.store is not None and self.store.exists:
+            self._print("Using store {}", self.store.path)
+            self._check_store()
+            self.sheet_names = self.store.meta['sheet_names']
+
+            if self.sheet_index is None:
+                self.sheet_index = self.store.meta['sheet_index']
+            elif self.sheet_index != self.store.meta['sheet_index']:
+                raise Exception("{} holds sheet index {}, not {}".format(
+                    self.store.path, self.store.meta['sheet_index'], self.sheet_index))
+        elif self.cache is not None and self.cache.is_valid():
+            self._print("Using cache {}", self.cache.path)
+            self.sheet_names = self.cache.sheet_names
+        else:
+            self.sheet_names = self._get_xls().sheet_names
 
-        if (len(self.xls.sheet_names) > 1) and not self.sheet_index:
+        if (len(self.sheet_names) > 1) and self.sheet_index is None:
             print("More than one sheet is present, please select: ")
-            for idx, sheet in enumerate(self.xls.sheet_names):
+            for idx, sheet in enumerate(self.sheet_names):
                 print("{} - {}".format(idx, sheet))
 
             self.sheet_index = int(input("Sheet index: "))
@@ -582,8 +1842,70 @@ class EraFixer(object):
         elif not self.sheet_index:
             self.sheet_index = 0
 
-        self._print("Using sheet index {} - {}".format(self.sheet_index, self.xls.sheet_names[self.sheet_index]))
-        self.df = self.xls.parse(self.xls.sheet_names[self.sheet_index])
+        self._print("Using sheet index {} - {}", self.sheet_index, self.sheet_names[self.sheet_index])
+        if self.store is not None and self.store.exists:
+            with self._phase('store_read'):
+                self.df = decode_frame(self.store.read_base(), self.store.meta['sheet'])
+            self._sheet_layout = self.store.meta['sheet_layout']
+        elif self.cache is not None:
+            with self._phase('cache_read'):
+                self.df = self.cache.read(self.sheet_index, low_memory=self.low_memory)
+            self._sheet_layout = self.cache.sheet_layout(self.sheet_index, low_memory=self.low_memory)
+
+        if self.df is None:
+            self.df = self._parse_sheet()
+
+            if self.cache is not None:
+                self._print("Writing cache {}", self.cache.path)
+                with self._phase('cache_write'):
+                    self.cache.write(self.sheet_index, self.df, self.sheet_names,
+                                     low_memory=self.low_memory, sheet_layout=self._sheet_layout)
+
+        # Columns and rows as laid out in the sheet, for incremental saves
+        if self._sheet_layout is not None:
+            self._sheet_columns = [self.df.columns[i] if i is not None else None for i in self._sheet_layout]
+            self._sheet_rows = self.df.index.copy()
+
+        self._normalize_forcs()
+
+        if self.store is not None:
+            if not self.store.exists:
+                self._create_store()
+
+            # Another process may have created the store first, or changed it since
+            self.refresh()
+
+        self._debug("Building author table")
+        with self._phase('author_table'):
+            self.author_table = AuthorTable(self.df[COL_LOOKUP['author']])
+
+    def _get_xls(self):
+        """ Returns the `pandas.ExcelFile`, opening it on first use """
+        if self.xls is None:
+            try:
+                with self._phase('open'):
+                    self.xls = pd.ExcelFile(self.fn)
+            except Exception:
+                print("Can't find excel file: {}".format(self.fn))
+                sys.exit(1)
+
+        return self.xls
+
+    @_profiled('parse_sheet')
+    def _parse_sheet(self):
+        """ Parse the working sheet, adding missing columns and cleaning dtypes
+
+        Returns:
+            `pandas.DataFrame`: Parsed sheet
+
+        Raises:
+            Exception: Some HANDLED cells are not blank and not a state, see `COL_DTYPES`
+        """
+        if self.low_memory:
+            self.df = self._stream_sheet()
+        else:
+            self.df = self._get_xls().parse(self.sheet_names[self.sheet_index])
+            self._sheet_layout = list(range(len(self.df.columns)))
 
         if 'HANDLED' not in self.df.columns:
             self._debug("Adding HANDLED (default 0) column to spreadsheet")
@@ -598,51 +1920,559 @@ class EraFixer(object):
             self.df['FORC_STRING'] = np.nan
 
         # Clean some dtypes
-        dtypes = {
-            'ERA_18_FOR4_ClawBack_Justify': 'object',
-            'ARCFORC': 'object',
-            'Staff_Comments': 'object',
-            'Category': 'object',
-            'ARIS_UPDATED': 'object',
-            'YEAR': 'int64',
-            'DEPARTMENT': 'object',
-            'First_MQ_Authors_Faculty': 'object',
-            'AUTHORS': 'object',
-            'TITLE': 'object',
-            'PUBLISHER': 'object',
-            'PARENT_DOC': 'object',
-            'EDITOR': 'object',
-            'VOL': 'object',
-            'NUMB': 'object',
-            'EDITION': 'object',
-            'START_PAGE': 'object',
-            'END_PAGE': 'object',
-            'PLACE': 'object',
-            'ISSBN': 'object',
-            'DOI': 'object',
-            'HANDLED': 'object',
-            'DISCIPLINE': 'object',
-        }
-        for col, col_type in dtypes.items():
-            self.df[col] = self.df[col].astype(col_type)
-
-    def _print(self, msg):
-        """ Simple wrapper to check verbose flag """
+        with self._phase('clean_dtypes'):
+            for col, col_type in COL_DTYPES.items():
+                if col_type == 'int8':
+                    self.df[col] = self._read_states(col)
+
+                self.df[col] = self.df[col].astype(col_type)
+
+        return self.df
+
+    def _read_states(self, col):
+        """ Numeric states of col with blanks as 0, refusing cells that aren't a state
+
+        Rules only change rows with HANDLED=0, so reading e.g. 'done' as 0 would let
+        them overwrite rows someone has marked by hand.
+        """
+        values = self.df[col]
+        states = pd.to_numeric(values, errors='coerce')
+        blank = values.isnull() | (values.map(str).str.strip() == '')
+        unreadable = ~blank & ~(states.between(-128, 127) & (states % 1 == 0))
+
+        if unreadable.any():
+            rows = np.flatnonzero(unreadable.to_numpy())
+            examples = ', '.join('row {}: {!r}'.format(row + 2, values.iloc[row]) for row in rows[:5])
+            raise Exception("{} can't be read on {} rows of {} ({}), fix or clear them".format(
+                col, len(rows), self.fn, examples))
+
+        return states.fillna(0)
+
+    def _stream_sheet(self):
+        """ Read only `WORKING_COLUMNS` of the working sheet, one row at a time
+
+        Cells are converted and parsed the same way as `pandas.read_excel`, but the
+        other columns are dropped as each row is read.
+
+        Returns:
+            `pandas.DataFrame`: Working columns of the sheet
+        """
+        try:
+            import openpyxl
+        except ImportError:
+            raise Exception("openpyxl is required for low memory mode")
+
+        book = openpyxl.load_workbook(self.fn, read_only=True, data_only=True, keep_links=False)
+        try:
+            sheet = book[self.sheet_names[self.sheet_index]]
+            sheet.reset_dimensions()
+            rows = sheet.iter_rows(values_only=True)
+
+            header = list(next(rows, ()))
+            positions = [pos for pos, name in enumerate(header) if name in WORKING_COLUMNS]
+            self._debug("Reading {} of {} columns", len(positions), len(header))
+
+            data = [[header[pos] for pos in positions]]
+            last_row = 0
+            for row in rows:
+                data.append([_excel_value(row[pos]) if pos < len(row) else '' for pos in positions])
+                if any(value is not None for value in row):
+                    last_row = len(data) - 1
+        finally:
+            book.close()
+
+        # Trailing blank rows are dropped, as pandas does
+        del data[last_row + 1:]
+
+        self._sheet_layout = [None] * len(header)
+        for i, pos in enumerate(positions):
+            self._sheet_layout[pos] = i
+
+        return TextParser(data, header=0).read()
+
+    @_profiled('normalize_forcs')
+    def _normalize_forcs(self):
+        """ Replace the FOR code and percentage columns with canonical values
+
+        Codes become categorical zero-padded strings (see `_canonical_code`) and
+        percentages floats. The parsed columns are kept so that `_to_excel_frame`
+        can write back unchanged cells in their original representation.
+        """
+        columns = [COL_LOOKUP[key] for key in FOR_CODE_KEYS + FOR_PERC_KEYS if COL_LOOKUP[key] in self.df]
+        self._debug("Normalizing FOR columns {}", columns)
+
+        self._parsed_forcs = self.df[columns].copy()
+        for key in FOR_CODE_KEYS:
+            if COL_LOOKUP[key] in self.df:
+                self.df[COL_LOOKUP[key]] = _canonical_codes(self.df[COL_LOOKUP[key]])
+
+        for key in FOR_PERC_KEYS:
+            if COL_LOOKUP[key] in self.df:
+                self.df[COL_LOOKUP[key]] = _percentages(self.df[COL_LOOKUP[key]])
+
+        self._normalized_forcs = self.df[columns].copy()
+
+    def _to_excel_frame(self, df):
+        """ Returns df with the compact columns back in the representation they were parsed with
+
+        Cells of the FOR columns that have not changed since `_normalize_forcs` get their
+        parsed value, changed cells get the new canonical value. Percentages are written
+        as the shortest decimal of their float32 value and categorical columns as objects.
+
+        Args:
+            df (`pandas.DataFrame`): Working DataFrame or a subset of its rows
+
+        Returns:
+            `pandas.DataFrame`: Copy of df ready to be written
+        """
+        df = df.copy()
+        for col in df.columns:
+            df[col] = _excel_column(df[col])
+
+        if self._parsed_forcs is None:
+            return df
+
+        for col in self._parsed_forcs.columns:
+            if col not in df:
+                continue
+
+            values = df[col].astype(object)
+            normalized = _excel_column(self._normalized_forcs[col].reindex(df.index)).astype(object)
+            unchanged = (values == normalized) | (values.isnull() & normalized.isnull())
+
+            df[col] = values.where(~unchanged, self._parsed_forcs[col].reindex(df.index))
+
+        return df
+
+    def _get_author_table(self):
+        """ Returns the author table, updating the rows edited since it was built """
+        authors = self.df[COL_LOOKUP['author']]
+        changed = None if self.author_table is None else self.author_table.changed_positions(authors)
+
+        if changed is None:
+            self._debug("Rebuilding author table")
+            with self._phase('author_table'):
+                self.author_table = AuthorTable(authors)
+        elif len(changed):
+            self._debug("Updating {} rows of the author table", len(changed))
+            with self._phase('author_table'):
+                self.author_table.update(changed, authors.iloc[changed])
+
+        return self.author_table
+
+    def _phase(self, name):
+        """ Context manager timing a phase when profiling, otherwise doing nothing """
+        if self.profile is None:
+            return contextlib.nullcontext()
+
+        return self.profile.phase(name)
+
+    def _print(self, msg, *args):
+        """ Simple wrapper to check verbose flag, msg is only formatted with args if shown """
         if self.verbose:
-            print(msg)
+            print(msg.format(*args) if args else msg)
 
-    def _debug(self, msg):
-        """ Simple wrapper to check debug flag """
+    def _debug(self, msg, *args):
+        """ Simple wrapper to check debug flag, msg is only formatted with args if shown """
         if self.debug:
-            print(msg)
+            print(msg.format(*args) if args else msg)
+
+
+RULE_KEYS = {
+    'author': 'author',
+    'journal': 'journal',
+    'discipline': 'discipline',
+    'forc_string': 'forc_string',
+    'forc': 'forc_string',
+    'justify': 'justify_string',
+    'justify_string': 'justify_string',
+}
+
+
+def load_rules(fn):
+    """Load rules from a CSV or YAML file
+
+    CSV files have a header with any of the columns author, journal, discipline,
+    forc_string and justify. YAML files hold a list of mappings with the same keys,
+    optionally under a top level `rules` key. Blank values are ignored.
+
+    Example CSV:
+        author,journal,discipline,forc_string,justify
+        gee,,astro,,
+        ,optics express,photonics,,
+        spence,,,0205,Development of Raman lasers
+
+    Args:
+        fn (str): Rules file name, YAML if it ends with .yaml or .yml
+
+    Returns:
+        list(dict): Rules in file order with keys matching `EraFixer.apply_rule`
+    """
+    if fn.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise Exception("PyYAML is required for YAML rules files")
+
+        with open(fn) as f:
+            raw_rules = yaml.safe_load(f) or list()
+
+        if isinstance(raw_rules, dict):
+            raw_rules = raw_rules.get('rules', list())
+    else:
+        raw_rules = pd.read_csv(fn, dtype=str, keep_default_na=False).to_dict('records')
+
+    rules = list()
+    for raw_rule in raw_rules:
+        rule = dict()
+        for key, value in raw_rule.items():
+            if key not in RULE_KEYS:
+                raise Exception("Unknown rule key '{}' in {}".format(key, fn))
+
+            if value is not None and str(value).strip() > '':
+                rule[RULE_KEYS[key]] = str(value).strip()
+
+        rules.append(rule)
+
+    return rules
+
+
+def apply_rules_to_workbooks(fns, rules, workers=None, incremental=False, **kwargs):
+    """Apply the same rules to each of several workbooks on a process pool
+
+    Each worker loads, applies the rules to and saves one workbook, so the
+    workbooks are processed in parallel. A workbook that fails is reported in its
+    result and doesn't stop the others.
+
+    Args:
+        fns (list(str)): Excel file names
+        rules (list(dict)): Rules, see `load_rules`
+        workers (int, optional): Number of processes, 1 processes the workbooks one
+            after another, default the number of CPUs
+        incremental (bool, optional): Save with `incremental`, see `EraFixer.save`
+        **kwargs: Other `EraFixer` arguments, e.g. sheet_index, which must be given
+            for workbooks with more than one sheet
+
+    Returns:
+        list(dict): Result of each workbook in order of fns, with fn, rows, matches
+            (number of matching rows of each rule), seconds and error (None if it succeeded)
+    """
+    if workers == 1 or len(fns) < 2:
+        return [_apply_rules_to_workbook(fn, rules, incremental, kwargs) for fn in fns]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_apply_rules_to_workbook, fn, rules, incremental, kwargs) for fn in fns]
+        return [future.result() for future in futures]
+
+
+def _apply_rules_to_workbook(fn, rules, incremental, kwargs):
+    """ Load, apply rules to and save a single workbook for `apply_rules_to_workbooks` """
+    start = time.perf_counter()
+    result = {'fn': fn, 'rows': None, 'matches': None, 'seconds': None, 'error': None}
+    try:
+        erafixer = EraFixer(fn=fn, **kwargs)
+        result['matches'] = [rule_result['matches'] for rule_result in erafixer.apply_rules(rules)]
+        erafixer.save(incremental=incremental)
+        result['rows'] = len(erafixer.df)
+    except SystemExit:
+        # EraFixer exits on workbooks it can't open, after printing why
+        result['error'] = "Can't open workbook"
+    except Exception as e:
+        result['error'] = str(e) or type(e).__name__
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def print_workbook_results(results, rules):
+    """ Print the matches of each workbook and of each rule over all workbooks
+
+    Args:
+        results (list(dict)): Output of `apply_rules_to_workbooks`
+        rules (list(dict)): The rules that were applied
+    """
+    print("{:<40} {:>8} {:>8} {:>8}".format('workbook', 'rows', 'matches', 'seconds'))
+    for result in results:
+        if result['error']:
+            print("{:<40} failed: {}".format(result['fn'], result['error']))
+        else:
+            print("{:<40} {:>8} {:>8} {:>8.1f}".format(
+                result['fn'], result['rows'], sum(result['matches']), result['seconds']))
+
+    print()
+    done = [result for result in results if not result['error']]
+    for i, rule in enumerate(rules):
+        matches = [result['matches'][i] for result in done]
+        rule = ', '.join('{}={}'.format(key, value) for key, value in rule.items())
+        print("{:>4} {:>6} matches in {:>3} workbooks  {}".format(
+            i + 1, sum(matches), sum(1 for count in matches if count), rule))
+
+
+def write_profile(erafixer, fn):
+    """ Write the phase timings of erafixer as JSON
+
+    Args:
+        erafixer (`EraFixer`): EraFixer created with profile=True
+        fn (str): Output file name, '-' for stdout
+    """
+    report = erafixer.profile.report()
+    report.update(fn=erafixer.fn, rows=len(erafixer.df))
+
+    if fn == '-':
+        print(json.dumps(report, indent=2))
+    else:
+        with open(fn, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def replay_log(fn, log_fn, save_name, verbose=False, debug=False):
+    """ Replay an operation log onto a copy of the workbook it was started on
+
+    Args:
+        fn (str): Workbook the log was started on, e.g. the original export
+        log_fn (str): Operation log file name
+        save_name (str): File name of the copy, overwritten if it exists
+        verbose (bool, optional): Show some output, default False
+        debug (bool, optional): Show lots of output, default False
+
+    Returns:
+        `EraFixer`: EraFixer of the saved copy
+    """
+    log = OperationLog(fn, path=log_fn)
+    if log.base is None:
+        raise Exception("Operation log {} is empty".format(log_fn))
+
+    if log.base['sha1'] != file_sha1(fn):
+        raise Exception("{} is not the workbook {} was started on".format(fn, log_fn))
+
+    shutil.copy(fn, save_name)
+    erafixer = EraFixer(save_name, sheet_index=log.base['sheet_index'], verbose=verbose, debug=debug)
+    erafixer.replay(log.records)
+    erafixer.save()
+
+    return erafixer
+
+
+def print_history(oplog):
+    """ Print the operations of an operation log
+
+    Args:
+        oplog (`OperationLog`): Operation log
+    """
+    for record, undone in oplog.operations():
+        args = ', '.join('{}={}'.format(key, value) for key, value in record['args'].items() if value is not None)
+        print("{:>4} {} {:<20} {:>6} rows  {}{}".format(
+            record['seq'], record['time'], record['op'], len(record['rows']), args, '  (undone)' if undone else ''))
+
+
+def print_dry_run(report):
+    """ Print the cells a dry run would have changed
+
+    Args:
+        report (dict): Report of `EraFixer.dry_run`
+    """
+    print("Dry run, the workbook was not changed")
+    for column, cells in report['columns'].items():
+        print("{:>8} cells  {}".format(cells, column))
+    print("{:>8} rows".format(report['rows']))
+
+
+def print_rule_results(results):
+    """ Print the number of matching rows for each rule
+
+    Args:
+        results (list(dict)): Output of `EraFixer.apply_rules`
+    """
+    for i, result in enumerate(results):
+        rule = ', '.join('{}={}'.format(key, value) for key, value in result.items()
+                         if key not in ['matches', 'error'])
+        error = '  ({})'.format(result['error']) if result.get('error') else ''
+        print("{:>4} {:>6} matches  {}{}".format(i + 1, result['matches'], rule, error))
+
+
+def load_journal_list(fn):
+    """ Load journal keywords per discipline from a rules file
+
+    Args:
+        fn (str): CSV or YAML file with journal and discipline columns, see `load_rules`
+
+    Returns:
+        dict: Discipline to a list of journal keywords, in file order
+    """
+    journal_disciplines = dict()
+    for rule in load_rules(fn):
+        if set(rule) != {'journal', 'discipline'}:
+            raise Exception("Journal list entries need a journal and a discipline only: {}".format(rule))
+
+        journal_disciplines.setdefault(rule['discipline'], list()).append(rule['journal'])
+
+    return journal_disciplines
+
+
+def load_concordance(fn):
+    """Load a concordance of old to new FOR codes from a CSV file
+
+    The header has the columns old, new and optionally weight. An old code listed
+    more than once is split between its new codes by their weights, which don't
+    need to add up to anything. A blank new code marks a retired code.
+
+    Example CSV:
+        old,new,weight
+        0201,0201,
+        0299,0201,3
+        0299,0206,1
+        0906,,
+
+    Args:
+        fn (str): Concordance file name
+
+    Returns:
+        list(dict): Mappings with old, new and weight, blanks as None
+    """
+    raw = pd.read_csv(fn, dtype=str, keep_default_na=False)
+    unknown = [col for col in raw.columns if col not in ['old', 'new', 'weight']]
+    if unknown or 'old' not in raw or 'new' not in raw:
+        raise Exception("Concordance {} needs old, new and weight columns only, found {}".format(
+            fn, list(raw.columns)))
+
+    concordance = list()
+    for i, mapping in enumerate(raw.to_dict('records')):
+        old = _canonical_code(mapping['old'])
+        new = _canonical_code(mapping['new'])
+        weight = mapping.get('weight', '').strip()
+        if pd.isnull(old):
+            raise Exception("No old code on line {} of {}".format(i + 2, fn))
+
+        try:
+            weight = float(weight) if weight else None
+        except ValueError:
+            raise Exception("Weight '{}' on line {} of {} is not a number".format(weight, i + 2, fn))
+
+        concordance.append({'old': old, 'new': None if pd.isnull(new) else new, 'weight': weight})
+
+    pairs = [(mapping['old'], mapping['new']) for mapping in concordance]
+    if len(set(pairs)) != len(pairs):
+        raise Exception("Concordance {} maps a code to the same new code more than once".format(fn))
+
+    return concordance
+
+
+def _concordance_table(concordance):
+    """Concordance as a table of old and new codes with the weights of each old code adding to 1
+
+    Old codes that are retired or split without weights are marked ambiguous.
+    """
+    table = pd.DataFrame(concordance, columns=['old', 'new', 'weight'])
+    table['weight'] = pd.to_numeric(table['weight'])
+
+    # A single new code doesn't need a weight
+    targets = table.groupby('old')['new'].transform('size')
+    table['weight'] = table['weight'].where(table['weight'].notnull() | (targets > 1), 1.0)
+
+    table['ambiguous'] = (table['new'].isnull() | ~(table['weight'] > 0)).groupby(table['old']).transform('any')
+    table['weight'] = table['weight'] / table.groupby('old')['weight'].transform('sum')
+
+    return table.astype({'old': object, 'new': object})
+
+
+def print_concordance_results(result):
+    """ Print the rows remapped by `EraFixer.apply_concordance` """
+    print("{:>6} carried forward rows".format(result['matched']))
+    print("{:>6} rows remapped".format(result['remapped']))
+    print("{:>6} rows with the concordance applied, set to HANDLED=4".format(result['matched'] - result['ambiguous']))
+    print("{:>6} rows with ambiguous mappings, set to HANDLED=3".format(result['ambiguous']))
+
+
+def print_journal_results(assigned, conflicts):
+    """ Print the number of rows set for each discipline and the conflicting rows
+
+    Args:
+        assigned (dict): Discipline to matching indices, from `EraFixer.set_journal_disciplines`
+        conflicts (dict): Index to disciplines, from `EraFixer.set_journal_disciplines`
+    """
+    for disc, indices in assigned.items():
+        print("{:>6} rows  {}".format(len(indices), disc))
+
+    if conflicts:
+        print("{} rows match journals of more than one discipline:".format(len(conflicts)))
+        for idx, discs in conflicts.items():
+            print("{:>6}  {}".format(idx, ', '.join(str(disc) for disc in discs)))
+
+
+def _excel_value(value):
+    """ Convert a cell value read by openpyxl the way pandas does, blanks become '' """
+    if value is None:
+        return ''
+    elif isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+
+def _excel_column(values):
+    """ Column as written to Excel, categoricals as objects and float32 as the shortest decimal
+
+    Args:
+        values (`pandas.Series`): Column of the working DataFrame
+
+    Returns:
+        `pandas.Series`: Column ready to be written, e.g. 33.3 rather than 33.29999923706055
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(object)
+    elif values.dtype == np.float32:
+        return pd.Series(values.to_numpy().astype(str), index=values.index).astype('float64')
+
+    return values
+
+
+def _snapshot(df):
+    """ Copy of df that later changes to df don't reach, shallow with copy-on-write """
+    if int(pd.__version__.split('.')[0]) >= 3 or getattr(pd.options.mode, 'copy_on_write', False) is True:
+        return df.copy(deep=False)
+
+    return df.copy()
+
+
+def _save_at_exit(ref):
+    """ Finish the background saves of an `EraFixer` that is still alive at exit """
+    erafixer = ref()
+    if erafixer is not None:
+        erafixer._save_at_exit()
+
+
+def _merge_dirty(dirty, other):
+    """ Add the changed rows of other to dirty, both column to a set of row ids """
+    for column, rows in other.items():
+        dirty[column].update(rows)
+
+
+def _write_excel(df, save_name):
+    """ Write df with its index to a new Excel file, module level so it can run in a process pool """
+    writer = pd.ExcelWriter(save_name, engine='xlsxwriter')
+    df.to_excel(writer)
+    writer.close()
+
+
+# Operations recorded in the `OperationLog`, with the `EraFixer` method applying
+# each to a mask of the matched rows
+OPERATIONS = {
+    'set_discipline': '_set_discipline_rows',
+    'carry_forward_forcs': '_carry_forward_rows',
+    'set_forc_string': '_set_forc_string_rows',
+    'apply_concordance': '_apply_concordance_rows',
+}
 
 
 if __name__ == '__main__':
     import argparse
+    import glob
 
     parser = argparse.ArgumentParser(
         description="Process and update ERA codes")
-    parser.add_argument('ERAFILE', help='ERA file as excel spreadsheet')
+    parser.add_argument('ERAFILE', nargs='+',
+                        help='ERA file as excel spreadsheet, several files or glob patterns with --rules '
+                        'apply the rules to each workbook on a process pool')
     parser.add_argument('--detect_author', dest='author',
                         help='Part of the author name in AUTHOR column, should be unique substring')
     parser.add_argument('--detect_journal', dest='journal',
@@ -652,14 +2482,66 @@ if __name__ == '__main__':
     parser.add_argument('--split_disciplines', action='store_true',
                         help='Split ERAFILE into different files called <PREFIX>_<DISC>.xlsx for each discipline')
     parser.add_argument('--prefix', help='Prefix for split-disciplines')
+    parser.add_argument('--workers', default=None, type=int,
+                        help='Number of processes writing split-disciplines files or processing several '
+                        'workbooks, default the number of CPUs')
     parser.add_argument('--carry_forward_forcs', action='store_true',
                         help='Carry 2015 codes forward into the corresponding 2018 columns')
+    parser.add_argument('--concordance', metavar='FILE',
+                        help='Remap the 2018 codes of carried forward rows with a CSV of old,new,weight codes, '
+                             'after --carry_forward_forcs if given. Remapped rows get HANDLED=4 and ambiguous rows '
+                             'HANDLED=3')
     parser.add_argument('--set_forc', dest='forc_string',
                         help='Apply the FORC string')
     parser.add_argument('--justify', dest='justify_string',
                         help='Justification string [optional for --set_forc]')
     parser.add_argument('--sheet_index', default=None, type=int,
                         help="Excel sheet to use, defaults to first sheet")
+    parser.add_argument('--cache', action='store_true', default=False,
+                        help="Cache the parsed sheet next to ERAFILE to skip parsing on later runs")
+    parser.add_argument('--low_memory', action='store_true', default=False,
+                        help="Only read the columns used by ERAFixer, the others are left untouched on save")
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help="Only write changed cells back to the workbook, keeping its formatting")
+    parser.add_argument('--rules',
+                        help='CSV or YAML file of author/journal, discipline, forc_string, justify rules to '
+                        'apply in order, saving once at the end')
+    parser.add_argument('--journals',
+                        help='CSV or YAML file of journal keyword, discipline pairs to match in a single pass, '
+                        'rows matching journals of several disciplines are reported and left unset')
+    parser.add_argument('--profile', metavar='FILE',
+                        help="Write the time, rows changed and peak memory of each phase as JSON to FILE, "
+                        "'-' for stdout")
+    parser.add_argument('--serve', metavar='SOCKET',
+                        help="Keep ERAFILE in memory and apply commands sent with --connect to the Unix socket "
+                        "SOCKET, '-' reads JSON requests from stdin")
+    parser.add_argument('--flush_interval', default=60, type=float,
+                        help="Seconds between saves of a --serve session, 0 only saves on --flush, default 60")
+    parser.add_argument('--connect', metavar='SOCKET',
+                        help="Send the command to the session served on SOCKET instead of running it")
+    parser.add_argument('--flush', action='store_true', default=False,
+                        help="Save the workbook of a --connect session")
+    parser.add_argument('--shutdown', action='store_true', default=False,
+                        help="Save the workbook and stop a --connect session")
+    parser.add_argument('--oplog', action='store_true', default=False,
+                        help="Record changes in ERAFILE.oplog instead of saving ERAFILE, see --materialize")
+    parser.add_argument('--materialize', action='store_true', default=False,
+                        help="Save ERAFILE with the changes recorded in ERAFILE.oplog")
+    parser.add_argument('--undo', action='store_true', default=False,
+                        help="Undo the last operation recorded in ERAFILE.oplog")
+    parser.add_argument('--history', action='store_true', default=False,
+                        help="List the operations recorded in ERAFILE.oplog")
+    parser.add_argument('--replay', nargs=2, metavar=('OPLOG', 'OUTPUT'),
+                        help="Replay OPLOG onto ERAFILE, the workbook it was started on, saving the result to OUTPUT")
+    parser.add_argument('--store', action='store_true', default=False,
+                        help="Work on ERAFILE.store, shared with other processes, instead of saving ERAFILE")
+    parser.add_argument('--export', action='store_true', default=False,
+                        help="Save ERAFILE with the changes in ERAFILE.store, requires --store")
+    parser.add_argument('--summary', action='store_true', default=False,
+                        help="Print the rows per HANDLED state and DISCIPLINE and the apportioned rows per FOR code, "
+                             "after any command")
+    parser.add_argument('--dry_run', action='store_true', default=False,
+                        help="Report the cells the command would change without saving ERAFILE")
     parser.add_argument('--verbose', action='store_true', default=False,
                         help="Show some output, default false")
     parser.add_argument('--debug', action='store_true', default=False,
@@ -667,8 +2549,23 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    if not os.path.exists(args.ERAFILE):
-        parser.error("File does not exist")
+    # Patterns are expanded here too, for shells that don't
+    workbooks = [fn for pattern in args.ERAFILE for fn in sorted(glob.glob(pattern)) or [pattern]]
+    for fn in workbooks:
+        if not os.path.exists(fn):
+            parser.error("File does not exist: {}".format(fn))
+
+    args.ERAFILE = workbooks[0]
+    args.workbooks = workbooks if len(workbooks) > 1 else None
+
+    if args.workbooks and not args.rules:
+        parser.error(
+            "Several workbooks can only be processed with --rules")
+
+    if args.workbooks and (args.oplog or args.materialize or args.undo or args.history or args.replay or
+                           args.serve or args.connect or args.profile):
+        parser.error(
+            "Several workbooks can't be combined with the operation log, session or profile options")
 
     # Do some argument checking
     if ((args.author and not args.forc_string) and not args.discipline):
@@ -692,14 +2589,96 @@ if __name__ == '__main__':
             "The justify string is only used with the --set_forc option")
 
     if args.forc_string:
-        match = forc_re.match(args.forc_string)
-        if match is None:
-            parser.error("FORC_STRING not valid")
+        error = parse_forc_strings(pd.Series([args.forc_string]))['error'].iloc[0]
+        if error is not None:
+            parser.error(error)
 
-    if not ((args.author and args.discipline) or
+    if args.rules and (args.author or args.journal or args.discipline or args.split_disciplines or
+                       args.carry_forward_forcs or args.concordance or args.forc_string):
+        parser.error(
+            "The --rules option can't be combined with other commands")
+
+    if args.rules and not os.path.exists(args.rules):
+        parser.error("Rules file does not exist")
+
+    if args.journals and (args.rules or args.author or args.journal or args.discipline or args.split_disciplines or
+                          args.carry_forward_forcs or args.concordance or args.forc_string):
+        parser.error(
+            "The --journals option can't be combined with other commands")
+
+    if args.journals and not os.path.exists(args.journals):
+        parser.error("Journals file does not exist")
+
+    if args.concordance and (args.author or args.journal or args.discipline or args.split_disciplines or
+                             args.forc_string):
+        parser.error(
+            "The --concordance option can only be combined with --carry_forward_forcs")
+
+    if args.concordance and not os.path.exists(args.concordance):
+        parser.error("Concordance file does not exist")
+
+    if args.connect and args.concordance:
+        parser.error(
+            "The --concordance option can't be sent to a session")
+
+    if args.connect and args.journals:
+        parser.error(
+            "The --journals option can't be sent to a session")
+
+    if args.serve and (args.rules or args.journals or args.author or args.journal or args.discipline or
+                       args.split_disciplines or args.carry_forward_forcs or args.concordance or args.forc_string):
+        parser.error(
+            "The --serve option can't be combined with other commands, send them with --connect")
+
+    if args.connect and args.rules:
+        parser.error(
+            "The --rules option can't be sent to a session")
+
+    if (args.flush or args.shutdown) and not args.connect:
+        parser.error(
+            "The --flush and --shutdown options require --connect to be set")
+
+    if args.connect and (args.oplog or args.materialize or args.undo or args.history or args.replay):
+        parser.error(
+            "The operation log options can't be sent to a session")
+
+    if args.replay and not os.path.exists(args.replay[0]):
+        parser.error("Operation log does not exist")
+
+    if args.export and not args.store:
+        parser.error(
+            "The --export option requires --store to be set")
+
+    if args.store and (args.low_memory or args.oplog or args.materialize or args.undo or args.history or
+                       args.replay or args.connect or args.workbooks):
+        parser.error(
+            "The --store option can't be combined with --low_memory, the operation log options, "
+            "--connect or several workbooks")
+
+    if args.summary and (args.serve or args.history or args.replay or args.workbooks):
+        parser.error(
+            "The --summary option can't be combined with --serve, --history, --replay or several workbooks")
+
+    if args.dry_run and (args.split_disciplines or args.serve or args.connect or args.materialize or args.undo or
+                         args.history or args.replay or args.workbooks):
+        parser.error(
+            "The --dry_run option only applies to commands that change the working sheet")
+
+    if not (args.rules or
+            args.journals or
+            args.serve or
+            args.materialize or
+            args.undo or
+            args.history or
+            args.replay or
+            args.export or
+            args.summary or
+            (args.connect and (args.flush or args.shutdown)) or
+            (args.author and args.discipline) or
             (args.journal and args.discipline) or
             (args.split_disciplines and args.prefix) or
             args.carry_forward_forcs or
+            args.concordance or
             args.forc_string
             ):
         parser.print_help()
@@ -0,0 +1,63 @@
+""" Find many keywords in a string at once, see `KeywordMatcher` """
+
+import re
+
+
+class KeywordMatcher(object):
+    """ Find all of a list of keywords in a string with a single regular expression
+
+    The keywords are compiled into a trie shaped alternation inside a lookahead, so
+    each position of the string gives the longest keyword starting there. The shorter
+    keywords starting at the same position are its prefixes, which are added from a
+    lookup table.
+
+    Args:
+        keywords (list(str)): Keywords, matched case sensitive, empty keywords are ignored
+    """
+
+    def __init__(self, keywords):
+        self.keywords = [keyword for keyword in dict.fromkeys(keywords) if keyword]
+        self._order = {keyword: i for i, keyword in enumerate(self.keywords)}
+        self._prefixes = {
+            keyword: [other for other in self.keywords if keyword.startswith(other)]
+            for keyword in self.keywords
+        }
+
+        trie = dict()
+        for keyword in self.keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, dict())
+            node[''] = True
+
+        self._re = re.compile('(?=({}))'.format(self._trie_pattern(trie))) if self.keywords else None
+
+    def find(self, text):
+        """ Keywords contained in text
+
+        Args:
+            text (str): String to search
+
+        Returns:
+            list(str): Keywords found, in the order they were given
+        """
+        if self._re is None:
+            return list()
+
+        found = set()
+        for match in self._re.finditer(text):
+            found.update(self._prefixes[match.group(1)])
+
+        return sorted(found, key=self._order.get)
+
+    def _trie_pattern(self, node):
+        branches = [re.escape(char) + self._trie_pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+
+        pattern = branches[0] if len(branches) == 1 else '(?:{})'.format('|'.join(branches))
+        if '' in node:
+            # A keyword ends here, longer keywords are tried first
+            pattern = '(?:{})?'.format(pattern)
+
+        return pattern
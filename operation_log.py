@@ -0,0 +1,179 @@
+""" Append-only log of the operations applied to a workbook, see `OperationLog` """
+
+import datetime
+import json
+import os
+import threading
+
+from sheet_cache import file_sha1
+
+
+class OperationLog(object):
+    """ Append-only log of the operations applied to a workbook, stored next to it
+
+    The log lives in `<fn>.oplog` with one JSON record per line, each with a 'type':
+        * 'base': first record, the SHA-1 and sheet index of the workbook the log
+          was started on
+        * 'op': one of `erafixer.OPERATIONS` with its arguments, the matched row ids and the
+          previous values of the cells it changed, numbered by 'seq'
+        * 'undo': the seq of an operation that was undone
+        * 'checkpoint': the SHA-1 of the workbook after a save and the number of
+          records saved in it
+
+    Records are cheap to append, so the workbook only needs saving on demand. The
+    records after the base or checkpoint matching the workbook on disk are the
+    changes not saved in it yet. Replaying all records onto the original workbook
+    gives the same result, as operations are applied to the rows they matched.
+
+    A partly written last line, e.g. after a crash, is dropped.
+
+    Args:
+        fn (str): Excel file name
+        path (str, optional): Log file name, default `<fn>.oplog`
+    """
+    version = 1
+
+    def __init__(self, fn, path=None):
+        self.fn = fn
+        self.path = path or fn + '.oplog'
+        self.records = list()
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            self._read()
+
+    @property
+    def base(self):
+        return self.records[0] if self.records else None
+
+    def start(self, sheet_index):
+        """ Start the log on the workbook, or check it belongs to the workbook
+
+        Args:
+            sheet_index (int): Sheet index of the working sheet
+
+        Returns:
+            list(dict): Records not saved in the workbook yet
+
+        Raises:
+            Exception: The log is for another sheet or the workbook has been changed
+                outside the log
+        """
+        sha1 = file_sha1(self.fn)
+        if self.base is None:
+            self.append({'type': 'base', 'version': self.version, 'sha1': sha1, 'sheet_index': sheet_index})
+            return list()
+
+        if self.base.get('version') != self.version:
+            raise Exception("{} has version {}, expected {}".format(
+                self.path, self.base.get('version'), self.version))
+
+        if self.base['sheet_index'] != sheet_index:
+            raise Exception("{} was started on sheet index {}, not {}".format(
+                self.path, self.base['sheet_index'], sheet_index))
+
+        # Latest saved state matching the workbook
+        for i in range(len(self.records) - 1, -1, -1):
+            if self.records[i]['type'] in ['base', 'checkpoint'] and self.records[i]['sha1'] == sha1:
+                saved = self.records[i].get('records', i + 1)
+                return [record for record in self.records[saved:] if record['type'] in ['op', 'undo']]
+
+        raise Exception("{} has been changed outside of {}".format(self.fn, self.path))
+
+    def record_operation(self, name, args, rows, before):
+        """ Append an operation
+
+        Args:
+            name (str): Operation name, a key of `erafixer.OPERATIONS`
+            args (dict): Keyword arguments of the operation
+            rows (list): Matched row ids
+            before (dict): Column to a dict of row id to the value before the operation
+
+        Returns:
+            dict: Appended record
+        """
+        seq = 1 + sum(1 for record in self.records if record['type'] == 'op')
+        record = {
+            'type': 'op',
+            'seq': seq,
+            'op': name,
+            'args': args,
+            'rows': rows,
+            'before': {column: [list(values), list(values.values())] for column, values in before.items()},
+        }
+        return self.append(record)
+
+    def record_undo(self, seq):
+        """ Append the undo of operation seq """
+        self.append({'type': 'undo', 'seq': seq})
+
+    def checkpoint(self, records=None):
+        """Append the hash of the workbook after it has been saved
+
+        Args:
+            records (int, optional): Number of records saved in the workbook, less than
+                all of them when operations were logged during a background save, default all
+        """
+        records = len(self.records) if records is None else records
+        self.append({'type': 'checkpoint', 'sha1': file_sha1(self.fn), 'records': records})
+
+    def operation(self, seq):
+        """ Record of operation seq """
+        for record in self.records:
+            if record['type'] == 'op' and record['seq'] == seq:
+                return record
+
+        raise Exception("No operation {} in {}".format(seq, self.path))
+
+    def operations(self):
+        """ All operations with whether they have been undone
+
+        Returns:
+            list(tuple(dict, bool)): Record and undone for each operation, in order
+        """
+        undone = set(record['seq'] for record in self.records if record['type'] == 'undo')
+
+        return [(record, record['seq'] in undone) for record in self.records if record['type'] == 'op']
+
+    def last_operation(self):
+        """ Record of the last operation that hasn't been undone, None if there is none """
+        operations = [record for record, undone in self.operations() if not undone]
+
+        return operations[-1] if operations else None
+
+    def append(self, record):
+        """ Append a record with the current time and flush it to disk
+
+        Returns:
+            dict: Appended record
+        """
+        record = dict(record, time=datetime.datetime.now().isoformat(timespec='seconds'))
+
+        # Checkpoints of background saves are appended from another thread
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.records.append(record)
+
+        return record
+
+    def _read(self):
+        """ Read the records, truncating a partly written last line """
+        with open(self.path, 'rb') as f:
+            lines = f.readlines()
+
+        # Records are written with their newline, a crash while appending leaves a line without one
+        if lines and not lines[-1].endswith(b'\n'):
+            print("Dropping a partly written record from {}".format(self.path))
+            lines.pop()
+            with open(self.path, 'r+b') as f:
+                f.truncate(sum(len(line) for line in lines))
+
+        for i, line in enumerate(lines):
+            try:
+                self.records.append(json.loads(line))
+            except ValueError:
+                raise Exception("Invalid record on line {} of {}".format(i + 1, self.path))
@@ -0,0 +1,97 @@
+""" Timings of the phases of an `erafixer.EraFixer` run, see `Profile` """
+
+import contextlib
+import sys
+import threading
+import time
+
+
+class Profile(object):
+    """ Timings of the phases of an `erafixer.EraFixer` run
+
+    Each phase (e.g. 'parse_sheet', 'match', 'write_sheet:<name>') records its number
+    of calls, the time spent, the rows changed through `erafixer.EraFixer._assign` and the peak
+    resident memory of the process when it last ended. Phases nest, e.g. 'match' is
+    part of 'set_discipline', and the totals of each include the nested ones.
+    Background saves record their phases from their own thread.
+    """
+
+    def __init__(self):
+        self.phases = dict()
+        self._start = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _touched(self):
+        """ Rows touched in each open phase of this thread, background saves have their own phases """
+        if not hasattr(self._local, 'touched'):
+            self._local.touched = list()
+
+        return self._local.touched
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Context manager timing the phase name
+
+        Args:
+            name (str): Phase name
+        """
+        touched = [None]
+        self._touched.append(touched)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._touched.pop()
+
+            rows_touched = 0 if touched[0] is None else int(touched[0].sum())
+            peak_rss_mb = _peak_rss_mb()
+
+            with self._lock:
+                phase = self.phases.setdefault(name, {'name': name, 'calls': 0, 'seconds': 0.0, 'rows_touched': 0})
+                phase['calls'] += 1
+                phase['seconds'] += seconds
+                phase['rows_touched'] += rows_touched
+                phase['peak_rss_mb'] = peak_rss_mb
+
+    def touch(self, mask):
+        """ Record the rows changed in the open phases
+
+        Args:
+            mask (`numpy.ndarray`): Boolean array of changed rows
+        """
+        for touched in self._touched:
+            if touched[0] is None or touched[0].shape != mask.shape:
+                touched[0] = mask.copy()
+            else:
+                touched[0] |= mask
+
+    def report(self):
+        """ Summary of all phases
+
+        Returns:
+            dict: total_seconds, peak_rss_mb and phases, a list of dicts in order of first use
+        """
+        with self._lock:
+            phases = [dict(phase) for phase in self.phases.values()]
+
+        return {
+            'total_seconds': time.perf_counter() - self._start,
+            'peak_rss_mb': _peak_rss_mb(),
+            'phases': phases,
+        }
+
+
+def _peak_rss_mb():
+    """ Peak resident memory of the process in MB, None where not available """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
@@ -0,0 +1,226 @@
+""" Long running session holding one `EraFixer` in memory
+
+Commands sent to a session are applied to the already parsed workbook, so they
+don't pay for parsing and saving the Excel file each time. Changes are written
+to disk on a `save` command, on a timer and when the session is shut down.
+
+The protocol is one JSON object per line in each direction, over a Unix socket
+or stdin/stdout. Requests have a 'command' key:
+
+    {"command": "rule", "author": "Gee", "discipline": "0201"}
+    {"command": "carry_forward_forcs"}
+    {"command": "split_disciplines", "prefix": "split"}
+    {"command": "save"}
+    {"command": "status"}
+    {"command": "summary"}
+    {"command": "shutdown"}
+
+'rule' takes the same keys as `EraFixer.apply_rule` and 'summary' answers with
+`Summary.report` of the session's `EraFixer`. Every request may also give
+'fn', which must be the workbook held by the session, and 'summary': true to
+get that report under 'summary' after any command. Responses have 'ok' and
+either the result of the command or an 'error' message.
+"""
+
+import contextlib
+import json
+import os
+import socket
+import sys
+import threading
+
+
+class Session(object):
+    """ Apply commands to a single `EraFixer`
+
+    Args:
+        fixer (`erafixer.EraFixer`): Parsed workbook
+        flush_interval (float, optional): Seconds between saves of pending changes,
+            0 only saves on request, default 60
+        incremental (bool, optional): Save with `incremental`, see `EraFixer.save`
+    """
+
+    def __init__(self, fixer, flush_interval=60, incremental=False):
+        self.fixer = fixer
+        self.flush_interval = flush_interval
+        self.incremental = incremental
+
+        self.running = True
+        self.pending = 0
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._timer = None
+
+        if flush_interval:
+            self._timer = threading.Thread(target=self._flush_loop, daemon=True)
+            self._timer.start()
+
+    def handle(self, request):
+        """ Apply a single request
+
+        Args:
+            request (dict): Decoded request, see module docstring
+
+        Returns:
+            dict: Response
+        """
+        try:
+            command = request.get('command')
+            fn = request.get('fn')
+            if fn and os.path.abspath(fn) != os.path.abspath(self.fixer.fn):
+                raise Exception("Session holds {}, not {}".format(self.fixer.fn, fn))
+
+            with self._lock:
+                response = self._handle(command, request)
+                if request.get('summary') and command != 'summary':
+                    response['summary'] = self.fixer.get_summary().report()
+
+                return response
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def _handle(self, command, request):
+        """ Apply a single command, see `handle` """
+        if command == 'rule':
+            rule = {key: request.get(key) for key in
+                    ['author', 'journal', 'discipline', 'forc_string', 'justify_string']}
+            matches = self.fixer.apply_rule(**rule)
+            if matches is None:
+                raise Exception("Rule has nothing to do: {}".format(rule))
+
+            self.pending += 1
+            return {'ok': True, 'matches': len(matches)}
+        elif command == 'carry_forward_forcs':
+            matches = self.fixer.carry_forward_forcs()
+            self.pending += 1
+            return {'ok': True, 'matches': len(matches)}
+        elif command == 'split_disciplines':
+            saved = self.fixer.split_disciplines(request['prefix'], workers=request.get('workers'))
+            return {'ok': True, 'saved': saved}
+        elif command == 'save':
+            return {'ok': True, 'saved': self.flush()}
+        elif command == 'status':
+            return {'ok': True, 'fn': self.fixer.fn, 'rows': len(self.fixer.df), 'pending': self.pending}
+        elif command == 'summary':
+            return dict(self.fixer.get_summary().report(), ok=True)
+        elif command == 'shutdown':
+            self.running = False
+            return {'ok': True, 'saved': self.flush()}
+        else:
+            raise Exception("Unknown command: {}".format(command))
+
+    def flush(self):
+        """ Save the workbook if any command has changed it
+
+        Returns:
+            str: Saved file name, None if there was nothing to save
+        """
+        with self._lock:
+            if not self.pending:
+                return None
+
+            save_name = self.fixer.save(incremental=self.incremental)
+            self.pending = 0
+
+            return save_name
+
+    def close(self):
+        """ Stop the timer and save pending changes """
+        self._stopped.set()
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print("Can't save: {}".format(e), file=sys.stderr)
+
+
+def serve(session, address):
+    """ Serve session until it is shut down
+
+    Args:
+        session (`Session`): Session to serve
+        address (str): Path of the Unix socket, '-' for stdin/stdout
+    """
+    try:
+        if address == '-':
+            serve_stdio(session)
+        else:
+            serve_socket(session, address)
+    finally:
+        session.close()
+
+
+def serve_socket(session, path):
+    """ Serve session on a Unix socket, one connection at a time
+
+    Args:
+        session (`Session`): Session to serve
+        path (str): Path of the socket, removed on exit
+    """
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    print("Serving {} on {}".format(session.fixer.fn, path))
+
+    try:
+        while session.running:
+            conn, _ = server.accept()
+            with conn, conn.makefile('r') as lines, conn.makefile('w') as out:
+                _serve_lines(session, lines, out)
+    finally:
+        server.close()
+        os.remove(path)
+
+
+def serve_stdio(session):
+    """ Serve session on stdin/stdout, other output is sent to stderr
+
+    Args:
+        session (`Session`): Session to serve
+    """
+    out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        _serve_lines(session, sys.stdin, out)
+
+
+def send(path, request):
+    """ Send a single request to a session served on a Unix socket
+
+    Args:
+        path (str): Path of the socket
+        request (dict): Request, see module docstring
+
+    Returns:
+        dict: Response
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(path)
+        with conn.makefile('w') as out, conn.makefile('r') as lines:
+            out.write(json.dumps(request) + '\n')
+            out.flush()
+            conn.shutdown(socket.SHUT_WR)
+
+            return json.loads(lines.readline())
+
+
+def _serve_lines(session, lines, out):
+    """ Answer each request line of lines on out until the input ends or the session is shut down """
+    for line in lines:
+        if not line.strip():
+            continue
+
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {'ok': False, 'error': "Invalid request: {}".format(e)}
+        else:
+            response = session.handle(request)
+
+        out.write(json.dumps(response) + '\n')
+        out.flush()
+
+        if not session.running:
+            break
@@ -0,0 +1,330 @@
+""" Working sheet shared between processes through memory-mapped files
+
+Reviewers working on the same workbook from several processes (e.g. notebook
+kernels) open one store instead of each parsing and saving the workbook. The
+store is a directory holding:
+
+    meta.json           Rows, columns and anything the owner wants to keep
+    base.arrow          The sheet as loaded, an uncompressed Arrow file read memory-mapped
+    <i>.col             One memory-mapped array per writable column
+    <i>.values          The distinct values of a 'values' column, one JSON value per line
+    lock                File the locks are taken on
+
+Writable columns are stored by kind: 'int8' and 'float32' columns as arrays of
+that type, other columns as int32 codes (-1 for blank) into their list of values,
+which only grows. Writes go straight into the shared arrays, so every process
+sees them on its next `SharedStore.read`.
+
+Rows are locked with `fcntl` byte-range locks on the lock file, byte i for row i,
+so processes can hold locks on different rows at the same time. The locks are
+held per process, taking a lock twice in the same process always succeeds.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+class SharedStore(object):
+    """ Store of a sheet with writable columns, shared between processes
+
+    Args:
+        path (str): Store directory, opened if it exists, see `create`
+    """
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = None
+        self.columns = dict()
+        self._values = dict()
+        self._lock_fd = None
+        self._held = None
+
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            self._open()
+
+    @property
+    def exists(self):
+        return self.meta is not None
+
+    def create(self, base, columns, meta=None):
+        """Create the store, unless another process has just created it
+
+        Args:
+            base (`pandas.DataFrame`): Sheet with string column names and columns of a
+                single type, written to base.arrow
+            columns (dict): Writable column name to its values, a `pandas.Series` with
+                one entry per row of base
+            meta (dict, optional): Kept in the store meta, see `update_meta`
+        """
+        try:
+            import pyarrow.feather as feather
+        except ImportError:
+            raise Exception("pyarrow is required for a shared store")
+
+        tmp_path = tempfile.mkdtemp(prefix=os.path.basename(self.path) + '.', dir=os.path.dirname(self.path) or '.')
+        try:
+            feather.write_feather(base, os.path.join(tmp_path, 'base.arrow'), compression='uncompressed')
+
+            kinds = dict()
+            for i, (name, values) in enumerate(columns.items()):
+                kinds[name] = _column_kind(values)
+                if kinds[name] == 'values':
+                    codes, distinct = pd.factorize(pd.Series(values).astype(object))
+                    array = codes.astype(np.int32)
+                    with open(os.path.join(tmp_path, '{}.values'.format(i)), 'w') as f:
+                        f.writelines(json.dumps(_json_value(value)) + '\n' for value in distinct)
+                else:
+                    array = pd.Series(values).to_numpy(dtype=kinds[name])
+
+                array.tofile(os.path.join(tmp_path, '{}.col'.format(i)))
+
+            open(os.path.join(tmp_path, 'lock'), 'w').close()
+            with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+                json.dump(dict(meta or dict(), version=self.version, rows=len(base),
+                               columns=[[name, kind] for name, kind in kinds.items()]), f)
+
+            os.rename(tmp_path, self.path)
+        except OSError:
+            # Lost the race to another process, its store is used instead
+            if not os.path.exists(os.path.join(self.path, 'meta.json')):
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self._open()
+
+    def read_base(self):
+        """ The sheet as it was when the store was created, read memory-mapped
+
+        Returns:
+            `pandas.DataFrame`: base as given to `create`
+        """
+        import pyarrow.feather as feather
+
+        return feather.read_table(os.path.join(self.path, 'base.arrow'), memory_map=True).to_pandas()
+
+    def read(self, name):
+        """ Current values of a writable column
+
+        Args:
+            name (str): Column name
+
+        Returns:
+            `numpy.ndarray` or `pandas.Categorical`: Copy of the values, 'values' columns
+                as a categorical
+        """
+        kind, array = self.columns[name]
+        if kind != 'values':
+            return np.array(array)
+
+        return pd.Categorical.from_codes(np.array(array), categories=pd.Index(self._read_values(name), dtype=object))
+
+    def write(self, name, positions, values):
+        """ Set a writable column to values on the rows at positions, locking the rows
+
+        Args:
+            name (str): Column name
+            positions (`numpy.ndarray`): Row positions
+            values: A scalar or one value per position
+
+        Raises:
+            Exception: Some of the rows are locked by another process
+        """
+        kind, array = self.columns[name]
+        values = np.broadcast_to(np.asarray(values, dtype=object), positions.shape)
+
+        with self.lock_rows(positions):
+            if kind == 'values':
+                array[positions] = self._codes(name, values)
+            else:
+                array[positions] = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=kind)
+
+    @contextlib.contextmanager
+    def lock_rows(self, positions, blocking=False):
+        """ Context manager holding the write locks of the rows at positions
+
+        Args:
+            positions (`numpy.ndarray`): Row positions
+            blocking (bool, optional): Wait for rows locked by another process instead
+                of raising, default False
+
+        Raises:
+            Exception: Some of the rows are locked by another process and not blocking
+        """
+        positions = np.unique(positions)
+        new = positions[self._held[positions] == 0]
+        acquired = list()
+        try:
+            for start, length in _runs(new):
+                try:
+                    fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB), length, start)
+                except (BlockingIOError, PermissionError):
+                    raise Exception("Some of rows {} to {} of {} are locked by another process".format(
+                        start, start + length - 1, self.path))
+                acquired.append((start, length))
+
+            self._held[positions] += 1
+            try:
+                yield
+            finally:
+                self._held[positions] -= 1
+        finally:
+            for start, length in acquired:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, length, start)
+
+    @contextlib.contextmanager
+    def lock(self, name):
+        """ Context manager holding the lock name, waiting for other processes holding it
+
+        Args:
+            name (str): 'meta', 'export' or a writable column name
+        """
+        names = ['meta', 'export'] + list(self.columns)
+        offset = self.meta['rows'] + names.index(name)
+
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, offset)
+
+    def read_meta(self):
+        """ Read the store meta again, e.g. after another process updated it
+
+        Returns:
+            dict: Store meta
+        """
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+        return self.meta
+
+    def update_meta(self, **meta):
+        """ Update the store meta with meta, e.g. the hash of the workbook after an export """
+        with self.lock('meta'):
+            self.read_meta()
+            self.meta.update(meta)
+
+            tmp_fn = os.path.join(self.path, 'meta.json.tmp')
+            with open(tmp_fn, 'w') as f:
+                json.dump(self.meta, f)
+
+            os.replace(tmp_fn, os.path.join(self.path, 'meta.json'))
+
+    def flush(self):
+        """ Write the changes in the writable columns to disk """
+        for kind, array in self.columns.values():
+            array.flush()
+
+    def close(self):
+        """ Flush and close the store, releasing any locks held """
+        if self._lock_fd is not None:
+            self.flush()
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _open(self):
+        self.read_meta()
+        if self.meta.get('version') != self.version:
+            raise Exception("{} has version {}, expected {}".format(
+                self.path, self.meta.get('version'), self.version))
+
+        rows = self.meta['rows']
+        for i, (name, kind) in enumerate(self.meta['columns']):
+            dtype = np.int32 if kind == 'values' else kind
+            array = np.memmap(os.path.join(self.path, '{}.col'.format(i)), dtype=dtype, mode='r+', shape=(rows,))
+            self.columns[name] = (kind, array)
+            if kind == 'values':
+                self._values[name] = {'fn': os.path.join(self.path, '{}.values'.format(i)), 'offset': 0,
+                                      'values': list(), 'codes': dict()}
+
+        self._lock_fd = os.open(os.path.join(self.path, 'lock'), os.O_RDWR)
+        self._held = np.zeros(rows, dtype=np.int32)
+
+    def _read_values(self, name):
+        """ Values of a 'values' column, reading those appended by other processes """
+        values = self._values[name]
+        with open(values['fn'], 'rb') as f:
+            f.seek(values['offset'])
+            lines = f.readlines()
+
+        # A line still being written by another process is read next time
+        if lines and not lines[-1].endswith(b'\n'):
+            lines.pop()
+
+        for line in lines:
+            value = json.loads(line)
+            values['codes'][_value_key(value)] = len(values['values'])
+            values['values'].append(value)
+            values['offset'] += len(line)
+
+        return values['values']
+
+    def _codes(self, name, values):
+        """ Codes of values in a 'values' column, appending new values """
+        codes = self._values[name]['codes']
+        keys = [None if pd.isnull(value) else _value_key(_json_value(value)) for value in values]
+
+        if any(key is not None and key not in codes for key in keys):
+            with self.lock(name):
+                known = self._read_values(name)
+                new = list()
+                for key, value in zip(keys, values):
+                    if key is not None and key not in codes:
+                        codes[key] = len(known) + len(new)
+                        new.append(_json_value(value))
+
+                with open(self._values[name]['fn'], 'a') as f:
+                    f.writelines(json.dumps(value) + '\n' for value in new)
+
+                # Read back, so the offset moves past them
+                self._read_values(name)
+
+        return np.array([-1 if key is None else codes[key] for key in keys], dtype=np.int32)
+
+
+def _column_kind(values):
+    """ Kind a writable column is stored as, 'int8', 'float32' or 'values' """
+    dtype = pd.Series(values).dtype
+    if dtype == np.int8:
+        return 'int8'
+    elif dtype == np.float32:
+        return 'float32'
+
+    return 'values'
+
+
+def _json_value(value):
+    """ value as a plain Python value for JSON """
+    if isinstance(value, np.generic):
+        value = value.item()
+
+    if not isinstance(value, (str, int, float, bool)):
+        raise TypeError("Can't store {!r} in a shared store".format(value))
+
+    return value
+
+
+def _value_key(value):
+    """ Key of a value, keeping e.g. 1 and '1' apart """
+    return type(value).__name__, value
+
+
+def _runs(positions):
+    """ Start and length of each run of consecutive positions, which must be sorted """
+    if not len(positions):
+        return list()
+
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = positions[np.concatenate([[0], breaks])]
+    ends = positions[np.concatenate([breaks - 1, [len(positions) - 1]])]
+
+    return [(int(start), int(end - start + 1)) for start, end in zip(starts, ends)]
@@ -0,0 +1,267 @@
+""" Columnar cache of parsed sheets stored next to the workbook, see `SheetCache`
+
+The frame encoding used by the cache is also used for the base sheet of a
+`shared_store.SharedStore`, see `encode_frame`.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+
+class SheetCache(object):
+    """ Columnar (Feather) cache of parsed sheets stored next to the workbook
+
+    The cache lives in the directory `<fn>.cache` and is keyed on the size, mtime
+    and SHA-1 of the workbook. A changed size invalidates the cache, a changed
+    mtime only if the content hash differs too. Editing the workbook (including
+    `erafixer.EraFixer.save`) therefore rebuilds the cache on the next load.
+
+    Object columns mixing types (e.g. FOR codes as floats and 'MD') are stored
+    as strings along with a type column and restored on read.
+
+    Note:
+        Requires pyarrow, without it the workbook is always parsed.
+
+    Args:
+        fn (str): Excel file name
+    """
+    version = 4
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.path = fn + '.cache'
+        self.meta = None
+
+    @property
+    def sheet_names(self):
+        return self.meta['sheet_names']
+
+    def is_valid(self):
+        """ Check the cache belongs to the current workbook
+
+        Returns:
+            bool: True if the cache can be used
+        """
+        try:
+            with open(os.path.join(self.path, 'meta.json')) as f:
+                self.meta = json.load(f)
+        except (IOError, ValueError):
+            self.meta = None
+            return False
+
+        stat = os.stat(self.fn)
+        if self.meta.get('version') != self.version or self.meta['size'] != stat.st_size:
+            return False
+
+        if self.meta['mtime'] != stat.st_mtime_ns:
+            if self.meta['sha1'] != file_sha1(self.fn):
+                return False
+
+            # Touched but not edited
+            self.meta['mtime'] = stat.st_mtime_ns
+            self._write_meta()
+
+        return True
+
+    def read(self, sheet_index, low_memory=False):
+        """ Read a sheet from the cache
+
+        Args:
+            sheet_index (int): Sheet index
+            low_memory (bool, optional): Read the working columns cached in low memory mode
+
+        Returns:
+            `pandas.DataFrame`: Parsed sheet, None if not cached or the cache is invalid
+        """
+        key = _sheet_key(sheet_index, low_memory)
+        if self.meta is None or key not in self.meta['sheets'] or not self.is_valid():
+            return None
+
+        sheet = self.meta['sheets'][key]
+        try:
+            frame = pd.read_feather(os.path.join(self.path, sheet['file']))
+        except Exception as e:
+            print("Can't read cache: {}".format(e))
+            return None
+
+        return decode_frame(frame, sheet)
+
+    def sheet_layout(self, sheet_index, low_memory=False):
+        """ Column of the cached sheet held in each column of the workbook sheet
+
+        Args:
+            sheet_index (int): Sheet index
+            low_memory (bool, optional): Layout of the sheet cached in low memory mode
+
+        Returns:
+            list: Column positions in the cached sheet, None for columns that weren't read.
+                None if not known
+        """
+        key = _sheet_key(sheet_index, low_memory)
+        if self.meta is None or key not in self.meta['sheets']:
+            return None
+
+        return self.meta['sheets'][key].get('sheet_layout')
+
+    def write(self, sheet_index, df, sheet_names, low_memory=False, sheet_layout=None):
+        """ Write a sheet to the cache, clearing it first if it belongs to an older workbook
+
+        Args:
+            sheet_index (int): Sheet index
+            df (`pandas.DataFrame`): Parsed sheet
+            sheet_names (list(str)): All sheet names of the workbook
+            low_memory (bool, optional): df only holds the working columns
+            sheet_layout (list, optional): Column of df held in each column of the workbook sheet
+        """
+        if not self.is_valid():
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.makedirs(self.path)
+
+            stat = os.stat(self.fn)
+            self.meta = {
+                'version': self.version,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'sha1': file_sha1(self.fn),
+                'sheet_names': list(sheet_names),
+                'sheets': dict(),
+            }
+
+        frame, sheet = encode_frame(df)
+
+        key = _sheet_key(sheet_index, low_memory)
+        sheet_file = 'sheet{}.feather'.format(key)
+        try:
+            frame.to_feather(os.path.join(self.path, sheet_file))
+        except Exception as e:
+            print("Can't write cache: {}".format(e))
+            return
+
+        self.meta['sheets'][key] = dict(sheet, file=sheet_file, sheet_layout=sheet_layout)
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp_fn = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_fn, 'w') as f:
+            json.dump(self.meta, f)
+
+        os.replace(tmp_fn, os.path.join(self.path, 'meta.json'))
+
+
+def encode_frame(df):
+    """Frame that can be written to Feather/Arrow, see `decode_frame`
+
+    Arrow needs string column names and columns of a single type, so columns are
+    renamed by position and mixed object columns are tagged (see `_tag_values`).
+
+    Args:
+        df (`pandas.DataFrame`): Parsed sheet
+
+    Returns:
+        tuple(`pandas.DataFrame`, dict): Encoded frame and the columns, tagged and
+            objects needed to decode it
+    """
+    frame = pd.DataFrame(index=pd.RangeIndex(len(df)))
+    tagged = list()
+    objects = list()
+    for i, col in enumerate(df.columns):
+        name = 'c{}'.format(i)
+        values = df[col].reset_index(drop=True)
+        if values.dtype == object and not values.dropna().map(type).eq(str).all():
+            frame[name], frame[name + '::type'] = _tag_values(values)
+            tagged.append(name)
+        else:
+            frame[name] = values
+            if values.dtype == object:
+                objects.append(name)
+
+    return frame, {
+        'columns': [str(col) if not isinstance(col, (int, float)) else col for col in df.columns],
+        'tagged': tagged,
+        'objects': objects,
+    }
+
+
+def decode_frame(frame, sheet):
+    """ Inverse of `encode_frame`, sheet is the dict it returned """
+    for col in sheet['tagged']:
+        frame[col] = _untag_values(frame[col], frame.pop(col + '::type'))
+
+    for col in sheet['objects']:
+        frame[col] = frame[col].astype(object).where(frame[col].notnull(), np.nan)
+
+    frame.columns = pd.Index(sheet['columns'], dtype=object)
+
+    return frame
+
+
+def _sheet_key(sheet_index, low_memory):
+    """ Key of a sheet in the cache meta, low memory reads are kept apart """
+    return '{}-low_memory'.format(sheet_index) if low_memory else str(sheet_index)
+
+
+def file_sha1(fn):
+    """ SHA-1 hex digest of the file contents """
+    sha1 = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+# Types that can appear in a parsed object column with their parsers, stored as
+# strings by `SheetCache`. Order matters as bool is an int and datetime a date.
+CACHE_TYPES = [
+    ('bool', bool, lambda value: value == 'True'),
+    ('int', (int, np.integer), int),
+    ('float', (float, np.floating), float),
+    ('datetime', datetime.datetime, pd.Timestamp),
+    ('date', datetime.date, datetime.date.fromisoformat),
+    ('time', datetime.time, datetime.time.fromisoformat),
+    ('str', object, str),
+]
+
+
+def _tag_values(values):
+    """ Split a mixed object column into strings and type names """
+    def type_name(value):
+        for name, value_type, _ in CACHE_TYPES:
+            if isinstance(value, value_type):
+                return name
+
+    def to_string(value):
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+
+        return repr(float(value)) if isinstance(value, (float, np.floating)) else str(value)
+
+    notnull = values.notnull()
+    types = values[notnull].map(type_name).reindex(values.index)
+    strings = values[notnull].map(to_string).reindex(values.index)
+
+    # Keep the kind of blank, NaN is the default
+    types[values.map(lambda value: value is pd.NaT)] = 'NaT'
+    types[values.map(lambda value: value is None)] = 'None'
+
+    return strings.astype(object), types.astype(object)
+
+
+def _untag_values(strings, types):
+    """ Inverse of `_tag_values` """
+    values = pd.Series(np.nan, index=strings.index, dtype=object)
+    for name, _, parse in CACHE_TYPES:
+        is_type = (types == name).to_numpy()
+        if is_type.any():
+            values[is_type] = [parse(value) for value in strings[is_type]]
+
+    values[(types == 'NaT').to_numpy()] = pd.NaT
+    values[(types == 'None').to_numpy()] = None
+
+    return values
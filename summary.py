@@ -0,0 +1,140 @@
+""" Progress and FOR apportionment of an ERA working sheet, see `Summary` """
+
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+class Summary(object):
+    """Progress and FOR apportionment of the working sheet, kept up to date as it changes
+
+    Holds the number of rows per HANDLED state and DISCIPLINE and the sum of the
+    2018 FOR percentages per code. `erafixer.EraFixer._assign` removes the rows it
+    changes before the change and adds them back after it, so keeping the summary
+    current costs as much as the rows changed, not a scan of the sheet.
+
+    Args:
+        df (`pandas.DataFrame`): Working sheet
+        pairs (list(tuple)): Column names of the code and percentage of each 2018 FOR
+            code, pairs missing from df are left out
+    """
+
+    def __init__(self, df, pairs):
+        self.pairs = [(code, perc) for code, perc in pairs if code in df and perc in df]
+        self.columns = set(['HANDLED', 'DISCIPLINE'] + [col for pair in self.pairs for col in pair])
+
+        # (HANDLED, DISCIPLINE) to rows, '' for a blank discipline, and code to the sum of its percentages
+        self.counts = Counter()
+        self.percentages = Counter()
+
+        self.add(df, np.arange(len(df)))
+
+    def add(self, df, positions, column=None, sign=1):
+        """ Add the rows of df at positions, or remove them with sign -1
+
+        Args:
+            df (`pandas.DataFrame`): Working sheet
+            positions (`numpy.ndarray`): Row positions
+            column (str, optional): Only update the counts column is part of, default all
+            sign (int, optional): 1 to add, -1 to remove, default 1
+        """
+        if not len(positions):
+            return
+
+        if column is None or column in ['HANDLED', 'DISCIPLINE']:
+            self._add_handled(df, positions, sign)
+
+        if column is None or column not in ['HANDLED', 'DISCIPLINE']:
+            self._add_percentages(df, positions, sign)
+
+    def remove(self, df, positions, column=None):
+        """ Remove the rows of df at positions, see `add` """
+        self.add(df, positions, column, sign=-1)
+
+    def _add_handled(self, df, positions, sign):
+        rows = pd.DataFrame({
+            'handled': df['HANDLED'].iloc[positions].to_numpy(),
+            'discipline': df['DISCIPLINE'].iloc[positions].astype(object).fillna('').to_numpy(),
+        })
+        for (handled, discipline), count in rows.value_counts().items():
+            _add_count(self.counts, (int(handled), discipline), sign * count)
+
+    def _add_percentages(self, df, positions, sign):
+        if not self.pairs:
+            return
+
+        codes = np.concatenate([df[code].iloc[positions].to_numpy(dtype=object) for code, _ in self.pairs])
+        percs = np.concatenate([pd.to_numeric(df[perc].iloc[positions], errors='coerce').to_numpy(dtype=float)
+                                for _, perc in self.pairs])
+        present = pd.notnull(codes) & ~np.isnan(percs)
+
+        for code, perc in pd.Series(percs[present]).groupby(codes[present]).sum().items():
+            _add_count(self.percentages, str(code), sign * perc)
+
+    def handled(self):
+        """ Rows per HANDLED state and DISCIPLINE
+
+        Returns:
+            `pandas.DataFrame`: HANDLED states as rows and disciplines as columns, '' for blank
+        """
+        if not self.counts:
+            return pd.DataFrame()
+
+        return pd.Series(self.counts).unstack(fill_value=0).astype(int).sort_index()
+
+    def for_codes(self, digits=4):
+        """ Apportioned rows per 2018 FOR code, the sum of its percentages / 100
+
+        Args:
+            digits (int, optional): 4, or 2 to add up the codes of each 2 digit code, default 4
+
+        Returns:
+            `pandas.Series`: Apportioned rows per code
+        """
+        rows = pd.Series(self.percentages, dtype=float) / 100
+        if digits == 2:
+            rows = rows.groupby(lambda code: code[:2] if code.isdigit() else code).sum()
+
+        return rows.sort_index()
+
+    def report(self):
+        """ Summary as plain dicts, e.g. to print with `print_summary` or send from a session
+
+        Returns:
+            dict: handled (state to discipline to rows), for_codes_2 and for_codes (code to apportioned rows)
+        """
+        handled = self.handled()
+        return {
+            'handled': {int(state): {str(disc): int(count) for disc, count in row.items() if count}
+                        for state, row in handled.iterrows()},
+            'for_codes_2': {code: round(rows, 2) for code, rows in self.for_codes(2).items()},
+            'for_codes': {code: round(rows, 2) for code, rows in self.for_codes(4).items()},
+        }
+
+
+def _add_count(counter, key, count):
+    """ Add count to the entry key of counter, dropping it when it gets back to 0 """
+    counter[key] += count
+    if abs(counter[key]) < 1e-6:
+        del counter[key]
+
+
+def print_summary(report):
+    """ Print a summary report, see `Summary.report`
+
+    Args:
+        report (dict): Output of `Summary.report`
+    """
+    handled = pd.DataFrame.from_dict(report['handled'], orient='index').fillna(0).astype(int)
+    # States come back as strings from a session
+    handled.index = handled.index.astype(int)
+    handled = handled.rename(columns={'': '(blank)'}).sort_index().sort_index(axis=1)
+    handled.index.name = 'HANDLED'
+    print("Rows per HANDLED state and DISCIPLINE")
+    print(handled.to_string())
+
+    for key, digits in [('for_codes_2', 2), ('for_codes', 4)]:
+        print("\nApportioned rows per {} digit FOR code".format(digits))
+        for code, rows in report[key].items():
+            print("{:>10.2f}  {}".format(rows, code))
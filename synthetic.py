@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+""" Write synthetic ERA workbooks for benchmarking
+
+The workbooks look like an ERA export: every `COL_LOOKUP` and `COL_DTYPES` column,
+multi-author AUTHORS strings, repeated journal names, 2015 FOR codes mixing floats,
+zero-padded strings and 'MD', and a few 2018 codes already filled in. The working
+sheet is preceded by a notes sheet, as in the exports, so it has sheet index 1.
+"""
+
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+import xlsx_patch
+from erafixer import COL_DTYPES, COL_LOOKUP
+
+SURNAMES = [
+    'Gee', 'McGee', 'Steel', 'Steele', 'Casteels', 'Xia', 'Xiao', 'Spence', 'Marco', 'Marconi',
+    'Zvyagin', 'Schwab', 'Smith', 'Nguyen', 'Wang', 'Li', 'Brown', 'Williams', 'Jones', 'Taylor',
+    'van der Berg', "O'Brien", 'JelÃ­nkovÃ¡', 'Müller', 'Kowalski', 'Singh',
+]
+
+JOURNALS = [
+    'Astrophysical Journal', 'Monthly Notices of the Royal Astronomical Society', 'Optics Express',
+    'Optics Letters', 'Physical Review Letters', 'Physical Review A', 'Geophysics',
+    'Journal of Geophysical Research', 'Biomedical Optics Express', 'Nature Photonics',
+    'Quantum Science and Technology', 'Publications of the Astronomical Society of Australia',
+]
+
+# 2015 codes, as floats, zero-padded strings and four digit codes
+FOR_CODES = [201.0, 202.0, 205.0, 206.0, 299.0, 401.0, 404.0, 906.0, 1001.0, '0201', '0206', '0299', '0906']
+
+# Percentage splits for one, two and three codes
+PERCENTAGES = [[100.0], [50.0, 50.0], [60.0, 40.0], [34.0, 33.0, 33.0]]
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+
+def make_frame(rows, seed=0, md_fraction=0.05, e18_fraction=0.1):
+    """ Synthetic ERA sheet
+
+    Args:
+        rows (int): Number of rows
+        seed (int, optional): Random seed, default 0
+        md_fraction (float, optional): Fraction of rows with an 'MD' code, default 0.05
+        e18_fraction (float, optional): Fraction of rows with 2018 codes already set, default 0.1
+
+    Returns:
+        `pandas.DataFrame`: Sheet without HANDLED, DISCIPLINE and FORC_STRING columns
+    """
+    rng = np.random.default_rng(seed)
+
+    df = pd.DataFrame(index=pd.RangeIndex(rows))
+    for col, col_type in COL_DTYPES.items():
+        if col not in ['HANDLED', 'DISCIPLINE']:
+            df[col] = np.nan if col_type == 'object' else 0
+
+    df['YEAR'] = rng.choice([2011, 2012, 2013, 2014, 2015, 2016], rows)
+    df['TITLE'] = ['Synthetic paper {}'.format(i) for i in range(rows)]
+    df['AUTHORS'] = _authors(rng, rows)
+    df[COL_LOOKUP['journal']] = rng.choice(JOURNALS, rows).astype(object)
+    df['ARIS_UPDATED'] = pd.Series(rng.choice([datetime.datetime(2017, 10, 27), np.nan, 'n/a'], rows))
+    df['VOL'] = pd.Series(rng.choice([1, 12, '2a', np.nan], rows))
+
+    for year, fraction in [('e15', 0.7), ('e18', e18_fraction)]:
+        with_codes = rng.random(rows) < fraction
+        splits = rng.integers(0, len(PERCENTAGES), rows)
+
+        for num in range(1, 5):
+            codes = pd.Series(rng.choice(np.array(FOR_CODES, dtype=object), rows))
+            percs = pd.Series([PERCENTAGES[split][num - 1] if num <= len(PERCENTAGES[split]) else np.nan
+                               for split in splits])
+            present = with_codes & percs.notnull().to_numpy()
+
+            if num == 1:
+                codes[present & (rng.random(rows) < md_fraction)] = 'MD'
+
+            df[COL_LOOKUP['for{}_{}'.format(num, year)]] = codes.where(present, np.nan)
+            df[COL_LOOKUP['for{}perc_{}'.format(num, year)]] = percs.where(present, np.nan)
+
+    return df
+
+
+def make_workbook(fn, rows, seed=0, sheets=2):
+    """ Write a synthetic ERA workbook
+
+    Args:
+        fn (str): File name, an existing file is overwritten
+        rows (int): Number of rows of the ERA sheet
+        seed (int, optional): Random seed, default 0
+        sheets (int, optional): Number of sheets, the ERA sheet is the second one and
+            any others are small, default 2
+
+    Returns:
+        str: File name
+    """
+    names = ['Notes', 'ERA'] + ['Extra {}'.format(i) for i in range(sheets - 2)]
+
+    # Small sheets with pandas, the ERA sheet is streamed in afterwards
+    writer = pd.ExcelWriter(fn, engine='xlsxwriter')
+    for name in names:
+        if name == 'ERA':
+            pd.DataFrame({'placeholder': []}).to_excel(writer, sheet_name=name, index=False)
+        else:
+            pd.DataFrame({'Notes': ['Synthetic ERA workbook', 'seed {}'.format(seed)]}).to_excel(
+                writer, sheet_name=name, index=False)
+    writer.close()
+
+    xlsx_patch.replace_sheet(fn, 'ERA', make_frame(rows, seed=seed), index=False)
+
+    return fn
+
+
+def _authors(rng, rows):
+    """ AUTHORS strings of one to eight authors, some as 'Surname, Given' """
+    initials = np.array(list('ABCDEFGHJKLMNPRSTW'))
+    pool = ['{} {}'.format(surname, initial) for surname in SURNAMES for initial in initials[:6]]
+    pool += ['{}, {}'.format(surname, given) for surname, given in
+             zip(SURNAMES, ['John', 'Mary', 'Wei', 'Anna', 'Raj', 'Olga'] * 5)]
+
+    counts = rng.integers(1, 9, rows)
+    picks = rng.integers(0, len(pool), counts.sum())
+    bounds = np.cumsum(counts)
+
+    return ['; '.join(pool[pick] for pick in picks[end - count:end]) for count, end in zip(counts, bounds)]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Write synthetic ERA workbooks")
+    parser.add_argument('rows', nargs='*', type=int, default=SIZES,
+                        help='Rows of each workbook, default {}'.format(' '.join(str(size) for size in SIZES)))
+    parser.add_argument('--prefix', default='synthetic',
+                        help='Workbooks are written to <PREFIX>_<ROWS>.xlsx, default synthetic')
+    parser.add_argument('--sheets', default=2, type=int,
+                        help='Number of sheets, default 2')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Random seed, default 0')
+
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        fn = '{}_{}.xlsx'.format(args.prefix, rows)
+        make_workbook(fn, rows, seed=args.seed, sheets=args.sheets)
+        print("Wrote {} ({:.1f} MB)".format(fn, os.path.getsize(fn) / 1e6))
@@ -0,0 +1,534 @@
+""" Update a single worksheet of an xlsx workbook without touching the others
+
+An xlsx workbook is a zip container with one XML part per worksheet. The helpers
+here rewrite only the part for the working sheet (plus a few styles) and copy
+every other part of the container through as is, so the untouched sheets are
+neither parsed nor re-serialized and keep their formatting.
+"""
+
+import datetime
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+
+NS = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+}
+
+# Same number formats pandas uses by default
+DATETIME_FORMAT = 'YYYY-MM-DD HH:MM:SS'
+DATE_FORMAT = 'YYYY-MM-DD'
+
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+
+# Characters that are not allowed in XML
+ILLEGAL_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Order Excel last calculated the formulas in, only a cache that Excel rebuilds when missing
+CALC_CHAIN = 'xl/calcChain.xml'
+
+
+def replace_sheet(fn, sheet_name, df, save_name=None, index=True):
+    """Replace the contents of one worksheet with df
+
+    The sheet is written the same way as `pandas.DataFrame.to_excel`: a bold header
+    row, the index as the first column and dates with the default pandas formats.
+    Strings are written inline so the shared strings of the other sheets are left alone.
+
+    The formulas of the sheet are dropped from the calculation chain. Sheets with other
+    parts attached, e.g. drawings, tables or comments, are refused, as these would be
+    left pointing at cells that no longer exist.
+
+    Args:
+        fn (str): Existing xlsx workbook
+        sheet_name (str): Name of the worksheet to replace
+        df (`pandas.DataFrame`): Contents of the worksheet
+        save_name (str, optional): File to write, default overwrite fn
+        index (bool, optional): Write the index as the first column, default True
+
+    Raises:
+        Exception: If the sheet has drawings, tables or other parts attached
+    """
+    with zipfile.ZipFile(fn) as zf:
+        part = get_sheet_part(zf, sheet_name)
+
+        rels_part = '{}/_rels/{}.rels'.format(*posixpath.split(part))
+        if rels_part in zf.namelist():
+            rels = ElementTree.fromstring(zf.read(rels_part))
+            types = sorted(set(rel.get('Type').rsplit('/', 1)[-1] for rel in rels.iterfind('rel:Relationship', NS)))
+            if types:
+                raise Exception("Sheet '{}' has {} attached, which would point at missing cells".format(
+                    sheet_name, ', '.join(types)))
+
+        styles_xml, styles = _add_styles(zf.read('xl/styles.xml').decode('utf-8'))
+        replacements = _drop_calc_chain(zf, sheet_name)
+
+    replacements.update({
+        'xl/styles.xml': styles_xml.encode('utf-8'),
+        part: _sheet_xml(df, styles, index=index),
+    })
+
+    copy_workbook(fn, save_name or fn, replacements)
+
+
+def patch_cells(fn, sheet_name, cells, save_name=None):
+    """Write single cells into an existing worksheet
+
+    Only the rows holding changed cells are rewritten, all other rows of the
+    worksheet XML are copied as text. Changed cells keep their style, so
+    formatting added to the workbook is preserved.
+
+    Args:
+        fn (str): Existing xlsx workbook
+        sheet_name (str): Name of the worksheet to patch
+        cells (dict): Row number (1-based, as in Excel) to a dict of column number
+            (0-based) to the new value
+        save_name (str, optional): File to write, default overwrite fn
+    """
+    with zipfile.ZipFile(fn) as zf:
+        part = get_sheet_part(zf, sheet_name)
+        styles_xml, styles = _add_styles(zf.read('xl/styles.xml').decode('utf-8'))
+        sheet_xml = zf.read(part).decode('utf-8')
+
+    replacements = {
+        'xl/styles.xml': styles_xml.encode('utf-8'),
+        part: _patch_sheet_xml(sheet_xml, cells, styles).encode('utf-8'),
+    }
+
+    copy_workbook(fn, save_name or fn, replacements)
+
+
+def get_sheet_part(zf, sheet_name):
+    """Find the zip member holding a worksheet
+
+    Args:
+        zf (`zipfile.ZipFile`): Open workbook
+        sheet_name (str): Name of the worksheet
+
+    Returns:
+        str: Member name, e.g. 'xl/worksheets/sheet2.xml'
+    """
+    workbook = ElementTree.fromstring(zf.read('xl/workbook.xml'))
+    rels = ElementTree.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+
+    for sheet in workbook.iterfind('main:sheets/main:sheet', NS):
+        if sheet.get('name') != sheet_name:
+            continue
+
+        rel_id = sheet.get('{{{}}}id'.format(NS['r']))
+        for rel in rels.iterfind('rel:Relationship', NS):
+            if rel.get('Id') == rel_id:
+                target = rel.get('Target')
+                if target.startswith('/'):
+                    return target.lstrip('/')
+
+                return os.path.normpath(os.path.join('xl', target)).replace(os.sep, '/')
+
+    raise Exception("Sheet '{}' not found".format(sheet_name))
+
+
+def get_sheet_id(zf, sheet_name):
+    """The sheetId of a worksheet, which other parts refer to it by
+
+    Args:
+        zf (`zipfile.ZipFile`): Open workbook
+        sheet_name (str): Name of the worksheet
+
+    Returns:
+        str: sheetId, e.g. '2'
+    """
+    workbook = ElementTree.fromstring(zf.read('xl/workbook.xml'))
+    for sheet in workbook.iterfind('main:sheets/main:sheet', NS):
+        if sheet.get('name') == sheet_name:
+            return sheet.get('sheetId')
+
+    raise Exception("Sheet '{}' not found".format(sheet_name))
+
+
+def copy_workbook(fn, save_name, replacements):
+    """Copy the zip container fn to save_name, replacing some members
+
+    The copy is written to a temporary file first so a failure never leaves a
+    half written workbook behind.
+
+    Args:
+        fn (str): Existing xlsx workbook
+        save_name (str): File to write, may be fn
+        replacements (dict): Member name to bytes or an iterable of str chunks, None
+            leaves the member out
+    """
+    tmp_fd, tmp_fn = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(os.path.abspath(save_name)))
+    os.close(tmp_fd)
+
+    try:
+        with zipfile.ZipFile(fn) as zin, zipfile.ZipFile(tmp_fn, 'w', zipfile.ZIP_DEFLATED) as zout:
+            for item in zin.infolist():
+                if item.filename not in replacements:
+                    with zin.open(item) as src, zout.open(item, 'w') as dst:
+                        shutil.copyfileobj(src, dst, 1 << 20)
+                    continue
+
+                content = replacements[item.filename]
+                if content is None:
+                    continue
+
+                with zout.open(zipfile.ZipInfo(item.filename, item.date_time), 'w') as dst:
+                    if isinstance(content, bytes):
+                        dst.write(content)
+                    else:
+                        for chunk in content:
+                            dst.write(chunk.encode('utf-8'))
+
+        # mkstemp creates the file readable only by its owner, keep the workbook's permissions
+        shutil.copymode(fn, tmp_fn)
+        os.replace(tmp_fn, save_name)
+    finally:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+
+
+def column_letter(col):
+    """ Excel column letter for a 0-based column number, e.g. 27 -> 'AB' """
+    letters = ''
+    col += 1
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+
+    return letters
+
+
+def column_number(letters):
+    """ 0-based column number for an Excel column letter, e.g. 'AB' -> 27 """
+    col = 0
+    for letter in letters:
+        col = col * 26 + ord(letter) - 64
+
+    return col - 1
+
+
+def cell_xml(ref, value, styles, style=None):
+    """XML for a single cell
+
+    Args:
+        ref (str): Cell reference, e.g. 'B12'
+        value: Cell value, blanks give an empty string
+        styles (dict): Style ids from `_add_styles`
+        style (int, optional): Style id for the cell, default depends on value
+
+    Returns:
+        str: `<c>` element
+    """
+    style_attr = '' if style is None else ' s="{}"'.format(style)
+
+    if isinstance(value, np.generic):
+        value = value.item()
+
+    if value is None or value is pd.NaT:
+        return ''
+    elif isinstance(value, bool):
+        return '<c r="{}"{} t="b"><v>{:d}</v></c>'.format(ref, style_attr, value)
+    elif isinstance(value, (int, float)):
+        if not np.isfinite(value):
+            return ''
+
+        return '<c r="{}"{}><v>{!r}</v></c>'.format(ref, style_attr, value)
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        if isinstance(value, datetime.datetime):
+            serial = (value.replace(tzinfo=None) - EXCEL_EPOCH) / datetime.timedelta(days=1)
+            style = styles['datetime'] if style is None else style
+        else:
+            serial = (value - EXCEL_EPOCH.date()).days
+            style = styles['date'] if style is None else style
+
+        return '<c r="{}" s="{}"><v>{!r}</v></c>'.format(ref, style, serial)
+
+    text = ILLEGAL_XML_RE.sub('', str(value))
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    space = ' xml:space="preserve"' if text != text.strip() else ''
+
+    return '<c r="{}"{} t="inlineStr"><is><t{}>{}</t></is></c>'.format(ref, style_attr, space, text)
+
+
+def _sheet_xml(df, styles, index=True):
+    """ Generate the worksheet XML for df in chunks """
+    yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+           '<worksheet xmlns="{}" xmlns:r="{}">'.format(NS['main'], NS['r']))
+
+    offset = 1 if index else 0
+    letters = [column_letter(col) for col in range(len(df.columns) + offset)]
+    yield '<dimension ref="A1:{}{}"/><sheetData>'.format(letters[-1], len(df) + 1)
+
+    header = [cell_xml('{}1'.format(letters[col + offset]), name, styles, style=styles['header'])
+              for col, name in enumerate(df.columns)]
+    yield '<row r="1">{}</row>'.format(''.join(header))
+
+    for row_num, row in enumerate(df.itertuples(index=index, name=None), start=2):
+        cells = list()
+        for col, value in enumerate(row):
+            style = styles['header'] if (index and col == 0) else None
+            cells.append(cell_xml('{}{}'.format(letters[col], row_num), value, styles, style=style))
+
+        yield '<row r="{}">{}</row>'.format(row_num, ''.join(cells))
+
+    yield '</sheetData></worksheet>'
+
+
+CALC_CELL_RE = re.compile(r'<c\b([^>]*?)/>')
+CALC_SHEET_RE = re.compile(r'\bi="(\d+)"')
+
+
+def _drop_calc_chain(zf, sheet_name):
+    """Drop the formulas of a sheet from the calculation chain
+
+    Excel reports a workbook as corrupt when calcChain.xml lists a cell that holds no
+    formula. If no formulas are left the part is removed along with its content type
+    and relationship, which are edited as text like styles.xml.
+
+    Args:
+        zf (`zipfile.ZipFile`): Open workbook
+        sheet_name (str): Name of the worksheet being replaced
+
+    Returns:
+        dict: Replacements for `copy_workbook`, empty if there is no calculation chain
+    """
+    if CALC_CHAIN not in zf.namelist():
+        return dict()
+
+    sheet_id = get_sheet_id(zf, sheet_name)
+    chain = zf.read(CALC_CHAIN).decode('utf-8')
+
+    kept = list()
+    current = None
+    for cell in CALC_CELL_RE.finditer(chain):
+        attrs = cell.group(1)
+
+        # A cell without a sheet is on the sheet of the cell before it
+        cell_sheet = CALC_SHEET_RE.search(attrs)
+        if cell_sheet is None:
+            attrs = ' i="{}"{}'.format(current, attrs)
+        else:
+            current = cell_sheet.group(1)
+
+        if current != sheet_id:
+            kept.append('<c{}/>'.format(attrs))
+
+    if kept:
+        cells = list(CALC_CELL_RE.finditer(chain))
+        chain = chain[:cells[0].start()] + ''.join(kept) + chain[cells[-1].end():]
+        return {CALC_CHAIN: chain.encode('utf-8')}
+
+    content_types = zf.read('[Content_Types].xml').decode('utf-8')
+    content_types = re.sub(r'<Override\b[^>]*\bPartName="/{}"[^>]*/>'.format(re.escape(CALC_CHAIN)), '',
+                           content_types)
+    rels = zf.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+    rels = re.sub(r'<Relationship\b[^>]*\bType="[^"]*/calcChain"[^>]*/>', '', rels)
+
+    return {
+        CALC_CHAIN: None,
+        '[Content_Types].xml': content_types.encode('utf-8'),
+        'xl/_rels/workbook.xml.rels': rels.encode('utf-8'),
+    }
+
+
+ROW_RE = re.compile(r'<row\b([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+CELL_RE = re.compile(r'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+REF_RE = re.compile(r'\br="([A-Z]+)(\d+)"')
+ROW_NUM_RE = re.compile(r'\br="(\d+)"')
+STYLE_RE = re.compile(r'\bs="(\d+)"')
+
+
+def _patch_sheet_xml(sheet_xml, cells, styles):
+    """ Returns sheet_xml with cells written in, see `patch_cells` """
+    data = re.search(r'<sheetData\s*/>|<sheetData\b[^>]*>(.*?)</sheetData>', sheet_xml, re.S)
+    if data is None:
+        raise Exception("No <sheetData> in worksheet")
+
+    if data.group(1) is None:
+        # Empty worksheet
+        sheet_xml = sheet_xml[:data.start()] + '<sheetData></sheetData>' + sheet_xml[data.end():]
+        data_start = data_end = data.start() + len('<sheetData>')
+    else:
+        data_start, data_end = data.span(1)
+
+    todo = sorted(cells)
+    out = [sheet_xml[:data_start]]
+    pos = data_start
+    for row in ROW_RE.finditer(sheet_xml, data_start, data_end):
+        if not todo:
+            break
+
+        row_num = ROW_NUM_RE.search(row.group(1))
+        if row_num is None:
+            raise Exception("Worksheet rows without a row number")
+
+        row_num = int(row_num.group(1))
+        while todo and todo[0] <= row_num:
+            out.append(sheet_xml[pos:row.start()])
+            pos = row.start()
+
+            if todo[0] < row_num:
+                out.append(_row_xml(todo[0], '', '', cells[todo[0]], styles))
+            else:
+                out.append(_row_xml(row_num, row.group(1), row.group(2) or '', cells[row_num], styles))
+                pos = row.end()
+
+            todo.pop(0)
+
+    out.append(sheet_xml[pos:data_end])
+    for row_num in todo:
+        out.append(_row_xml(row_num, '', '', cells[row_num], styles))
+
+    out.append(sheet_xml[data_end:])
+    sheet_xml = ''.join(out)
+
+    # Grow the dimension to include the new cells
+    dimension = re.search(r'<dimension ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"\s*/>', sheet_xml)
+    if dimension is not None:
+        last_col = column_number(dimension.group(3) or dimension.group(1))
+        last_row = int(dimension.group(4) or dimension.group(2))
+        last_col = max([last_col] + [max(row_cells) for row_cells in cells.values() if row_cells])
+        last_row = max([last_row] + list(cells))
+        sheet_xml = '{}<dimension ref="{}{}:{}{}"/>{}'.format(
+            sheet_xml[:dimension.start()], dimension.group(1), dimension.group(2),
+            column_letter(last_col), last_row, sheet_xml[dimension.end():])
+
+    return sheet_xml
+
+
+def _row_xml(row_num, attrs, content, row_cells, styles):
+    """ A `<row>` element with row_cells merged into the existing cells in content """
+    existing = dict()
+    for cell in CELL_RE.finditer(content):
+        ref = REF_RE.search(cell.group(1))
+        if ref is None:
+            raise Exception("Worksheet cells without a cell reference")
+
+        existing[column_number(ref.group(1))] = cell
+
+    new_cells = list()
+    for col in sorted(set(existing) | set(row_cells)):
+        if col not in row_cells:
+            new_cells.append(existing[col].group(0))
+            continue
+
+        value = row_cells[col]
+        ref = '{}{}'.format(column_letter(col), row_num)
+
+        # Keep the style of the cell
+        style = None
+        if col in existing:
+            style_match = STYLE_RE.search(existing[col].group(1))
+            if style_match is not None and (style_match.group(1) != '0' or
+                                            not isinstance(value, (datetime.datetime, datetime.date))):
+                style = int(style_match.group(1))
+
+        cell = cell_xml(ref, value, styles, style=style)
+        if cell == '' and style is not None:
+            cell = '<c r="{}" s="{}"/>'.format(ref, style)
+
+        new_cells.append(cell)
+
+    # Spans are only a hint and may no longer be right
+    attrs = re.sub(r'\s*spans="[^"]*"', '', attrs)
+    if not ROW_NUM_RE.search(attrs):
+        attrs = ' r="{}"{}'.format(row_num, attrs)
+
+    return '<row{}>{}</row>'.format(attrs, ''.join(new_cells))
+
+
+def _add_styles(styles_xml):
+    """Add the header and date styles used by `_sheet_xml` to a styles.xml part
+
+    Styles that are already present, e.g. from an earlier save, are reused. The
+    part is edited as text so that everything already in it, including namespaces
+    that ElementTree would rename, is kept exactly.
+
+    Args:
+        styles_xml (str): Contents of xl/styles.xml
+
+    Returns:
+        tuple(str, dict): New contents and the ids of the 'header', 'datetime' and 'date' styles
+    """
+    styles_xml, datetime_fmt_id = _get_num_fmt(styles_xml, DATETIME_FORMAT)
+    styles_xml, date_fmt_id = _get_num_fmt(styles_xml, DATE_FORMAT)
+
+    styles_xml, font_id = _get_element(styles_xml, 'fonts', 'font', '<font><b/></font>')
+    styles_xml, border_id = _get_element(
+        styles_xml, 'borders', 'border',
+        '<border><left style="thin"/><right style="thin"/><top style="thin"/>'
+        '<bottom style="thin"/><diagonal/></border>')
+
+    styles = dict()
+    styles_xml, styles['header'] = _get_element(
+        styles_xml, 'cellXfs', 'xf',
+        '<xf numFmtId="0" fontId="{}" fillId="0" borderId="{}" xfId="0" applyFont="1" applyBorder="1" '
+        'applyAlignment="1"><alignment horizontal="center" vertical="top"/></xf>'.format(font_id, border_id))
+    styles_xml, styles['datetime'] = _get_element(
+        styles_xml, 'cellXfs', 'xf',
+        '<xf numFmtId="{}" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'.format(
+            datetime_fmt_id))
+    styles_xml, styles['date'] = _get_element(
+        styles_xml, 'cellXfs', 'xf',
+        '<xf numFmtId="{}" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'.format(
+            date_fmt_id))
+
+    return styles_xml, styles
+
+
+def _get_num_fmt(styles_xml, format_code):
+    """Find or add a number format in styles.xml
+
+    Returns:
+        tuple(str, int): New styles.xml and the numFmtId
+    """
+    for num_fmt in re.findall(r'<numFmt\b[^>]*>', styles_xml):
+        if 'formatCode="{}"'.format(format_code) in num_fmt:
+            return styles_xml, int(re.search(r'numFmtId="(\d+)"', num_fmt).group(1))
+
+    num_fmt_ids = [int(num_fmt_id) for num_fmt_id in re.findall(r'numFmtId="(\d+)"', styles_xml)]
+    num_fmt_id = max([163] + num_fmt_ids) + 1
+
+    if not re.search(r'<numFmts\b', styles_xml):
+        # numFmts has to be the first element of the styleSheet
+        styles_xml = re.sub(r'(<styleSheet\b[^>]*>)', r'\1<numFmts count="0"/>', styles_xml, count=1)
+
+    styles_xml, _ = _get_element(styles_xml, 'numFmts', 'numFmt', '<numFmt numFmtId="{}" formatCode="{}"/>'.format(
+        num_fmt_id, format_code))
+
+    return styles_xml, num_fmt_id
+
+
+def _get_element(styles_xml, section, element, new_element):
+    """Find an element in a section of styles.xml, appending it if not present
+
+    Returns:
+        tuple(str, int): New styles.xml and the position of the element in the section
+    """
+    match = re.search(r'<{0}\b([^>]*?)/>'.format(section), styles_xml)
+    if match is not None:
+        attrs, content = match.group(1), ''
+    else:
+        match = re.search(r'<{0}\b([^>]*)>(.*?)</{0}>'.format(section), styles_xml, re.S)
+        if match is None:
+            raise Exception("No <{}> in styles.xml".format(section))
+
+        attrs, content = match.groups()
+
+    elements = re.findall(r'<{0}\b[^>]*?(?:/>|>.*?</{0}>)'.format(element), content, re.S)
+    if new_element in elements:
+        return styles_xml, elements.index(new_element)
+
+    attrs = re.sub(r'\s*count="\d+"', '', attrs)
+    new_section = '<{0}{1} count="{2}">{3}{4}</{0}>'.format(section, attrs, len(elements) + 1, content, new_element)
+
+    return styles_xml[:match.start()] + new_section + styles_xml[match.end():], len(elements)